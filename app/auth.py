@@ -2,9 +2,10 @@
 import os
 import secrets
 import sqlite3
-import traceback # Added from earlier version
+import time
+import logging
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 from fastapi import Depends, HTTPException, status, Response, Request # Added Request
 from fastapi.security import APIKeyCookie, OAuth2PasswordBearer # Added APIKeyCookie
@@ -14,8 +15,11 @@ from passlib.context import CryptContext
 # Assuming your project structure allows these relative imports
 from . import models # For type hinting if needed (e.g., User model for return types)
 from . import config
+from . import utils
 # Import necessary functions from database.py
-from .database import get_db_connection, generate_secure_token, hash_value as hash_session_token
+from .database import get_db_connection, generate_secure_token, run_in_db_thread, hash_value as hash_session_token
+
+logger = logging.getLogger(__name__)
 
 # Password Hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -31,6 +35,48 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token") # tokenUrl points to you
 # Dependency for getting the session token from the cookie
 cookie_scheme = APIKeyCookie(name=SESSION_COOKIE_NAME, auto_error=False)
 
+# --- Session lookup cache ---
+# Maps a session token HASH (never the raw token) to (expires_at_monotonic, user dict).
+# Entries are short-lived and explicitly invalidated on logout and on account changes that
+# revoke sessions, so a stale entry can outlive a DB-side change by at most the TTL.
+# Only touched from the event loop; lookups run on DB threads but are cached after the await.
+SESSION_USER_CACHE_TTL_SECONDS = 60
+SESSION_USER_CACHE_MAX_ENTRIES = 4096
+_session_user_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+# Bumped on every invalidation. A lookup that was in flight across a bump may have read a row
+# that has since been revoked, so its result is returned but not cached.
+_session_cache_generation = 0
+
+def _cache_session_user(session_token_hashed: str, user: Dict[str, Any]):
+    if len(_session_user_cache) >= SESSION_USER_CACHE_MAX_ENTRIES:
+        # Dicts keep insertion order, so this drops the oldest entry.
+        _session_user_cache.pop(next(iter(_session_user_cache)))
+    _session_user_cache[session_token_hashed] = (time.monotonic() + SESSION_USER_CACHE_TTL_SECONDS, user)
+
+def _get_cached_session_user(session_token_hashed: str) -> Optional[Dict[str, Any]]:
+    cached = _session_user_cache.get(session_token_hashed)
+    if not cached:
+        return None
+    expires_at, user = cached
+    if expires_at < time.monotonic():
+        _session_user_cache.pop(session_token_hashed, None)
+        return None
+    return dict(user)
+
+def invalidate_cached_session(session_token_raw: Optional[str]):
+    """Drops the cached user for a single raw session token (e.g. on logout)."""
+    global _session_cache_generation
+    if session_token_raw:
+        _session_cache_generation += 1
+        _session_user_cache.pop(hash_session_token(session_token_raw), None)
+
+def invalidate_cached_sessions_for_user(user_id: int):
+    """Drops every cached session belonging to `user_id` (e.g. after a password, email or name change)."""
+    global _session_cache_generation
+    _session_cache_generation += 1
+    for token_hash in [h for h, (_, user) in _session_user_cache.items() if user["id"] == user_id]:
+        _session_user_cache.pop(token_hash, None)
+
 
 # --- Password Utilities ---
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -58,7 +104,7 @@ def authenticate_user_from_db(
         A dictionary containing user details if successful, otherwise None.
     """
     if not conn:
-        print("ERROR (auth.authenticate_user_from_db): Database connection is None.")
+        logger.error("authenticate_user_from_db called without a database connection.")
         return None
     
     try:
@@ -72,14 +118,14 @@ def authenticate_user_from_db(
         user_row = cursor.fetchone()
 
         if not user_row:
-            print(f"DEBUG (auth.authenticate_user_from_db): User not found for email: {normalized_email}")
+            logger.debug("Login failed: user not found for email %s", normalized_email)
             return None 
 
         user_data = dict(user_row)
         stored_password_hash = user_data.get("password_hash")
 
         if not stored_password_hash or not verify_password(password, stored_password_hash):
-            print(f"DEBUG (auth.authenticate_user_from_db): Password verification failed for email: {normalized_email}")
+            logger.debug("Login failed: password verification failed for email %s", normalized_email)
             return None
 
         # Return relevant user details, excluding the password hash
@@ -90,12 +136,10 @@ def authenticate_user_from_db(
             "is_active": user_data["is_active"],
         }
     except sqlite3.Error as e:
-        print(f"ERROR (auth.authenticate_user_from_db): Database error - {e}")
-        traceback.print_exc()
+        logger.exception("Database error while authenticating user")
         return None
     except Exception as e: # Catch any other unexpected errors
-        print(f"ERROR (auth.authenticate_user_from_db): Unexpected error - {e}")
-        traceback.print_exc()
+        logger.exception("Unexpected error while authenticating user")
         return None
 
 
@@ -134,17 +178,15 @@ async def create_user_session(response: Response, user_id: int) -> str:
             secure=config.BASE_URL.startswith("https://"), # Secure cookie if served over HTTPS
             path="/"
         )
-        print(f"AUTH: Session cookie '{SESSION_COOKIE_NAME}' set for user_id {user_id}. Expires: {expires_at.isoformat()}")
+        logger.debug("Session cookie set for user_id %s. Expires: %s", user_id, expires_at)
         return session_token_raw # Return the raw token (e.g., for /token response model)
         
     except sqlite3.Error as e:
-        print(f"ERROR (auth.create_user_session): Database error - {e}")
-        traceback.print_exc()
+        logger.exception("Database error while creating session for user_id %s", user_id)
         if conn: conn.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not create user session due to a database issue.")
     except Exception as e:
-        print(f"ERROR (auth.create_user_session): Unexpected error - {e}")
-        traceback.print_exc()
+        logger.exception("Unexpected error while creating session for user_id %s", user_id)
         if conn: conn.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not create user session due to an unexpected server error.")
     finally:
@@ -161,11 +203,23 @@ async def get_user_by_session_token_internal(token_raw: Optional[str]) -> Option
         return None
     
     session_token_hashed = hash_session_token(token_raw) # Hash the raw token for DB lookup
+    cached_user = _get_cached_session_user(session_token_hashed)
+    if cached_user:
+        return cached_user
+
+    # sqlite3 calls block; run the lookup in a worker thread so the event loop keeps serving other clients.
+    generation = _session_cache_generation
+    user = await run_in_db_thread(_fetch_user_by_session_token_hash, session_token_hashed)
+    if user and generation == _session_cache_generation:
+        _cache_session_user(session_token_hashed, user)
+    return dict(user) if user else None
+
+def _fetch_user_by_session_token_hash(session_token_hashed: str) -> Optional[Dict[str, Any]]:
     conn = None
     try:
         conn = get_db_connection() # Get a new connection
         cursor = conn.cursor()
-        now_utc_iso = datetime.now(timezone.utc).isoformat()
+        now_utc_iso = utils.utc_now_iso()
         
         cursor.execute(
             """SELECT u.id, u.name, u.email, u.is_active
@@ -187,12 +241,55 @@ async def get_user_by_session_token_internal(token_raw: Optional[str]) -> Option
         return None
         
     except sqlite3.Error as e:
-        print(f"ERROR (auth.get_user_by_session_token_internal): Database error - {e}")
-        traceback.print_exc()
+        logger.exception("Database error while resolving session token")
         return None
     except Exception as e:
-        print(f"ERROR (auth.get_user_by_session_token_internal): Unexpected error - {e}")
-        traceback.print_exc()
+        logger.exception("Unexpected error while resolving session token")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+async def get_session_participant_by_token(token_raw: Optional[str], session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    WebSocket handshake helper: resolves a RAW session token to its user and, in the same
+    query, whether that user participates in the active session `session_id`. Returns the user dict with an
+    extra `is_participant` flag, or None if the token is invalid.
+    """
+    if not token_raw:
+        return None
+    return await run_in_db_thread(_verify_ws_access, token_raw, session_id)
+
+def _verify_ws_access(token_raw: str, session_id: str) -> Optional[Dict[str, Any]]:
+    session_token_hashed = hash_session_token(token_raw)
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        now_utc_iso = utils.utc_now_iso()
+
+        cursor.execute(
+            """SELECT u.id, u.name, u.email, u.is_active,
+                      EXISTS (SELECT 1 FROM session_participants sp JOIN sessions s ON s.id = sp.session_id
+                              WHERE sp.session_id = ? AND sp.user_id = u.id AND s.is_active = 1) AS is_participant
+               FROM users u JOIN auth_tokens at ON u.id = at.user_id
+               WHERE at.token_hash = ? AND at.token_type = 'session'
+               AND at.expires_at > ? AND at.used_at IS NULL
+            """, (session_id, session_token_hashed, now_utc_iso)
+        )
+        user_row = cursor.fetchone()
+        if not user_row:
+            return None
+
+        return {
+            "id": user_row["id"],
+            "name": user_row["name"],
+            "email": user_row["email"],
+            "is_active": user_row["is_active"],
+            "is_participant": bool(user_row["is_participant"]),
+        }
+    except sqlite3.Error as e:
+        logger.exception("Database error while verifying WebSocket access to session %s", session_id)
         return None
     finally:
         if conn:
@@ -264,7 +361,7 @@ async def get_current_user_bearer(token: str = Depends(oauth2_scheme)) -> Option
     # 3. Extract user identifier (e.g., user_id or sub) from token claims.
     # 4. Fetch user from database based on that identifier.
     # For now, this is a placeholder and returns None.
-    print(f"DEBUG (auth.get_current_user_bearer): Received Bearer token: {token[:15]}...")
+    logger.debug("Bearer token authentication is not implemented; ignoring token.")
     # Example: user_id = my_jwt_decode_function(token).get("sub")
     # user = await fetch_user_from_db_by_id(user_id)
     # return user
@@ -283,7 +380,7 @@ async def logout_user(response: Response, session_token_raw: Optional[str]):
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
-            now_utc_iso = datetime.now(timezone.utc).isoformat()
+            now_utc_iso = utils.utc_now_iso()
             # Mark the specific token as used by setting used_at and making it expire immediately
             cursor.execute(
                 """UPDATE auth_tokens 
@@ -292,19 +389,19 @@ async def logout_user(response: Response, session_token_raw: Optional[str]):
                 (now_utc_iso, now_utc_iso, session_token_hashed)
             )
             conn.commit()
-            print(f"AUTH: Session token (hash starting {session_token_hashed[:10]}...) marked as used/expired in DB for logout.")
+            logger.debug("Session token (hash starting %s...) marked as used/expired for logout.", session_token_hashed[:10])
         except sqlite3.Error as e:
-            print(f"ERROR (auth.logout_user): Database error invalidating token - {e}")
-            traceback.print_exc()
+            logger.exception("Database error invalidating session token on logout")
             if conn: conn.rollback()
             # Proceed with cookie deletion even if DB update fails
         except Exception as e:
-            print(f"ERROR (auth.logout_user): Unexpected error invalidating token - {e}")
-            traceback.print_exc()
+            logger.exception("Unexpected error invalidating session token on logout")
             if conn: conn.rollback()
         finally:
             if conn:
                 conn.close()
+        # After the token is revoked in the DB, so no lookup can re-cache it.
+        invalidate_cached_session(session_token_raw)
 
     # Always attempt to delete the cookie from the browser
     response.delete_cookie(
@@ -314,4 +411,4 @@ async def logout_user(response: Response, session_token_raw: Optional[str]):
         samesite="Lax", # Match samesite attribute
         path="/"
     )
-    print(f"AUTH: Session cookie '{SESSION_COOKIE_NAME}' cleared from browser response.")
+    logger.debug("Session cookie cleared from browser response.")
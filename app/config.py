@@ -1,5 +1,6 @@
 import os
 import sys
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import Optional, List, Dict, Any
@@ -8,24 +9,30 @@ import json
 # Load environment variables from a .env file if it exists
 load_dotenv()
 
+# Imported before logging_utils.setup_logging() runs: until then only WARNING and above reach
+# the console (via logging's last-resort handler), so the DEBUG summary below costs nothing.
+logger = logging.getLogger(__name__)
+
 # --- Application Base URL ---
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8001")
 
 CSRF_PROTECT_SECRET_KEY = os.getenv("CSRF_PROTECT_SECRET_KEY")
 
 DEBUG_MODE = os.getenv("DEBUG_MODE", "False").lower() in ('true', '1', 't', 'yes')
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if DEBUG_MODE else "INFO").upper()
+LOG_QUEUE_MAX_SIZE = int(os.getenv("LOG_QUEUE_MAX_SIZE", 10000))
 DATABASE_PATH = Path(os.getenv("DATABASE_PATH","./tesseracs_chat.db"))
 
 # --- Secret Key for Encryption ---
 APP_SECRET_KEY = os.getenv("APP_SECRET_KEY")
 if not APP_SECRET_KEY:
-    print("CRITICAL WARNING: APP_SECRET_KEY is not set in the environment. "
-          "User-specific API keys will not be securely stored. This is a major security risk. "
-          "Please set this environment variable to a strong, random string. "
-          "For development, the application will proceed, but encryption will be disabled if this key is missing.")
+    logger.critical("APP_SECRET_KEY is not set in the environment. "
+                    "User-specific API keys will not be securely stored. This is a major security risk. "
+                    "Please set this environment variable to a strong, random string. "
+                    "For development, the application will proceed, but encryption will be disabled if this key is missing.")
 elif len(APP_SECRET_KEY) < 32:
-    print(f"WARNING: APP_SECRET_KEY is set but may not be strong enough (length: {len(APP_SECRET_KEY)}). "
-          "Ensure it's a Fernet-compatible key (32 url-safe base64-encoded bytes).")
+    logger.warning("APP_SECRET_KEY is set but may not be strong enough (length: %d). "
+                   "Ensure it's a Fernet-compatible key (32 url-safe base64-encoded bytes).", len(APP_SECRET_KEY))
 
 
 # --- LLM Configuration ---
@@ -77,17 +84,17 @@ LLM_PROVIDERS: Dict[str, Dict[str, Any]] = {
 }
 
 # --- Provider Characteristics ---
-PROVIDERS_TYPICALLY_USING_API_KEYS = {
+PROVIDERS_TYPICALLY_USING_API_KEYS = frozenset({
     "google_gemini",
     "anthropic_claude",
     "openai_compatible_server"
-}
+})
 
-PROVIDERS_ALLOWING_USER_KEYS_EVEN_IF_SYSTEM_CONFIGURED = {
+PROVIDERS_ALLOWING_USER_KEYS_EVEN_IF_SYSTEM_CONFIGURED = frozenset({
     "google_gemini",
     "anthropic_claude",
     "openai_compatible_server"
-}
+})
 
 
 # --- Helper function to get a provider's configuration ---
@@ -131,18 +138,25 @@ else:
         STATIC_DIR = current_working_dir / "static"
     
     if not STATIC_DIR or not STATIC_DIR.is_dir(): 
-        print(f"CRITICAL ERROR: Static directory not found. Checked standard locations relative to {APP_DIR}, {PROJECT_ROOT}, and {current_working_dir}. Application may not serve frontend assets.")
+        logger.critical("Static directory not found. Checked standard locations relative to %s, %s, and %s. Application may not serve frontend assets.", APP_DIR, PROJECT_ROOT, current_working_dir)
 
 # --- Docker Configuration ---
 LANGUAGES_CONFIG_PATH = APP_DIR / "static" / "languages.json"
 try:
     with open(LANGUAGES_CONFIG_PATH, "r", encoding="utf-8") as f:
         SUPPORTED_LANGUAGES = json.load(f)
-    print(f"DEBUG config: Successfully loaded {len(SUPPORTED_LANGUAGES)} languages from {LANGUAGES_CONFIG_PATH}")
+    logger.debug("Successfully loaded %d languages from %s", len(SUPPORTED_LANGUAGES), LANGUAGES_CONFIG_PATH)
 except Exception as e:
-    print(f"CRITICAL ERROR: Could not load or parse languages.json: {e}")
+    logger.critical("Could not load or parse languages.json: %s", e)
     SUPPORTED_LANGUAGES = {}
 
+# Maximum number of per-session conversation memories kept in process; colder ones are rebuilt from the DB.
+MEMORY_LRU_SIZE = int(os.getenv("MEMORY_LRU_SIZE", 5000))
+
+# Upper bounds for inbound WebSocket data; keep WS_MAX_MESSAGE_SIZE in line with uvicorn's --ws-max-size.
+WS_MAX_MESSAGE_SIZE = int(os.getenv("WS_MAX_MESSAGE_SIZE", 2 * 1024 * 1024))
+MAX_CODE_CONTENT_LENGTH = int(os.getenv("MAX_CODE_CONTENT_LENGTH", 1_000_000))
+
 DOCKER_TIMEOUT_SECONDS = int(os.getenv("DOCKER_TIMEOUT_SECONDS", 30))
 DOCKER_MEM_LIMIT = os.getenv("DOCKER_MEM_LIMIT", "128m")
 
@@ -162,24 +176,22 @@ MAIL_CONFIG = {
 }
 
 if not all([MAIL_CONFIG["MAIL_USERNAME"], MAIL_CONFIG["MAIL_PASSWORD"], MAIL_CONFIG["MAIL_SERVER"], MAIL_CONFIG["MAIL_FROM"]]):
-    print("WARNING: Essential email configuration (USERNAME, PASSWORD, SERVER, FROM) missing in .env file. Email functionalities will likely fail.")
+    logger.warning("Essential email configuration (USERNAME, PASSWORD, SERVER, FROM) missing in .env file. Email functionalities will likely fail.")
 
 # --- Rate Limiting Configuration ---
 FORGOT_PASSWORD_ATTEMPT_LIMIT = int(os.getenv("FORGOT_PASSWORD_ATTEMPT_LIMIT", 3))
 FORGOT_PASSWORD_ATTEMPT_WINDOW_HOURS = int(os.getenv("FORGOT_PASSWORD_ATTEMPT_WINDOW_HOURS", 24))
 
 # --- Debug Logging for Configuration ---
-print(f"DEBUG config: Application DEBUG_MODE: {DEBUG_MODE}")
-print(f"DEBUG config: Application BASE_URL is set to: {BASE_URL}")
-if STATIC_DIR:
-    print(f"DEBUG config: Static files directory resolved to: {STATIC_DIR.resolve()}")
-else:
-     print("DEBUG config: Static files directory NOT RESOLVED.")
-print(f"DEBUG config: Email VALIDATE_CERTS: {MAIL_CONFIG['VALIDATE_CERTS']}, SSL_TLS: {MAIL_CONFIG['MAIL_SSL_TLS']}, STARTTLS: {MAIL_CONFIG['MAIL_STARTTLS']}")
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("Application DEBUG_MODE: %s", DEBUG_MODE)
+    logger.debug("Application BASE_URL is set to: %s", BASE_URL)
+    if STATIC_DIR:
+        logger.debug("Static files directory resolved to: %s", STATIC_DIR.resolve())
+    else:
+        logger.debug("Static files directory NOT RESOLVED.")
+    logger.debug("Email VALIDATE_CERTS: %s, SSL_TLS: %s, STARTTLS: %s",
+                 MAIL_CONFIG['VALIDATE_CERTS'], MAIL_CONFIG['MAIL_SSL_TLS'], MAIL_CONFIG['MAIL_STARTTLS'])
 
 if not CSRF_PROTECT_SECRET_KEY:
-     print("WARNING config: CSRF_PROTECT_SECRET_KEY is not set in environment. main.py will use a fallback (insecure for production).")
- 
-print("-" * 50)
-print(f"DEBUG: APP_SECRET_KEY loaded in config.py: {APP_SECRET_KEY}")
-print("-" * 50)
+    logger.warning("CSRF_PROTECT_SECRET_KEY is not set in environment. main.py will use a fallback (insecure for production).")
@@ -1,19 +1,158 @@
 import sqlite3
 import os
+import logging
+import queue
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import hashlib
 import secrets
 import datetime
-from typing import Dict,List,Any
+from contextlib import contextmanager
+from typing import Dict,List,Any,Callable,Iterator,Optional,Tuple,TypeVar
+
+logger = logging.getLogger(__name__)
 
 DATABASE_NAME = "tesseracs_chat.db"
 DATABASE_PATH = Path("/data") / DATABASE_NAME
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+# Per-connection cache of prepared statements. Pooled connections live for the whole process,
+# so hot statements are prepared once per connection instead of once per request.
+DB_CACHED_STATEMENTS = 256
+DB_MMAP_SIZE = 256 * 1024 * 1024
+# Commits only trigger a checkpoint once the WAL holds this many pages; a background task
+# checkpoints every DB_WAL_CHECKPOINT_INTERVAL_SECONDS so that rarely has to happen inline.
+DB_WAL_AUTOCHECKPOINT_PAGES = 10000
+DB_WAL_CHECKPOINT_INTERVAL_SECONDS = 60
+
+# --- Hot statements shared across modules ---
+# Keeping the exact SQL text in one place guarantees every caller hits the same cached statement.
+SQL_CHECK_SESSION_PARTICIPANT = "SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?"
+SQL_FETCH_USER_LLM_SETTINGS = "SELECT selected_llm_provider_id, selected_llm_model_id, user_llm_api_key_encrypted, selected_llm_base_url FROM users WHERE id = ?"
+# Active session plus the caller's membership in one lookup; is_participant distinguishes 403 from 404.
+SQL_SELECT_ACTIVE_SESSION_ACCESS = """SELECT s.id, s.name, sp.user_id IS NOT NULL AS is_participant
+    FROM sessions s LEFT JOIN session_participants sp ON sp.session_id = s.id AND sp.user_id = ?
+    WHERE s.id = ? AND s.is_active = 1"""
+# Messages the user has not hidden, gated on membership in one statement: no rows means the user
+# is not a participant, a single row with a NULL id means a participant with nothing to show.
+# Pages are keyed on (timestamp, id): timestamps only have one-second resolution, so rows sharing
+# the last timestamp of a page are told apart by id. A NULL since_id means "strictly after since".
+# Params: (since timestamp or None, since, since, since_id or None, session_id, user_id, limit or -1 for no limit).
+SQL_SELECT_VISIBLE_MESSAGES_FOR_PARTICIPANT = """SELECT m.* FROM session_participants sp
+    LEFT JOIN chat_messages m ON m.session_id = sp.session_id
+        AND (? IS NULL OR m.timestamp > ? OR (m.timestamp = ? AND m.id > ?))
+        AND NOT EXISTS (SELECT 1 FROM hidden_messages h WHERE h.message_id = m.id AND h.user_id = sp.user_id)
+    WHERE sp.session_id = ? AND sp.user_id = ?
+    ORDER BY m.timestamp ASC, m.id ASC
+    LIMIT ?"""
+SQL_UPDATE_SESSION_LAST_ACCESSED = "UPDATE sessions SET last_accessed_at = ? WHERE id = ?"
+SQL_INSERT_USER_CHAT_MESSAGE = """INSERT INTO chat_messages (session_id, user_id, sender_name, sender_type, content, turn_id, reply_to_message_id)
+    VALUES (?, ?, ?, 'user', ?, ?, ?)
+    RETURNING *"""
+SQL_INSERT_AI_CHAT_MESSAGE = """INSERT INTO chat_messages (session_id, user_id, sender_name, sender_type, content, turn_id, reply_to_message_id, prompting_user_id, project_id)
+    VALUES (?, ?, 'AI', 'ai', ?, ?, ?, ?, ?)"""
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A sqlite3 connection whose close() hands it back to the pool instead of closing it,
+    so existing `conn.close()` call sites keep working unchanged.
+    """
+    _pool: "ConnectionPool" = None
+    _checked_out: bool = False
+
+    def close(self):
+        if self._checked_out:
+            self._checked_out = False
+            self._pool.release(self)
+
+    def close_for_real(self):
+        super().close()
+
+class ConnectionPool:
+    """
+    A small thread-safe pool of long-lived sqlite3 connections. Connections are opened with
+    check_same_thread=False because handlers hand them to worker threads via asyncio.to_thread;
+    the pool guarantees only one caller uses a connection at a time.
+    """
+    def __init__(self, database_path: Path, size: int):
+        self.database_path = database_path
+        self.size = size
+        self._idle: "queue.LifoQueue[PooledConnection]" = queue.LifoQueue(maxsize=size)
+
+    def _open(self) -> PooledConnection:
+        conn = sqlite3.connect(
+            self.database_path, factory=PooledConnection, check_same_thread=False,
+            cached_statements=DB_CACHED_STATEMENTS
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON;")
+        # Per-connection settings; they persist because pooled connections are reused.
+        # In WAL mode (set once on the file by init_db) NORMAL sync only fsyncs at checkpoints.
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA cache_size = -65536;")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE};")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {DB_WAL_AUTOCHECKPOINT_PAGES};")
+        conn._pool = self
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        conn._checked_out = True
+        return conn
+
+    def release(self, conn: PooledConnection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close_for_real()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close_for_real()
+            except queue.Empty:
+                break
+
+_connection_pool = ConnectionPool(DATABASE_PATH, DB_POOL_SIZE)
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+    return _connection_pool.acquire()
+
+@contextmanager
+def get_conn() -> Iterator[PooledConnection]:
+    """Checks a connection out of the pool for the duration of a `with` block."""
+    conn = _connection_pool.acquire()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def db_connection() -> Iterator[PooledConnection]:
+    """FastAPI dependency yielding a pooled connection that is returned after the response."""
+    with get_conn() as conn:
+        yield conn
+
+# Database work runs on its own threads, one per pooled connection, so bursts never open
+# connections beyond the pool and never queue behind Docker or git work on the default executor.
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="sqlite")
+
+_T = TypeVar("_T")
+
+async def run_in_db_thread(func: Callable[..., _T], *args: Any) -> _T:
+    """Like asyncio.to_thread, but on the database executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args))
+
+def close_db_pool():
+    _db_executor.shutdown(wait=True)
+    _connection_pool.close_all()
 
 def get_projects_by_ids(conn, project_ids: List[str]) -> List[Dict[str, Any]]:
     """
@@ -31,9 +170,14 @@ def get_projects_by_ids(conn, project_ids: List[str]) -> List[Dict[str, Any]]:
     return [dict(row) for row in cursor.fetchall()]
 
 def init_db():
-    print(f"Initializing and migrating database schema at {DATABASE_PATH}...")
+    logger.info("Initializing and migrating database schema at %s...", DATABASE_PATH)
     conn = get_db_connection()
     cursor = conn.cursor()
+
+    # journal_mode is stored in the database file, so switching once here covers every connection.
+    journal_mode = cursor.execute("PRAGMA journal_mode = WAL;").fetchone()[0]
+    if journal_mode.lower() != "wal":
+        logger.warning("Could not enable WAL journal mode; database is using '%s'.", journal_mode)
     
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS hidden_messages (
@@ -134,7 +278,7 @@ def init_db():
     cursor.execute("PRAGMA table_info(chat_messages)")
     columns = [column['name'] for column in cursor.fetchall()]
     if 'project_id' not in columns:
-        print("Migrating 'chat_messages' table: Adding 'project_id' column...")
+        logger.info("Migrating 'chat_messages' table: Adding 'project_id' column...")
         cursor.execute("""
             ALTER TABLE chat_messages
             ADD COLUMN project_id TEXT REFERENCES projects(id) ON DELETE SET NULL
@@ -142,20 +286,32 @@ def init_db():
 
     cursor.execute("DROP TABLE IF EXISTS message_files;")
 
-    print("All table structures are up to date.")
+    logger.info("All table structures are up to date.")
     conn.commit()
 
-    print("Creating/verifying indexes...")
+    logger.info("Creating/verifying indexes...")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_auth_tokens_token_hash ON auth_tokens (token_hash);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_host_user_id ON sessions (host_user_id);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages (session_id);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_session_id ON projects (session_id);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_password_reset_attempts_email_time ON password_reset_attempts (email, attempted_at);")
+    # The personal sessions listing starts from the user's participant rows; this index covers
+    # that lookup (user_id, is_hidden) and hands back session_id without touching the table.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_participants_user ON session_participants (user_id, is_hidden, session_id);")
+    # Membership checks on (session_id, user_id) and lookups by sessions.id are already served by
+    # the tables' primary keys. The joinable-sessions listing and the public/protected name-conflict
+    # check only ever look at active shared sessions, so a partial index keeps that set small.
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_active_shared ON sessions (name, created_at)
+        WHERE is_active = 1 AND access_level IN ('public', 'protected');
+    """)
     
     conn.commit()
+    # Refresh planner statistics for any tables whose indexes changed.
+    cursor.execute("PRAGMA optimize;")
     conn.close()
-    print("Database initialization and migration check complete.")
+    logger.info("Database initialization and migration check complete.")
 
 def hash_value(value: str) -> str:
     return hashlib.sha256(value.encode('utf-8')).hexdigest()
@@ -166,9 +322,11 @@ def generate_secure_token(length: int = 32) -> str:
 # (All other functions like get_code_execution_results, save_edited_code_content, etc., can be kept as they are for now)
 # We will copy the existing functions from your file to ensure nothing is lost.
 
-def get_code_execution_results(session_id):
-    # This function remains unchanged for now
-    conn = get_db_connection()
+def get_code_execution_results(session_id, conn=None):
+    # Reuses the caller's connection when given one; otherwise opens and closes its own.
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("""
@@ -182,23 +340,35 @@ def get_code_execution_results(session_id):
         results = [dict(row) for row in cursor.fetchall()]
         return results
     finally:
-        conn.close()
+        if owns_conn:
+            conn.close()
 
-def get_edited_code_blocks(session_id: str) -> dict:
-    # This function remains unchanged for now
-    conn = get_db_connection()
+def get_edited_code_blocks(session_id: str, conn=None) -> dict:
+    # Reuses the caller's connection when given one; otherwise opens and closes its own.
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection()
     cursor = conn.cursor()
     edited_blocks = {}
     try:
+        # Snapshot queued edits before the query: an entry only leaves the queue once its batch has
+        # committed, so a block is then in the snapshot, in the rows, or both.
+        pending_edits = [(code_block_id, code_content)
+                         for (pending_session_id, code_block_id), (_, _, code_content) in list(_pending_edited_blocks.items())
+                         if pending_session_id == session_id]
         cursor.execute(
             "SELECT code_block_id, edited_content FROM edited_code_blocks WHERE session_id = ?",
             (session_id,)
         )
         for row in cursor.fetchall():
             edited_blocks[row['code_block_id']] = row['edited_content']
+        # Queued edits are newer than anything saved.
+        for code_block_id, code_content in pending_edits:
+            edited_blocks[code_block_id] = code_content
         return edited_blocks
     finally:
-        conn.close()
+        if owns_conn:
+            conn.close()
 
 def delete_edited_code_block(session_id, code_block_id):
     # This function remains unchanged for now
@@ -213,7 +383,7 @@ def delete_edited_code_block(session_id, code_block_id):
         return True
     except Exception as e:
         conn.rollback()
-        print(f"Error deleting edited code block for {code_block_id}: {e}")
+        logger.error("Error deleting edited code block for %s: %s", code_block_id, e)
         return False
     finally:
         conn.close()
@@ -251,4 +421,139 @@ def save_edited_code_content(session_id, code_block_id, language, code_content):
         conn.commit()
         return True
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# --- Coalescing writer for edited code blocks ---
+# Editors send `save_code_content` frequently while a user types. Instead of one thread hop and
+# one commit per frame, the latest content per (session_id, code_block_id) is kept in memory and
+# a single background task writes everything pending in one transaction.
+EDITED_CODE_FLUSH_DELAY_SECONDS = 0.05
+# A failed batch stays queued and is retried after this pause.
+EDITED_CODE_RETRY_DELAY_SECONDS = 1.0
+
+# (session_id, code_block_id) -> (version, language, content). An entry stays here until a batch
+# holding that version has committed, so readers always see either the queued or the saved edit.
+_pending_edited_blocks: Dict[Tuple[str, str], Tuple[int, str, str]] = {}
+_edited_code_version = 0
+_edited_code_writer_wakeup: Optional[asyncio.Event] = None
+_edited_code_writer_task: Optional[asyncio.Task] = None
+# The batch write currently running on the DB executor, if any.
+_edited_code_flush: Optional[asyncio.Future] = None
+
+def queue_edited_code_content(session_id, code_block_id, language, code_content):
+    """Queues an edited code block for the background writer; later saves of the same block replace earlier ones."""
+    global _edited_code_version
+    _edited_code_version += 1
+    _pending_edited_blocks[(session_id, code_block_id)] = (_edited_code_version, language, code_content)
+    if _edited_code_writer_wakeup:
+        _edited_code_writer_wakeup.set()
+
+async def discard_pending_edited_code(session_id, code_block_id=None):
+    """
+    Drops queued edits for a session (or a single block) so they are not written after a delete.
+    Also waits for a batch that is already being written, so the caller's DELETE lands after it
+    instead of being undone by it.
+    """
+    for key in [k for k in _pending_edited_blocks if k[0] == session_id and (code_block_id is None or k[1] == code_block_id)]:
+        _pending_edited_blocks.pop(key, None)
+    if _edited_code_flush is not None:
+        await asyncio.wait({_edited_code_flush})
+
+def _save_edited_code_batch(batch: List[Tuple[str, str, str, str]]):
+    conn = get_db_connection()
+    try:
+        conn.executemany("""
+            INSERT OR REPLACE INTO edited_code_blocks 
+            (session_id, code_block_id, language, edited_content, edited_at)
+            VALUES (?, ?, ?, ?, datetime('now', 'utc'))
+        """, batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _finish_edited_code_flush(written: Dict[Tuple[str, str], int], flush: asyncio.Future):
+    global _edited_code_flush
+    _edited_code_flush = None
+    if flush.cancelled() or flush.exception() is not None:
+        logger.error("Error saving %d edited code block(s): %s", len(written), None if flush.cancelled() else flush.exception())
+        return
+    # Blocks edited again (or discarded and re-queued) while the batch ran keep their newer entry.
+    for key, version in written.items():
+        pending = _pending_edited_blocks.get(key)
+        if pending is not None and pending[0] == version:
+            del _pending_edited_blocks[key]
+
+async def flush_edited_code_content() -> bool:
+    """Writes everything queued in one transaction. Returns False if the write failed; the edits then stay queued."""
+    global _edited_code_flush
+    while _edited_code_flush is not None:
+        await asyncio.wait({_edited_code_flush})
+    if not _pending_edited_blocks:
+        return True
+    written = {key: version for key, (version, _, _) in _pending_edited_blocks.items()}
+    batch = [(session_id, code_block_id, language, code_content)
+             for (session_id, code_block_id), (_, language, code_content) in _pending_edited_blocks.items()]
+    # A task of its own, so cancelling a caller (e.g. the writer loop at shutdown) never abandons a
+    # write halfway; the done callback updates the queue whoever is still waiting.
+    flush = asyncio.ensure_future(run_in_db_thread(_save_edited_code_batch, batch))
+    flush.add_done_callback(functools.partial(_finish_edited_code_flush, written))
+    _edited_code_flush = flush
+    await asyncio.wait({flush})
+    return not flush.cancelled() and flush.exception() is None
+
+async def _edited_code_writer_loop():
+    while True:
+        await _edited_code_writer_wakeup.wait()
+        _edited_code_writer_wakeup.clear()
+        # Give rapid-fire saves a moment to collapse into the same batch.
+        await asyncio.sleep(EDITED_CODE_FLUSH_DELAY_SECONDS)
+        if not await flush_edited_code_content():
+            await asyncio.sleep(EDITED_CODE_RETRY_DELAY_SECONDS)
+            _edited_code_writer_wakeup.set()
+
+def start_edited_code_writer():
+    global _edited_code_writer_wakeup, _edited_code_writer_task
+    if _edited_code_writer_task is None or _edited_code_writer_task.done():
+        _edited_code_writer_wakeup = asyncio.Event()
+        _edited_code_writer_task = asyncio.create_task(_edited_code_writer_loop())
+
+async def stop_edited_code_writer():
+    global _edited_code_writer_task
+    writer_task = _edited_code_writer_task
+    if writer_task:
+        _edited_code_writer_task = None
+        writer_task.cancel()
+        try:
+            await writer_task
+        except asyncio.CancelledError:
+            pass
+    # Waits for a batch still in flight before writing what is left, all before the pool closes.
+    await flush_edited_code_content()
+
+# --- Periodic WAL checkpoints ---
+_wal_checkpoint_task: Optional[asyncio.Task] = None
+
+def _checkpoint_wal_sync():
+    # PASSIVE never waits on readers or blocks writers; frames still in use are picked up next round.
+    with get_conn() as conn:
+        busy, wal_pages, checkpointed_pages = conn.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchone()
+    logger.debug("WAL checkpoint: busy=%s, %s/%s pages checkpointed.", busy, checkpointed_pages, wal_pages)
+
+async def _wal_checkpoint_loop():
+    while True:
+        await asyncio.sleep(DB_WAL_CHECKPOINT_INTERVAL_SECONDS)
+        try:
+            await run_in_db_thread(_checkpoint_wal_sync)
+        except sqlite3.Error as e:
+            logger.warning("Background WAL checkpoint failed: %s", e)
+
+def start_wal_checkpointer():
+    global _wal_checkpoint_task
+    if _wal_checkpoint_task is None or _wal_checkpoint_task.done():
+        _wal_checkpoint_task = asyncio.create_task(_wal_checkpoint_loop())
+
+def stop_wal_checkpointer():
+    global _wal_checkpoint_task
+    if _wal_checkpoint_task:
+        _wal_checkpoint_task.cancel()
+        _wal_checkpoint_task = None
@@ -1,37 +1,51 @@
 import asyncio
 import docker
+import functools
+import orjson
 import os
 import shutil
 import socket
-import traceback
+import logging
 from pathlib import Path
 from typing import Dict, Any, List
 from multiprocessing import Process, Pipe
 from multiprocessing.connection import Connection
 
 from fastapi import WebSocket
+from starlette.websockets import WebSocketState
 from docker.errors import DockerException
 
 from . import config, state
-from .utils import send_ws_message
+from .utils import send_ws_message, get_ws_writer_queue
 from .docker_worker import start_worker, STREAM_END_SIGNAL, ERROR_PREFIX
 
+# How many output chunks may be sent between two checks of the client's connection state.
+CODE_OUTPUT_STATE_CHECK_INTERVAL = 16
+# A client whose writer queue holds this many frames is not keeping up; further output is held
+# back and sent coalesced once the queue drains, instead of growing the queue without bound.
+CODE_OUTPUT_MAX_QUEUED_FRAMES = 256
+# Held-back output beyond this many characters is not streamed at all; the client still gets
+# the full output in code_finished.
+CODE_OUTPUT_MAX_BACKLOG_CHARS = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
 worker_process: Process | None = None
 parent_conn: Connection | None = None
 
 def start_docker_worker():
     global worker_process, parent_conn
     if worker_process is None or not worker_process.is_alive():
-        print("DOCKER_UTILS: Starting Docker worker process...")
+        logger.info("Starting Docker worker process...")
         parent_conn, child_conn = Pipe()
         worker_process = Process(target=start_worker, args=(child_conn,))
         worker_process.start()
         child_conn.close()
-        print(f"DOCKER_UTILS: Worker process started with PID {worker_process.pid}.")
+        logger.info("Docker worker process started with PID %s.", worker_process.pid)
 
 def shutdown_docker_worker():
     global worker_process, parent_conn
-    print("DOCKER_UTILS: Shutting down Docker worker process...")
+    logger.info("Shutting down Docker worker process...")
     if parent_conn:
         try:
             parent_conn.send("EXIT")
@@ -42,15 +56,15 @@ def shutdown_docker_worker():
         if worker_process.is_alive():
             worker_process.terminate()
             worker_process.join()
-    print("DOCKER_UTILS: Worker process shut down.")
+    logger.info("Docker worker process shut down.")
 
 docker_client = None
 try:
     docker_client = docker.from_env()
     docker_client.ping()
-    print("✅ Connected to Docker daemon.")
+    logger.info("Connected to Docker daemon.")
 except DockerException as e:
-    print(f"❌ Could not connect to Docker daemon: {e}")
+    logger.error("Could not connect to Docker daemon: %s", e)
     docker_client = None
 
 async def run_code_in_docker(websocket: WebSocket, client_id: str, project_id: str,
@@ -74,7 +88,7 @@ async def run_code_in_docker(websocket: WebSocket, client_id: str, project_id: s
             data = parent_conn.recv()
             queue.put_nowait(data)
         except Exception as e:
-            print(f"DOCKER_UTILS: Error reading from pipe: {e}")
+            logger.error("Error reading from Docker worker pipe: %s", e)
             queue.put_nowait(STREAM_END_SIGNAL)
             
     pipe_fileno = parent_conn.fileno()
@@ -84,6 +98,34 @@ async def run_code_in_docker(websocket: WebSocket, client_id: str, project_id: s
     exit_code = -1
     error_message = None
 
+    # Output chunks arrive per line/read, so the chunk branch below is the hot path of a run.
+    # Bind the lookups once and only re-check the connection state every few chunks; a failed
+    # send also marks the client as gone. Output is still collected for the caller either way.
+    # Session sockets have a single writer task; frames go through its queue when there is one.
+    writer_queue = get_ws_writer_queue(websocket)
+    send_text = websocket.send_text
+    dumps = orjson.dumps
+    connected = WebSocketState.CONNECTED
+    check_mask = CODE_OUTPUT_STATE_CHECK_INTERVAL - 1
+    chunks_sent = 0
+    client_gone = False
+    # Output held back while the writer queue is full, as [stream, [data, ...]] runs per stream.
+    backlog: List[list] = []
+    backlog_chars = 0
+
+    def output_frame(stream, payload: str) -> bytes:
+        return dumps({
+            "type": "code_output",
+            "payload": {"project_id": project_id, "stream": stream, "data": payload},
+        })
+
+    def flush_backlog():
+        nonlocal backlog_chars
+        for stream, parts in backlog:
+            writer_queue.put_nowait(output_frame(stream, "".join(parts)))
+        backlog.clear()
+        backlog_chars = 0
+
     try:
         await loop.run_in_executor(None, parent_conn.send, job_payload)
 
@@ -105,28 +147,55 @@ async def run_code_in_docker(websocket: WebSocket, client_id: str, project_id: s
                         async with state.running_containers_lock:
                             state.running_containers[project_id] = {"container": container_obj, "client_id": client_id}
                     except Exception as e:
-                         print(f"DOCKER_UTILS: Could not get container object for {container_id}: {e}")
+                         logger.warning("Could not get container object for %s: %s", container_id, e)
             elif msg_type == "waiting_for_input":
                 await send_ws_message(websocket, "code_waiting_input", {"project_id": project_id})
             elif msg_type == "chunk":
                 payload = data.get("data", "")
                 full_output_parts.append(payload)
-                await send_ws_message(websocket, "code_output", {
-                    "project_id": project_id,
-                    "stream": data.get("stream"),
-                    "data": payload
-                })
+                if client_gone:
+                    continue
+                if not (chunks_sent & check_mask) and websocket.client_state is not connected:
+                    client_gone = True
+                    continue
+                chunks_sent += 1
+                stream = data.get("stream")
+                try:
+                    if writer_queue is None:
+                        # A direct send waits for the socket, which already paces the output.
+                        await send_text(output_frame(stream, payload).decode())
+                    elif backlog or writer_queue.qsize() >= CODE_OUTPUT_MAX_QUEUED_FRAMES:
+                        if backlog and backlog[-1][0] == stream:
+                            backlog[-1][1].append(payload)
+                        else:
+                            backlog.append([stream, [payload]])
+                        backlog_chars += len(payload)
+                        if backlog_chars > CODE_OUTPUT_MAX_BACKLOG_CHARS:
+                            logger.debug("Client %s is not keeping up with the output of project %s; stopped streaming it.", client_id, project_id)
+                            backlog.clear()
+                            client_gone = True
+                        elif writer_queue.qsize() < CODE_OUTPUT_MAX_QUEUED_FRAMES:
+                            flush_backlog()
+                    else:
+                        writer_queue.put_nowait(output_frame(stream, payload))
+                except Exception as e:
+                    logger.debug("Stopped streaming output of project %s to client %s: %s", project_id, client_id, e)
+                    client_gone = True
             elif msg_type == "exit_code":
                 exit_code = data.get("exit_code", -1)
 
     except Exception as e:
         error_message = f"An unexpected error occurred in run_code_in_docker: {e}"
-        traceback.print_exc()
+        logger.exception("Unexpected error running project %s in Docker", project_id)
     finally:
         loop.remove_reader(pipe_fileno)
         async with state.running_containers_lock:
             state.running_containers.pop(project_id, None)
 
+    # Output still held back goes out ahead of the caller's code_finished.
+    if backlog and not client_gone:
+        flush_backlog()
+
     return exit_code, "".join(full_output_parts), error_message
 
 async def send_input_to_container(project_id: str, user_input: str):
@@ -137,7 +206,7 @@ async def send_input_to_container(project_id: str, user_input: str):
         await loop.run_in_executor(None, parent_conn.send, {"type": "input", "data": user_input})
         return True
     except Exception as e:
-        print(f"DOCKER_UTILS: Error sending input via pipe: {e}")
+        logger.error("Error sending input to Docker worker pipe: %s", e)
         return False
 
 async def stop_container(project_id: str):
@@ -151,7 +220,7 @@ async def stop_container(project_id: str):
         except docker.errors.NotFound:
             pass
         except Exception as e:
-            print(f"[Cleanup-{project_id}] Error during container cleanup: {e}")
+            logger.warning("[Cleanup-%s] Error during container cleanup: %s", project_id, e)
     
     async with state.running_previews_lock:
         preview_info = state.running_previews.pop(project_id, None)
@@ -163,13 +232,19 @@ async def stop_container(project_id: str):
             state.preview_routes.pop(project_id, None)
         except docker.errors.NotFound: pass 
         except Exception as e:
-            print(f"[Cleanup-{project_id}] Error during preview container cleanup: {e}")
+            logger.warning("[Cleanup-%s] Error during preview container cleanup: %s", project_id, e)
+
+@functools.lru_cache(maxsize=1)
+def _get_own_container_attrs() -> Dict[str, Any]:
+    """
+    Inspects the container this app runs in. Its mounts and networks are fixed for the life of
+    the process, so the Docker API round trip is made once; failures raise and are not cached.
+    """
+    return docker_client.containers.get(socket.gethostname()).attrs
 
 def _get_host_path_from_container_path(container_path: str) -> str:
     try:
-        container_id = socket.gethostname()
-        container = docker_client.containers.get(container_id)
-        mounts = container.attrs['Mounts']
+        mounts = _get_own_container_attrs()['Mounts']
         for mount in sorted(mounts, key=lambda m: len(m['Destination']), reverse=True):
             container_mount_point = mount['Destination']
             host_mount_point = mount['Source']
@@ -178,18 +253,16 @@ def _get_host_path_from_container_path(container_path: str) -> str:
                 host_path = os.path.join(host_mount_point, relative_path)
                 return host_path
     except Exception as e:
-        print(f"[DOCKER_UTILS] ⚠️  Could not translate container path: {e}")
+        logger.warning("Could not translate container path: %s", e)
     return container_path
 
 def get_current_container_network():
     if not docker_client: return None
     try:
-        container_id = socket.gethostname()
-        container = docker_client.containers.get(container_id)
-        networks = container.attrs['NetworkSettings']['Networks']
+        networks = _get_own_container_attrs()['NetworkSettings']['Networks']
         return next(iter(networks)) if networks else None
     except Exception as e:
-        print(f"DOCKER_UTILS: Could not determine container's network: {e}")
+        logger.warning("Could not determine container's network: %s", e)
     return None
 
 async def handle_preview_server(websocket: WebSocket, project_id: str, persistent_project_id: str, project_path: str, lang_config: Dict[str, Any]):
@@ -233,7 +306,7 @@ async def handle_preview_server(websocket: WebSocket, project_id: str, persisten
 
         await send_ws_message(websocket, "project_preview_ready", { "project_id": project_id, "url": proxy_path })
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Failed to start preview server for project %s", project_id)
         await send_ws_message(websocket, "code_finished", { "project_id": project_id, "error": f"Failed to start preview server: {e}"})
 
 async def cleanup_dangling_containers():
@@ -1,4 +1,5 @@
 import os
+import logging
 import traceback
 import docker
 import socket
@@ -7,6 +8,9 @@ import select
 from multiprocessing.connection import Connection
 from typing import Dict, Any
 import app.config as config
+import app.logging_utils as logging_utils
+
+logger = logging.getLogger(__name__)
 
 STREAM_END_SIGNAL = "__DOCKER_STREAM_END__"
 ERROR_PREFIX = "DOCKER_ERROR::"
@@ -31,7 +35,7 @@ def get_host_path_from_container_path(container_path: str) -> str:
                 relative_path = os.path.relpath(container_path, container_mount_point)
                 return os.path.join(host_mount_point, relative_path)
     except Exception as e:
-        print(f"[Worker] Path translation error: {e}")
+        logger.warning("Path translation error: %s", e)
     return container_path
 
 def process_job(conn: Connection, job: Dict[str, Any]):
@@ -68,7 +72,8 @@ def process_job(conn: Connection, job: Dict[str, Any]):
         raw_sock = socket_obj._sock if hasattr(socket_obj, '_sock') else socket_obj
         raw_sock.setblocking(False)
         
-        buffer = b''
+        # Demultiplexed from Docker's 8-byte-header frames; a bytearray so reads append in place.
+        buffer = bytearray()
         read_sockets = [raw_sock, conn]
         waiting_signal_sent = False
 
@@ -111,19 +116,25 @@ def process_job(conn: Connection, job: Dict[str, Any]):
                         if not raw_data:
                             if s in read_sockets: read_sockets.remove(s)
                         else:
-                            buffer += raw_data
+                            buffer.extend(raw_data)
                     except (BlockingIOError, InterruptedError):
                         continue
                     except (ConnectionResetError, BrokenPipeError, PIPE_ENDED_ERROR):
                         if s in read_sockets: read_sockets.remove(s)
 
-            while len(buffer) >= 8:
-                header = buffer[:8]
-                stream_type, size = struct.unpack('>BxxxL', header)
-                if len(buffer) < 8 + size: break
-                payload = buffer[8 : 8 + size].decode('utf-8', 'replace')
+            # Walk the complete frames by offset and drop them from the buffer once, instead of
+            # re-slicing the remaining bytes after every frame.
+            offset = 0
+            buffer_len = len(buffer)
+            while buffer_len - offset >= 8:
+                stream_type, size = struct.unpack_from('>BxxxL', buffer, offset)
+                frame_end = offset + 8 + size
+                if buffer_len < frame_end: break
+                payload = buffer[offset + 8 : frame_end].decode('utf-8', 'replace')
                 conn.send({"type": "chunk", "stream": "stdout" if stream_type == 1 else "stderr", "data": payload})
-                buffer = buffer[8 + size:]
+                offset = frame_end
+            if offset:
+                del buffer[:offset]
         
         result = container.wait()
         conn.send({"type": "exit_code", "exit_code": result.get("StatusCode", -1)})
@@ -144,6 +155,7 @@ def process_job(conn: Connection, job: Dict[str, Any]):
 
 def start_worker(conn: Connection):
     global docker_client
+    logging_utils.setup_worker_logging()
     docker_client = docker.from_env()
     
     while True:
@@ -157,5 +169,5 @@ def start_worker(conn: Connection):
         except Exception:
             try: conn.send(f"{ERROR_PREFIX}{traceback.format_exc()}")
             except Exception: pass
-    print("[Worker Process]: Exiting.")
+    logger.info("Docker worker process exiting.")
 
@@ -1,12 +1,14 @@
 # app/email_utils.py
 import smtplib
 import ssl
-import traceback
+import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from pathlib import Path
 from . import config
 
+logger = logging.getLogger(__name__)
+
 EMAIL_TEMPLATES_DIR = config.APP_DIR / "static" / "email_templates"
 
 def create_smtp_server():
@@ -33,7 +35,7 @@ async def send_registration_password_email(
     login_url: str
 ) -> bool:
     if not config.MAIL_CONFIG.get("MAIL_FROM") or not config.MAIL_CONFIG.get("MAIL_SERVER"):
-        print("EMAIL ERROR: Mail configuration is incomplete.")
+        logger.error("Mail configuration is incomplete.")
         return False
 
     subject = "Welcome to Tesseracs Chat - Your Account Details"
@@ -69,12 +71,11 @@ async def send_registration_password_email(
         with create_smtp_server() as server:
             server.sendmail(config.MAIL_CONFIG["MAIL_FROM"], recipient_email, message.as_string())
             
-        print(f"EMAIL: Registration email successfully sent to {recipient_email}.")
+        logger.info("Registration email successfully sent to %s.", recipient_email)
         return True
 
     except Exception as e:
-        print(f"EMAIL ERROR: Failed to send registration email: {e}")
-        traceback.print_exc()
+        logger.exception("Failed to send registration email to %s", recipient_email)
         return False
 
 async def send_password_reset_email(
@@ -84,7 +85,7 @@ async def send_password_reset_email(
     login_url: str
 ) -> bool:
     if not config.MAIL_CONFIG.get("MAIL_FROM") or not config.MAIL_CONFIG.get("MAIL_SERVER"):
-        print("EMAIL ERROR: Mail configuration is incomplete.")
+        logger.error("Mail configuration is incomplete.")
         return False
 
     subject = "Your Tesseracs Chat Password Has Been Reset"
@@ -119,11 +120,10 @@ async def send_password_reset_email(
         with create_smtp_server() as server:
             server.sendmail(config.MAIL_CONFIG["MAIL_FROM"], recipient_email, message.as_string())
 
-        print(f"EMAIL: Password reset email successfully sent to {recipient_email}.")
+        logger.info("Password reset email successfully sent to %s.", recipient_email)
         return True
 
     except Exception as e:
-        print(f"EMAIL ERROR: Failed to send password reset email: {e}")
-        traceback.print_exc()
+        logger.exception("Failed to send password reset email to %s", recipient_email)
         return False
 
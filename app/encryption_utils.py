@@ -1,10 +1,14 @@
 # app/encryption_utils.py
+import functools
+import logging
 import os
 from cryptography.fernet import Fernet, InvalidToken
 # Import config from the current package
 from . import config 
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
 # Global variable to hold the Fernet instance, initialized once
 _fernet_instance: Optional[Fernet] = None
 
@@ -16,20 +20,20 @@ def _get_fernet() -> Fernet:
     global _fernet_instance
     if _fernet_instance is None:
         if not config.APP_SECRET_KEY:
-            print("CRITICAL ERROR: APP_SECRET_KEY is not configured in the environment. "
-                  "Cannot perform encryption/decryption of sensitive data.")
+            logger.critical("APP_SECRET_KEY is not configured in the environment. "
+                            "Cannot perform encryption/decryption of sensitive data.")
             raise ValueError("APP_SECRET_KEY is not configured. Encryption services are unavailable.")
         
         try:
             # APP_SECRET_KEY must be a URL-safe base64-encoded 32-byte key.
             key_bytes = config.APP_SECRET_KEY.encode('utf-8')
             _fernet_instance = Fernet(key_bytes)
-            print("Fernet encryption service initialized successfully.")
+            logger.info("Fernet encryption service initialized successfully.")
         except Exception as e:
             # This can happen if the key is not correctly formatted (e.g., wrong length, not base64)
-            print(f"CRITICAL ERROR: Failed to initialize Fernet with APP_SECRET_KEY: {e}. "
-                  "Ensure APP_SECRET_KEY is a valid Fernet key (URL-safe base64 encoded 32-byte key). "
-                  "You can generate one using: python -c \"from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())\"")
+            logger.critical("Failed to initialize Fernet with APP_SECRET_KEY: %s. "
+                            "Ensure APP_SECRET_KEY is a valid Fernet key (URL-safe base64 encoded 32-byte key). "
+                            "You can generate one using: python -c \"from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())\"", e)
             raise ValueError(f"Invalid APP_SECRET_KEY format for Fernet encryption: {e}") from e
             
     return _fernet_instance
@@ -52,14 +56,12 @@ def encrypt_data(data: str) -> Optional[str]:
         encrypted_bytes = fernet_cipher.encrypt(data.encode('utf-8'))
         return encrypted_bytes.decode('utf-8') # Store the encrypted data as a string
     except ValueError as ve: # Raised by _get_fernet if APP_SECRET_KEY is not set/invalid
-        print(f"Encryption failed due to configuration issue: {ve}")
+        logger.error("Encryption failed due to configuration issue: %s", ve)
         # Depending on policy, you might re-raise or return a specific error indicator.
         # For now, returning None as the operation could not be completed.
         return None
     except Exception as e:
-        print(f"Error during data encryption: {e}")
-        # import traceback
-        # traceback.print_exc() # Uncomment for detailed stack trace during development
+        logger.error("Error during data encryption: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
         return None
 
 def decrypt_data(encrypted_data: str) -> Optional[str]:
@@ -83,15 +85,39 @@ def decrypt_data(encrypted_data: str) -> Optional[str]:
     except InvalidToken:
         # This is a common error if the token is tampered with, the key is wrong,
         # or the data is not valid Fernet-encrypted data.
-        print("Error during data decryption: Invalid token. Data might be corrupted or key mismatch.")
+        logger.error("Error during data decryption: Invalid token. Data might be corrupted or key mismatch.")
         return None
     except ValueError as ve: # Raised by _get_fernet if APP_SECRET_KEY is not set/invalid
-        print(f"Decryption failed due to configuration issue: {ve}")
+        logger.error("Decryption failed due to configuration issue: %s", ve)
         return None
     except Exception as e:
-        print(f"An unexpected error occurred during data decryption: {e}")
-        # import traceback
-        # traceback.print_exc() # Uncomment for detailed stack trace during development
+        logger.error("An unexpected error occurred during data decryption: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+        return None
+
+class _DecryptionFailed(Exception):
+    pass
+
+@functools.lru_cache(maxsize=1024)
+def _decrypt_data_or_raise(encrypted_data: str) -> str:
+    # lru_cache does not store calls that raise, so only successful decryptions are memoized.
+    decrypted = decrypt_data(encrypted_data)
+    if decrypted is None:
+        raise _DecryptionFailed()
+    return decrypted
+
+def decrypt_data_cached(encrypted_data: str) -> Optional[str]:
+    """
+    Memoized `decrypt_data` for hot paths that repeatedly decrypt the same stored value
+    (e.g. a user's LLM API key on every AI turn).
+
+    The cache is keyed by the ciphertext itself: Fernet tokens embed a fresh IV and timestamp,
+    so re-encrypting or changing a key always produces a new token and simply misses the cache.
+    Failures are not cached, so a transient error (e.g. a configuration problem that is later
+    fixed) is retried, and logged, on the next call.
+    """
+    try:
+        return _decrypt_data_or_raise(encrypted_data)
+    except _DecryptionFailed:
         return None
 
 # Example usage (for testing purposes, typically not run directly like this in production)
@@ -1,20 +1,62 @@
 import os
 import uuid
-import traceback
+import logging
 import json
 import re
 import asyncio
 import sqlite3
+import orjson
 from multiprocessing import Process, Pipe
 from multiprocessing.connection import Connection
 from typing import List, Optional, Any, Dict, Tuple
 
 from fastapi import WebSocket
-from langchain_core.messages import messages_to_dict
 
 from . import state, database, encryption_utils, project_utils, config
 from .llm_worker import start_worker, STREAM_END_SIGNAL, ERROR_PREFIX
 
+logger = logging.getLogger(__name__)
+
+# Constant error frames, serialized once; state.broadcast hands them to each connection's writer as-is.
+WORKER_NOT_RUNNING_FRAME = orjson.dumps({"type": "error", "payload": "LLM worker process is not running."}).decode()
+PROVIDER_NOT_CONFIGURED_FRAME = orjson.dumps({"type": "error", "payload": "AI provider not configured."}).decode()
+
+# --- Stream parser tables, built once at import instead of per chunk ---
+STREAM_TAG_REGEX = re.compile(r"(_(ANSWER|PROJECT|FILE|EDIT_ANSWER|UPDATE_ANSWER|EDIT_PROJECT|UPDATE_PROJECT|EDIT_FILE|UPDATE_FILE|EXTEND_FILE)_(START|END)_)")
+JSON_END_TAG = "_JSON_END_"
+MAX_TAG_LENGTH = 40
+
+START_EVENT_MAP = {
+    "PROJECT": "project_header", "FILE": "start_file_stream",
+    "UPDATE_PROJECT": "project_update_start", "EDIT_PROJECT": "project_edit_start",
+    "UPDATE_ANSWER": "answer_update_start", "EDIT_ANSWER": "answer_edit_start",
+    "UPDATE_FILE": "file_update_start", "EXTEND_FILE": "file_extend_start", "EDIT_FILE": "file_edit_start"
+}
+END_EVENT_MAP = {
+    "ANSWER": "end_answer_stream", "FILE": "end_file_stream", "UPDATE_ANSWER": "end_answer_update",
+    "UPDATE_PROJECT": "end_project_update", "EDIT_PROJECT": "end_project_edit",
+    "UPDATE_FILE": "end_file_update", "EXTEND_FILE": "end_file_extend",
+    "EDIT_ANSWER": "end_answer_edit", "EDIT_FILE": "end_file_edit"
+}
+
+# Streamed content frames are sent as pre-serialized UTF-8: the envelope around the content is
+# constant, so only the content itself is encoded per chunk, straight to the bytes that go out.
+_AI_CHUNK_FRAME_PREFIX = b'{"type":"ai_chunk","payload":'
+_FILE_CHUNK_FRAME_PREFIX = b'{"type":"file_chunk","payload":{"content":'
+
+def _ai_chunk_frame(content: str) -> bytes:
+    return b"".join((_AI_CHUNK_FRAME_PREFIX, orjson.dumps(content), b"}"))
+
+def _file_chunk_frame(content: str) -> bytes:
+    return b"".join((_FILE_CHUNK_FRAME_PREFIX, orjson.dumps(content), b"}}"))
+
+# Maps the innermost parser state to the frame builder for streamed content.
+# States not listed here (e.g. no open block) produce no frame.
+CONTENT_FRAME_BUILDERS = {
+    **dict.fromkeys(["ANSWER", "UPDATE_ANSWER", "PROJECT", "UPDATE_PROJECT", "EDIT_ANSWER", "EDIT_PROJECT"], _ai_chunk_frame),
+    **dict.fromkeys(["FILE", "UPDATE_FILE", "EXTEND_FILE", "EDIT_FILE"], _file_chunk_frame),
+}
+
 # --- Global variables for the worker process and communication pipe ---
 worker_process: Optional[Process] = None
 parent_conn: Optional[Connection] = None
@@ -26,12 +68,12 @@ def start_llm_worker():
     """
     global worker_process, parent_conn
     if worker_process is None or not worker_process.is_alive():
-        print("LLM_SYSTEM: Starting LLM worker process...")
+        logger.info("Starting LLM worker process...")
         parent_conn, child_conn = Pipe()
         worker_process = Process(target=start_worker, args=(child_conn,))
         worker_process.start()
         child_conn.close()
-        print(f"LLM_SYSTEM: Worker process started with PID {worker_process.pid}.")
+        logger.info("LLM worker process started with PID %s.", worker_process.pid)
 
 def shutdown_llm_worker():
     """
@@ -39,19 +81,19 @@ def shutdown_llm_worker():
     This should be called when the main application shuts down.
     """
     global worker_process, parent_conn
-    print("LLM_SYSTEM: Shutting down LLM worker process...")
+    logger.info("Shutting down LLM worker process...")
     if parent_conn:
         try:
             parent_conn.send("EXIT")
         except (BrokenPipeError, EOFError):
-            print("LLM_SYSTEM: Pipe to worker was already closed.")
+            logger.warning("Pipe to LLM worker was already closed.")
     if worker_process and worker_process.is_alive():
         worker_process.join(timeout=5)
         if worker_process.is_alive():
-            print("LLM_SYSTEM: Worker did not exit gracefully, terminating.")
+            logger.warning("LLM worker did not exit gracefully, terminating.")
             worker_process.terminate()
             worker_process.join()
-    print("LLM_SYSTEM: Worker process shut down.")
+    logger.info("LLM worker process shut down.")
 
 # --- Database and Settings Functions (Copied from original, unchanged) ---
 def _get_llm_settings_sync(user_id: int) -> dict:
@@ -59,24 +101,32 @@ def _get_llm_settings_sync(user_id: int) -> dict:
     try:
         conn = database.get_db_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT selected_llm_provider_id, selected_llm_model_id, user_llm_api_key_encrypted, selected_llm_base_url FROM users WHERE id = ?",
-            (user_id,)
-        )
+        cursor.execute(database.SQL_FETCH_USER_LLM_SETTINGS, (user_id,))
         user_settings = cursor.fetchone()
         if not user_settings:
             return {"error": "User settings not found."}
-        settings = dict(user_settings)
-        api_key_encrypted = settings.get("user_llm_api_key_encrypted")
-        settings["api_key"] = encryption_utils.decrypt_data(api_key_encrypted) if api_key_encrypted else None
-        return settings
+        return dict(user_settings)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Failed to load LLM settings for user %s", user_id)
         return {"error": str(e)}
     finally:
         if conn:
             conn.close()
 
+async def _get_llm_settings(user_id: int) -> dict:
+    """The user's LLM settings row plus the decrypted "api_key", or a dict with an "error"."""
+    settings = state.get_cached_llm_settings(user_id)
+    if settings is None:
+        generation = state.llm_settings_cache_generation
+        settings = await database.run_in_db_thread(_get_llm_settings_sync, user_id)
+        if "error" in settings:
+            return settings
+        if generation == state.llm_settings_cache_generation:
+            state.cache_llm_settings(user_id, settings)
+    # The cache holds only the ciphertext; the plaintext key lives for this turn.
+    api_key_encrypted = settings.get("user_llm_api_key_encrypted")
+    return {**settings, "api_key": encryption_utils.decrypt_data_cached(api_key_encrypted) if api_key_encrypted else None}
+
 def _process_and_save_ai_response(session_id: str, user_id: int, full_raw_content: str, turn_id: int, reply_to_id: Optional[int]) -> Tuple[Optional[int], Optional[str], Optional[str]]:
     """
     Parses the full AI response, applies creation/edit/update logic, and saves the results.
@@ -157,15 +207,14 @@ def _process_and_save_ai_response(session_id: str, user_id: int, full_raw_conten
                     cursor.execute("INSERT INTO projects (id, session_id, name, git_repo_blob) VALUES (?, ?, ?, ?)",
                                    (new_project_id, session_id, project_data.get("name"), repo_blob))
                 else:
-                    print(f"[LLM_SAVE_ERROR] Failed to create git repo blob. Error: {error}")
+                    logger.error("Failed to create git repo blob: %s", error)
             else:
-                print("[LLM_SAVE_ERROR] Failed to parse project data from raw content.")
+                logger.error("Failed to parse project data from raw AI content.")
         
         # --- Final INSERT for New Messages (including Projects and simple Answers) ---
         cursor.execute(
-            """INSERT INTO chat_messages (session_id, user_id, sender_name, sender_type, content, turn_id, reply_to_message_id, prompting_user_id, project_id)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (session_id, user_id, 'AI', 'ai', new_message_content, turn_id, reply_to_id, user_id, new_project_id)
+            database.SQL_INSERT_AI_CHAT_MESSAGE,
+            (session_id, user_id, new_message_content, turn_id, reply_to_id, user_id, new_project_id)
         )
         new_message_id = cursor.lastrowid
 
@@ -176,8 +225,7 @@ def _process_and_save_ai_response(session_id: str, user_id: int, full_raw_conten
         return new_message_id, new_project_id, new_message_content
 
     except Exception as e:
-        print(f"!!! LLM_SAVE_ERROR: An exception occurred in _process_and_save_ai_response: {e}")
-        traceback.print_exc()
+        logger.exception("Failed to process and save AI response for session %s", session_id)
         if conn: conn.rollback()
         return None, None, None
     finally:
@@ -185,6 +233,37 @@ def _process_and_save_ai_response(session_id: str, user_id: int, full_raw_conten
 
 
 
+# Fast streams arrive as many tiny chunks; gather them briefly so each broadcast carries more text.
+STREAM_BATCH_WINDOW_SECONDS = 0.015
+STREAM_BATCH_MAX_CHARS = 4096
+
+async def _collect_chunk_batch(queue: asyncio.Queue) -> Tuple[str, Optional[str]]:
+    """
+    Waits for the next chunk from the worker pipe and, if it is small, gives the worker
+    STREAM_BATCH_WINDOW_SECONDS to produce more before draining everything queued.
+    Returns the joined text and the terminal item (STREAM_END_SIGNAL or an error chunk)
+    if one was reached, otherwise None.
+    """
+    parts = []
+    item = await queue.get()
+    if item == STREAM_END_SIGNAL or item.startswith(ERROR_PREFIX):
+        return "", item
+    parts.append(item)
+    size = len(item)
+
+    if size < STREAM_BATCH_MAX_CHARS and queue.empty():
+        await asyncio.sleep(STREAM_BATCH_WINDOW_SECONDS)
+
+    while True:
+        try:
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if item == STREAM_END_SIGNAL or item.startswith(ERROR_PREFIX):
+            return "".join(parts), item
+        parts.append(item)
+    return "".join(parts), None
+
 async def invoke_llm_for_session(
     session_id: str,
     websocket: WebSocket,
@@ -207,7 +286,7 @@ async def invoke_llm_for_session(
             data = parent_conn.recv()
             queue.put_nowait(data)
         except Exception as e:
-            print(f"Error reading from pipe: {e}")
+            logger.error("Error reading from LLM worker pipe: %s", e)
             queue.put_nowait(STREAM_END_SIGNAL)
 
     pipe_fileno = parent_conn.fileno()
@@ -215,26 +294,29 @@ async def invoke_llm_for_session(
 
     try:
         if not parent_conn or not worker_process or not worker_process.is_alive():
-            await state.broadcast(session_id, {"type": "error", "payload": "LLM worker process is not running."}); await asyncio.sleep(0)
+            await state.broadcast(session_id, WORKER_NOT_RUNNING_FRAME); await asyncio.sleep(0)
             return
 
-        settings = await asyncio.to_thread(_get_llm_settings_sync, user_id)
+        # The settings row and the session's conversation history are independent lookups,
+        # so fetch them concurrently; history is cached per session, so a wasted load is cheap.
+        settings, history_messages_serialised = await asyncio.gather(
+            _get_llm_settings(user_id),
+            state.get_serialised_history_for_client(session_id)
+        )
         if "error" in settings:
             await state.broadcast(session_id, {"type": "error", "payload": f"Could not load LLM settings: {settings['error']}"}); await asyncio.sleep(0)
             return
         
         provider_id = settings.get("selected_llm_provider_id")
         if not provider_id or not settings.get("selected_llm_model_id"):
-            await state.broadcast(session_id, {"type": "error", "payload": "AI provider not configured."}); await asyncio.sleep(0)
+            await state.broadcast(session_id, PROVIDER_NOT_CONFIGURED_FRAME); await asyncio.sleep(0)
             return
 
-        memory = await state.get_memory_for_client(session_id)
-        
         job_payload = {
             "prompt": user_input_raw, "provider_id": provider_id,
             "model_id": settings.get("selected_llm_model_id"), "api_key": settings.get("api_key"),
             "base_url": settings.get("selected_llm_base_url"),
-            "history_messages_serialised": messages_to_dict(memory.chat_memory.messages)
+            "history_messages_serialised": history_messages_serialised
         }
 
         await loop.run_in_executor(None, parent_conn.send, job_payload)
@@ -244,137 +326,143 @@ async def invoke_llm_for_session(
 
         parser_stack = []
         buffer = ""
-        tag_regex = re.compile(r"(_(ANSWER|PROJECT|FILE|EDIT_ANSWER|UPDATE_ANSWER|EDIT_PROJECT|UPDATE_PROJECT|EDIT_FILE|UPDATE_FILE|EXTEND_FILE)_(START|END)_)")
-        json_end_tag = "_JSON_END_"
-        MAX_TAG_LENGTH = 40 
+        tag_regex = STREAM_TAG_REGEX
+        frame_builders = CONTENT_FRAME_BUILDERS
 
         while not stop_event.is_set():
-            chunk = await queue.get()
-            if chunk == STREAM_END_SIGNAL: break
-            if chunk.startswith(ERROR_PREFIX):
+            chunk, terminal_chunk = await _collect_chunk_batch(queue)
+            if chunk:
                 all_content_parts.append(chunk)
-                await state.broadcast(session_id, {"type": "error", "payload": chunk})
-                break
-
-            all_content_parts.append(chunk)
-            buffer += chunk
-
-            while True:
-                match = tag_regex.search(buffer)
-                if not match:
-                    if parser_stack and len(buffer) > MAX_TAG_LENGTH:
-                        split_pos = len(buffer) - MAX_TAG_LENGTH
-                        content_chunk = buffer[:split_pos]
-                        buffer = buffer[split_pos:]
-                        
-                        current_state = parser_stack[-1]
-                        if current_state in ["ANSWER", "UPDATE_ANSWER", "PROJECT", "UPDATE_PROJECT", "EDIT_ANSWER", "EDIT_PROJECT"]:
-                            await state.broadcast(session_id, {"type": "ai_chunk", "payload": content_chunk}); await asyncio.sleep(0)
-                        elif current_state in ["FILE", "UPDATE_FILE", "EXTEND_FILE", "EDIT_FILE"]:
-                            await state.broadcast(session_id, {"type": "file_chunk", "payload": {"content": content_chunk}}); await asyncio.sleep(0)
-                    break 
-
-                content_before_tag = buffer[:match.start()]
-                if content_before_tag:
-                    current_state_before = parser_stack[-1] if parser_stack else None
-                    if current_state_before in ["ANSWER", "UPDATE_ANSWER", "PROJECT", "UPDATE_PROJECT", "EDIT_ANSWER", "EDIT_PROJECT"]:
-                        await state.broadcast(session_id, {"type": "ai_chunk", "payload": content_before_tag}); await asyncio.sleep(0)
-                    elif current_state_before in ["FILE", "UPDATE_FILE", "EXTEND_FILE", "EDIT_FILE"]:
-                        await state.broadcast(session_id, {"type": "file_chunk", "payload": {"content": content_before_tag}}); await asyncio.sleep(0)
+                buffer += chunk
+
+                while True:
+                    match = tag_regex.search(buffer)
+                    if not match:
+                        if parser_stack and len(buffer) > MAX_TAG_LENGTH:
+                            split_pos = len(buffer) - MAX_TAG_LENGTH
+                            content_chunk = buffer[:split_pos]
+                            buffer = buffer[split_pos:]
+
+                            build_frame = frame_builders.get(parser_stack[-1])
+                            if build_frame:
+                                await state.broadcast(session_id, build_frame(content_chunk)); await asyncio.sleep(0)
+                        elif not parser_stack and len(buffer) > MAX_TAG_LENGTH:
+                            # Text outside any block is never streamed; keep only a possible partial
+                            # tag so the buffer (and each regex scan) doesn't grow with the reply.
+                            buffer = buffer[-MAX_TAG_LENGTH:]
+                        break 
+
+                    content_before_tag = buffer[:match.start()]
+                    if content_before_tag and parser_stack:
+                        build_frame = frame_builders.get(parser_stack[-1])
+                        if build_frame:
+                            await state.broadcast(session_id, build_frame(content_before_tag)); await asyncio.sleep(0)
                 
-                buffer = buffer[match.end():]
+                    buffer = buffer[match.end():]
                 
-                # --- START OF THE CRITICAL FIX ---
-                # The regex has 3 groups, so we unpack 3 values.
-                tag_full, tag_type, tag_action = match.groups()
-                # --- END OF THE CRITICAL FIX ---
-
-                if tag_action == "START":
-                    if json_end_tag in buffer:
-                        json_str, rest_of_buffer = buffer.split(json_end_tag, 1)
-                        buffer = rest_of_buffer
-                        try:
-                            args = json.loads(json_str.strip())
-                            parser_stack.append(tag_type)
+                    # The regex has 3 groups, so we unpack 3 values.
+                    tag_full, tag_type, tag_action = match.groups()
+
+                    if tag_action == "START":
+                        if JSON_END_TAG in buffer:
+                            json_str, rest_of_buffer = buffer.split(JSON_END_TAG, 1)
+                            buffer = rest_of_buffer
+                            try:
+                                args = json.loads(json_str.strip())
+                                parser_stack.append(tag_type)
                             
-                            event_payload = {**args, 'turn_id': turn_id, 'prompting_user_id': user_id, 'prompting_user_name': user_name}
-                            if 'path' in event_payload:
-                                event_payload['language'] = project_utils.get_language_from_extension(event_payload['path'])
+                                event_payload = {**args, 'turn_id': turn_id, 'prompting_user_id': user_id, 'prompting_user_name': user_name}
+                                if 'path' in event_payload:
+                                    event_payload['language'] = project_utils.get_language_from_extension(event_payload['path'])
                             
-                            event_map = {
-                                "PROJECT": "project_header", "FILE": "start_file_stream",
-                                "UPDATE_PROJECT": "project_update_start", "EDIT_PROJECT": "project_edit_start",
-                                "UPDATE_ANSWER": "answer_update_start", "EDIT_ANSWER": "answer_edit_start",
-                                "UPDATE_FILE": "file_update_start", "EXTEND_FILE": "file_extend_start", "EDIT_FILE": "file_edit_start"
-                            }
-                            if tag_type in event_map:
-                                await state.broadcast(session_id, {"type": event_map[tag_type], "payload": event_payload}); await asyncio.sleep(0)
-                        except json.JSONDecodeError:
-                            print(f"PARSER WARNING: Invalid JSON in stream for {tag_type}: {json_str}")
-                            buffer = tag_full + json_str + json_end_tag + rest_of_buffer
-                    else:
-                        buffer = tag_full + buffer
-                        break
+                                if tag_type in START_EVENT_MAP:
+                                    await state.broadcast(session_id, {"type": START_EVENT_MAP[tag_type], "payload": event_payload}); await asyncio.sleep(0)
+                            except json.JSONDecodeError:
+                                logger.warning("Invalid JSON in stream for %s: %s", tag_type, json_str)
+                                buffer = tag_full + json_str + JSON_END_TAG + rest_of_buffer
+                        else:
+                            buffer = tag_full + buffer
+                            break
                 
-                elif tag_action == "END":
-                    if parser_stack and parser_stack[-1] == tag_type:
-                        parser_stack.pop()
-                        end_event_map = {
-                            "ANSWER": "end_answer_stream", "FILE": "end_file_stream", "UPDATE_ANSWER": "end_answer_update",
-                            "UPDATE_PROJECT": "end_project_update", "EDIT_PROJECT": "end_project_edit",
-                            "UPDATE_FILE": "end_file_update", "EXTEND_FILE": "end_file_extend",
-                            "EDIT_ANSWER": "end_answer_edit", "EDIT_FILE": "end_file_edit"
-                        }
-                        if tag_type in end_event_map:
-                            await state.broadcast(session_id, {"type": end_event_map[tag_type], "payload": {"turn_id": turn_id}}); await asyncio.sleep(0)
-                    else:
-                        print(f"PARSER WARNING: Mismatched end tag. Stack: {parser_stack}, Got: {tag_type}")
+                    elif tag_action == "END":
+                        if parser_stack and parser_stack[-1] == tag_type:
+                            parser_stack.pop()
+                            if tag_type in END_EVENT_MAP:
+                                await state.broadcast(session_id, {"type": END_EVENT_MAP[tag_type], "payload": {"turn_id": turn_id}}); await asyncio.sleep(0)
+                        else:
+                            logger.warning("Mismatched end tag. Stack: %s, got: %s", parser_stack, tag_type)
+
+            if terminal_chunk is not None:
+                if terminal_chunk != STREAM_END_SIGNAL:
+                    all_content_parts.append(terminal_chunk)
+                    await state.broadcast(session_id, {"type": "error", "payload": terminal_chunk})
+                break
 
         if buffer and parser_stack:
-            current_state = parser_stack[-1]
-            if current_state in ["ANSWER", "UPDATE_ANSWER", "PROJECT", "UPDATE_PROJECT", "EDIT_ANSWER", "EDIT_PROJECT"]:
-                await state.broadcast(session_id, {"type": "ai_chunk", "payload": buffer})
-            elif current_state in ["FILE", "UPDATE_FILE", "EXTEND_FILE", "EDIT_FILE"]:
-                await state.broadcast(session_id, {"type": "file_chunk", "payload": {"content": buffer}}); await asyncio.sleep(0)
+            build_frame = frame_builders.get(parser_stack[-1])
+            if build_frame:
+                await state.broadcast(session_id, build_frame(buffer)); await asyncio.sleep(0)
 
     except Exception as e:
-        tb_str = traceback.format_exc()
-        print(f"LLM_SYSTEM ERROR in invoke_llm_for_session: {e}\n{tb_str}")
+        logger.exception("Error in invoke_llm_for_session for session %s", session_id)
         await state.broadcast(session_id, {"type": "error", "payload": f"AI Error: {str(e)}"})
     finally:
         loop.remove_reader(pipe_fileno)
 
         if stop_event.is_set():
-            print(f"LLM_SYSTEM: Stream {stream_id} was stopped by client.")
+            logger.info("Stream %s was stopped by client.", stream_id)
         
         full_response_content = "".join(all_content_parts)
-        
+        await state.unregister_ai_stream(stream_id)
+
+        # Persisting the reply (project packing, edits, INSERT) happens off the streaming task;
+        # shutdown awaits these so a finished stream is never lost.
+        finalize_task = asyncio.create_task(
+            _finalize_ai_turn(session_id, user_id, full_response_content, turn_id, reply_to_id)
+        )
+        state.turn_finalize_tasks.add(finalize_task)
+        finalize_task.add_done_callback(state.turn_finalize_tasks.discard)
+
+    # The session's turn worker awaits this call, so wait for the reply to be saved and in memory
+    # before the next turn starts. Shielded: cancelling the stream must not cancel the save.
+    await asyncio.shield(finalize_task)
+
+async def _finalize_ai_turn(session_id: str, user_id: int, full_response_content: str, turn_id: int, reply_to_id: Optional[int]):
+    """Saves a completed AI reply in a worker thread and announces the result to the session."""
+    try:
         ai_message_id, saved_project_id, final_content = await asyncio.to_thread(
             _process_and_save_ai_response,
             session_id, user_id, full_response_content, turn_id, reply_to_id
         )
+    except Exception:
+        logger.exception("Failed to finalize AI turn %s for session %s", turn_id, session_id)
+        ai_message_id, saved_project_id, final_content = None, None, None
 
-        # Check if the response was an update/edit block
-        is_update_or_edit = "_UPDATE_ANSWER_START_" in full_response_content or "_EDIT_ANSWER_START_" in full_response_content
-        
-        if ai_message_id and is_update_or_edit:
-            # This was an update, so we broadcast a 'message_updated' event
-            await state.broadcast(session_id, {
-                "type": "message_updated",
-                "payload": {
-                    "message_id": ai_message_id,
-                    "new_content": final_content
-                }
-            })
-            state.remove_memory_for_client(session_id)
-            await state.unregister_ai_stream(stream_id)
-            return # End the execution here for updates
-        
-        if ai_message_id is not None:
+    # Check if the response was an update/edit block
+    is_update_or_edit = "_UPDATE_ANSWER_START_" in full_response_content or "_EDIT_ANSWER_START_" in full_response_content
+    
+    if ai_message_id and is_update_or_edit:
+        # This was an update, so we broadcast a 'message_updated' event
+        await state.broadcast(session_id, {
+            "type": "message_updated",
+            "payload": {
+                "message_id": ai_message_id,
+                "new_content": final_content
+            }
+        })
+        state.remove_memory_for_client(session_id)
+        return # End the execution here for updates
+    
+    if ai_message_id is not None:
+        modifies_project = "_EDIT_PROJECT_START_" in full_response_content or "_UPDATE_PROJECT_START_" in full_response_content
+        if saved_project_id is None and not modifies_project:
+            # A plain answer is remembered exactly as saved; project replies need the project
+            # context (and relinked messages) that a rebuild from the database picks up.
+            state.append_message_to_memory(session_id, 'ai', final_content)
+        else:
             state.remove_memory_for_client(session_id)
-        
-        await state.broadcast(session_id, {"type": "ai_stream_end", "payload": {"message_id": ai_message_id, "turn_id": turn_id, "project_id": saved_project_id}})
-        await state.unregister_ai_stream(stream_id)
+    
+    await state.broadcast(session_id, {"type": "ai_stream_end", "payload": {"message_id": ai_message_id, "turn_id": turn_id, "project_id": saved_project_id}})
 
 def _update_original_message_to_link(cursor: sqlite3.Cursor, original_message_id: int, new_message_id: int, text: str):
     """Updates an existing message to become a link to a new message."""
@@ -419,7 +507,7 @@ def _apply_answer_modifications(cursor: sqlite3.Cursor, block_type: str, origina
             # Re-wrap the newly modified text in the standard answer format.
             return f"_ANSWER_START_\n{{}}\n_JSON_END_\n{editable_text}\n_ANSWER_END_"
         except (json.JSONDecodeError, TypeError):
-            print(f"LLM_SAVE_ERROR: Could not apply answer edits due to invalid JSON. Content: {new_content_data}")
+            logger.error("Could not apply answer edits due to invalid JSON. Content: %s", new_content_data)
             return None
     
     return None
\ No newline at end of file
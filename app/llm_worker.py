@@ -1,4 +1,5 @@
 import os
+import logging
 import traceback
 from pathlib import Path
 from multiprocessing.connection import Connection
@@ -9,12 +10,16 @@ import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import Runnable, RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import Runnable
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage, messages_from_dict
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_anthropic import ChatAnthropic
 
+from . import logging_utils
+
+logger = logging.getLogger(__name__)
+
 # --- Constants ---
 STREAM_END_SIGNAL = "__STREAM_END__"
 ERROR_PREFIX = "ERROR::"
@@ -26,7 +31,7 @@ try:
     with open(PROMPT_FILE_PATH, "r", encoding="utf-8") as f:
         SYSTEM_PROMPT = f.read()
 except FileNotFoundError:
-    print("FATAL ERROR: system_prompt.txt not found. Please ensure it exists in the 'app' directory.")
+    logger.critical("system_prompt.txt not found. Please ensure it exists in the 'app' directory.")
     SYSTEM_PROMPT = "You are a helpful assistant." # Fallback to prevent crash
 
 prompt_template = ChatPromptTemplate.from_messages([
@@ -50,36 +55,33 @@ def get_model(provider_id: str, model_id: str, api_key: Optional[str], base_url:
         else:
             return None
     except Exception as e:
-        print(f"[Worker] Error initializing model: {e}")
+        logger.error("Error initializing model %s/%s: %s", provider_id, model_id, e)
         return None
 
 
-def get_chain(model_instance: Optional[Runnable], history_messages: List[BaseMessage]) -> Runnable:
-    """Constructs the LangChain runnable chain."""
-    def memory_loader_func(input_dict: dict) -> List[BaseMessage]:
-        return history_messages
-
-    return (
-        RunnablePassthrough.assign(history=RunnableLambda(memory_loader_func))
-        | prompt_template
-        | model_instance
-        | output_parser
-    )
+def build_chain(provider_id: str, model_id: str, api_key: Optional[str], base_url: Optional[str]) -> Optional[Runnable]:
+    """
+    Returns the prompt | model | parser pipeline for one job. The prompt template and parser are
+    shared module-level objects; the model (and the SDK client holding the job's API key) is built
+    per job and dropped with the chain, so no user's key outlives the job that used it.
+    """
+    model_instance = get_model(provider_id=provider_id, model_id=model_id, api_key=api_key, base_url=base_url)
+    if not model_instance:
+        return None
+    return prompt_template | model_instance | output_parser
 
 
 def stream_with_native_google_sdk(conn: Connection, job: dict):
     """
     Handles streaming specifically for Google Gemini using its native SDK.
     """
-    print("[WORKER/Google] Using native Google SDK for streaming.")
+    logger.debug("Using native Google SDK for streaming.")
     api_key = job.get("api_key")
     if not api_key:
-        print("[WORKER/Google] ERROR: API key is missing.")
+        logger.error("Google API key is missing.")
         conn.send(f"{ERROR_PREFIX}Google API Key is not configured in your settings.")
         return
     
-    print(f"[WORKER/Google] Configuring with API Key starting with: {api_key[:4]}...")
-
     try:
         genai.configure(api_key=api_key)
         model = genai.GenerativeModel(job["model_id"], system_instruction=SYSTEM_PROMPT)
@@ -89,27 +91,26 @@ def stream_with_native_google_sdk(conn: Connection, job: dict):
             role = "user" if isinstance(msg, HumanMessage) else "model"
             history_for_sdk.append({'role': role, 'parts': [msg.content]})
 
-        print("[WORKER/Google] Sending request to Google API...")
         response_stream = model.generate_content(history_for_sdk, stream=True)
 
         chunk_count = 0
         for chunk in response_stream:
             chunk_count += 1
             try:
-                if chunk.text:
-                    print(f"[WORKER/Google CHUNK {chunk_count}]: {repr(chunk.text)}")
-                    conn.send(chunk.text)
+                # `chunk.text` is a computed property that walks the candidate parts, so read it once.
+                chunk_text = chunk.text
+                if chunk_text:
+                    conn.send(chunk_text)
             except ValueError:
-                print(f"[WORKER/Google WARN] Chunk {chunk_count} had no valid text part. It might have been blocked for safety reasons.")
-                if hasattr(chunk, 'candidates') and chunk.candidates:
-                     print(f"Safety Ratings: {chunk.candidates[0].safety_ratings}")
+                logger.warning("Google chunk %d had no valid text part. It might have been blocked for safety reasons.", chunk_count)
+                if logger.isEnabledFor(logging.DEBUG) and getattr(chunk, 'candidates', None):
+                    logger.debug("Safety ratings: %s", chunk.candidates[0].safety_ratings)
                 continue # Gracefully skip to the next chunk
 
-        print(f"[WORKER/Google] Stream finished. Received {chunk_count} chunks.")
+        logger.debug("Google stream finished. Received %d chunks.", chunk_count)
 
     except Exception as e:
-        print(f"[WORKER/Google] CRITICAL ERROR during API call: {e}")
-        traceback.print_exc()
+        logger.exception("Error during Google API call")
         
         if isinstance(e, google_exceptions.PermissionDenied):
             error_message = f"Permission Denied. This is likely due to an invalid or revoked API key. Details: {e}"
@@ -120,52 +121,48 @@ def stream_with_native_google_sdk(conn: Connection, job: dict):
 
 def process_job(conn: Connection, job: dict):
     """Processes a single job dictionary received from the main app."""
-    print(f"[Worker] Processing job for provider: {job.get('provider_id')}")
+    logger.debug("Processing job for provider: %s", job.get('provider_id'))
     history_messages = messages_from_dict(job["history_messages_serialised"])
-    model_instance = get_model(
-        provider_id=job["provider_id"],
-        model_id=job["model_id"],
-        api_key=job["api_key"],
-        base_url=job["base_url"]
-    )
 
     if job["provider_id"] == "google_gemini":
         job["history_messages"] = history_messages
         stream_with_native_google_sdk(conn, job)
         return
 
-    if not model_instance:
+    chain = build_chain(job["provider_id"], job["model_id"], job["api_key"], job["base_url"])
+    if not chain:
         conn.send(f"{ERROR_PREFIX}Failed to initialize model for provider '{job['provider_id']}'.")
         return
 
-    chain = get_chain(model_instance, history_messages)
-    for chunk in chain.stream({"input": job["prompt"]}):
-        conn.send(chunk)
+    for chunk in chain.stream({"input": job["prompt"], "history": history_messages}):
+        # StrOutputParser already yields str; skip the empty chunks some providers emit.
+        if chunk:
+            conn.send(chunk)
 
 
 def start_worker(conn: Connection):
     """
     The main loop for the worker process. Waits for jobs and processes them.
     """
-    print(f"[Worker Process - PID {os.getpid()}]: Started and waiting for jobs.")
+    logging_utils.setup_worker_logging()
+    logger.info("LLM worker process %s started and waiting for jobs.", os.getpid())
     while True:
         try:
             job = conn.recv()
             if job == "EXIT":
-                print("[Worker Process]: EXIT signal received. Shutting down.")
+                logger.info("EXIT signal received. Shutting down.")
                 break
             
             process_job(conn, job)
 
         except Exception as e:
             tb_str = traceback.format_exc()
-            print(f"[Worker Process]: An unexpected error occurred: {e}\n{tb_str}")
+            logger.exception("Unexpected error while processing job")
             try:
                 conn.send(f"{ERROR_PREFIX}An unexpected error occurred in the worker: {e}\n{tb_str}")
             except Exception as pipe_err:
-                print(f"[Worker Process]: Failed to send error over pipe: {pipe_err}")
+                logger.error("Failed to send error over pipe: %s", pipe_err)
         finally:
             conn.send(STREAM_END_SIGNAL)
-            print("[Worker Process]: Finished job and sent stream end signal.")
     
-    print("[Worker Process]: Exiting.")
\ No newline at end of file
+    logger.info("LLM worker process exiting.")
\ No newline at end of file
@@ -0,0 +1,107 @@
+# app/logging_utils.py
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Optional
+
+from . import config
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_log_queue: Optional[queue.Queue] = None
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+
+class RingBufferQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler over a bounded queue. When the listener falls behind and the queue is full,
+    the oldest pending record is dropped instead of blocking (or erroring in) the caller.
+    """
+    def enqueue(self, record: logging.LogRecord) -> None:
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+class LogRateLimiter:
+    """
+    Token bucket for log calls that clients can trigger at will: up to `burst` records at once,
+    refilled at `rate` records per second. Callers check allow() before logging and can report
+    how many records were dropped with take_suppressed(). Meant for use on the event loop thread.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._suppressed = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        self._suppressed += 1
+        return False
+
+    def take_suppressed(self) -> int:
+        """Returns the number of records dropped since the last call and resets it."""
+        suppressed = self._suppressed
+        self._suppressed = 0
+        return suppressed
+
+def setup_logging() -> None:
+    """
+    Routes all log records through a QueueHandler so that callers on the event loop
+    only enqueue records. A QueueListener thread does the actual (blocking) stream writes.
+    The queue is bounded by config.LOG_QUEUE_MAX_SIZE and behaves as a ring buffer.
+    Safe to call more than once; only the first call installs the handlers.
+    """
+    global _log_queue, _queue_listener
+    if _queue_listener is not None:
+        return
+
+    _log_queue = queue.Queue(maxsize=config.LOG_QUEUE_MAX_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    level = logging.getLevelName(config.LOG_LEVEL)
+    root_logger = logging.getLogger()
+    root_logger.handlers = [RingBufferQueueHandler(_log_queue)]
+    root_logger.setLevel(level if isinstance(level, int) else logging.INFO)
+
+    _queue_listener = logging.handlers.QueueListener(_log_queue, stream_handler, respect_handler_level=True)
+    _queue_listener.start()
+
+def setup_worker_logging() -> None:
+    """
+    Logging for child worker processes. A forked child inherits the parent's QueueHandler but
+    not its listener thread, so records would never be written; replace it with a direct
+    stream handler (blocking writes are fine off the event loop).
+    """
+    global _log_queue, _queue_listener
+    _log_queue = None
+    _queue_listener = None
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    level = logging.getLevelName(config.LOG_LEVEL)
+    root_logger = logging.getLogger()
+    root_logger.handlers = [stream_handler]
+    root_logger.setLevel(level if isinstance(level, int) else logging.INFO)
+
+def shutdown_logging() -> None:
+    """Flushes any queued records and stops the listener thread."""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
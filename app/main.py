@@ -1,9 +1,11 @@
 
 import os
 import sys
-import traceback
+import logging
 from pathlib import Path
 import asyncio
+import functools
+import time
 import uuid
 import json
 import sqlite3
@@ -11,8 +13,14 @@ import uuid
 from urllib.parse import urlparse
 import datetime
 import shutil
-from typing import Optional, Dict, Any, List
+import re
+from typing import Optional, Dict, Any, List, Tuple
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 import httpx
+import orjson
 
 from fastapi import (
     FastAPI,
@@ -25,6 +33,7 @@ from fastapi import (
     Response as FastAPIResponse,
     Path as FastApiPath,
     Body,
+    Query,
     status
 )
 from fastapi.responses import (
@@ -37,7 +46,6 @@ from fastapi.responses import (
 )
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from fastapi.websockets import WebSocketState
 
 from pydantic import HttpUrl
 
@@ -55,6 +63,17 @@ from . import models
 from . import encryption_utils
 from . import project_utils
 from . import llm
+from . import logging_utils
+
+logging_utils.setup_logging()
+logger = logging.getLogger(__name__)
+
+# Constant error frames for the WebSocket loop, serialized once. The per-connection writer
+# sends str items from its queue verbatim and JSON-encodes everything else.
+WS_ERROR_MESSAGE_TOO_LARGE = orjson.dumps({"type": "error", "payload": "Message too large."}).decode()
+WS_ERROR_TOO_MANY_PENDING = orjson.dumps({"type": "error", "payload": "Too many pending messages in this session. Please wait a moment and try again."}).decode()
+WS_ERROR_CODE_TOO_LARGE = orjson.dumps({"type": "error", "payload": "Code block is too large to save."}).decode()
+WS_ERROR_INVALID_MESSAGE = orjson.dumps({"type": "error", "payload": "Invalid message format. Expected a JSON object."}).decode()
 
 app = FastAPI(title="Tesseracs Chat CSRF Example")
 
@@ -76,6 +95,15 @@ def get_csrf_config():
         ("httponly", True),
     ]
 
+@app.exception_handler(sqlite3.Error)
+async def sqlite_error_exception_handler(request: Request, exc: sqlite3.Error):
+    # Routes let database errors propagate; `with conn` / the pool has already rolled back.
+    logger.error("Database error handling %s %s", request.method, request.url.path, exc_info=exc)
+    return JSONResponse(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={"detail": "A database error occurred."}
+    )
+
 @app.exception_handler(CsrfProtectError)
 async def csrf_protect_exception_handler(request: Request, exc: CsrfProtectError):
     return JSONResponse(
@@ -83,63 +111,90 @@ async def csrf_protect_exception_handler(request: Request, exc: CsrfProtectError
         content={"detail": exc.message if exc.message else "CSRF Validation Failed"}
     )
 
+# Routes without path parameters resolve to fixed paths, so look them up in the router once.
+@functools.lru_cache(maxsize=None)
+def _get_login_page_path() -> str:
+    return app.url_path_for("get_login_page_route")
+
+@functools.lru_cache(maxsize=None)
+def _get_session_choice_page_path() -> str:
+    return app.url_path_for("get_session_choice_page")
+
+@functools.lru_cache(maxsize=None)
+def _get_public_login_page_url() -> str:
+    """Absolute login URL on config.BASE_URL, as linked from account emails."""
+    return urlparse(config.BASE_URL)._replace(path=_get_login_page_path()).geturl()
+
+# Page templates are read from disk once and kept in memory, pre-split around their placeholders
+# so a request only joins byte segments. In DEBUG_MODE they are re-read on every request so edits
+# to the static files show up without a restart.
+HTML_PAGE_NAMES = ("login.html", "session-choice.html", "chat-session.html", "settings.html")
+CSRF_TOKEN_PLACEHOLDER = "%%CSRF_TOKEN_RAW%%"
+# Every placeholder serve_html_with_csrf can fill; replacement keys must come from this list.
+HTML_TEMPLATE_PLACEHOLDERS = (CSRF_TOKEN_PLACEHOLDER, "%%SESSION_NAME_PLACEHOLDER%%", "[User Name]")
+_HTML_PLACEHOLDER_SPLIT_RE = re.compile(
+    b"(" + b"|".join(re.escape(p.encode("utf-8")) for p in HTML_TEMPLATE_PLACEHOLDERS) + b")"
+)
+# A template is a tuple alternating literal bytes and placeholder bytes: (text, placeholder, text, ...).
+# None records a page that was found missing, so requests for it don't go back to disk either.
+_html_template_cache: Dict[Path, Optional[Tuple[bytes, ...]]] = {}
+
+def _load_html_template(file_path: Path) -> Optional[Tuple[bytes, ...]]:
+    """Returns the split segments of an HTML page, from memory when possible, or None if the file does not exist."""
+    if not config.DEBUG_MODE and file_path in _html_template_cache:
+        return _html_template_cache[file_path]
+    # Open directly instead of is_file() + open(): one syscall on a miss rather than two.
+    try:
+        with open(file_path, "rb") as f:
+            segments = tuple(_HTML_PLACEHOLDER_SPLIT_RE.split(f.read()))
+    except (FileNotFoundError, IsADirectoryError):
+        segments = None
+    _html_template_cache[file_path] = segments
+    return segments
+
 async def serve_html_with_csrf(
     file_path: Path,
     request: Request,
     csrf_protect: CsrfProtect,
     replacements: Optional[Dict[str, str]] = None
 ) -> HTMLResponse:
-    if not file_path.is_file():
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Resource {file_path.name} not found.")
-
-    html_content_original = ""
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            html_content_original = f.read()
+        template_segments = _load_html_template(file_path)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error loading content for {file_path.name}.")
+    if template_segments is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Resource {file_path.name} not found.")
 
     _raw_token_csrf, signed_token_for_cookie = csrf_protect.generate_csrf_tokens()
     if not _raw_token_csrf or not signed_token_for_cookie:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="CSRF token generation failed on server.")
 
-    html_content_processed = html_content_original
-    
-    csrf_placeholder = "%%CSRF_TOKEN_RAW%%"
-    if csrf_placeholder in html_content_processed:
-        html_content_processed = html_content_processed.replace(csrf_placeholder, _raw_token_csrf)
-    
+    placeholder_values = {CSRF_TOKEN_PLACEHOLDER.encode("utf-8"): _raw_token_csrf.encode("utf-8")}
     if replacements:
         for key, value in replacements.items():
-            if key in html_content_processed:
-                html_content_processed = html_content_processed.replace(key, str(value))
+            placeholder_values[key.encode("utf-8")] = str(value).encode("utf-8")
 
-    response = HTMLResponse(content=html_content_processed)
+    # Odd indices hold placeholders; ones without a value are left in the page as-is.
+    parts = list(template_segments)
+    for i in range(1, len(parts), 2):
+        parts[i] = placeholder_values.get(parts[i], parts[i])
+
+    response = HTMLResponse(content=b"".join(parts))
     try:
         csrf_protect.set_csrf_cookie(response=response, csrf_signed_token=signed_token_for_cookie)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Failed to set CSRF cookie for %s", file_path.name)
 
     return response
 
-@app.patch("/api/sessions/{session_id}", response_model=models.SessionResponseModel, tags=["Sessions"])
-async def update_session_name(
-    request: Request,
-    session_id: str = FastApiPath(..., description="The ID of the session to update."),
-    update_data: models.SessionUpdateRequest = Body(...),
-    user: Dict[str, Any] = Depends(auth.get_current_active_user),
-    csrf_protect: CsrfProtect = Depends()
-):
-    await csrf_protect.validate_csrf(request)
-    user_id = user['id']
-    new_name = update_data.name
-
-    conn = None
-    try:
-        conn = database.get_db_connection()
+def _rename_session_sync(session_id: str, user_id: int, new_name: str) -> Optional[sqlite3.Row]:
+    """Renames a session the user participates in and returns the updated row; runs on the database executor."""
+    # `with conn` commits on success and rolls back on any exception, HTTPExceptions included;
+    # database errors are turned into a 500 by the app-wide sqlite3.Error handler.
+    with database.get_conn() as conn, conn:
         cursor = conn.cursor()
 
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user_id))
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user_id))
         if not cursor.fetchone():
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to modify this session.")
 
@@ -151,30 +206,27 @@ async def update_session_name(
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found.")
         
         cursor.execute("SELECT * FROM sessions WHERE id = ?", (session_id,))
-        updated_session_row = cursor.fetchone()
-        conn.commit()
+        return cursor.fetchone()
 
-        if not updated_session_row:
-             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found after update.")
+@app.patch("/api/sessions/{session_id}", response_model=models.SessionResponseModel, tags=["Sessions"])
+async def update_session_name(
+    request: Request,
+    session_id: str = FastApiPath(..., description="The ID of the session to update."),
+    update_data: models.SessionUpdateRequest = Body(...),
+    user: Dict[str, Any] = Depends(auth.get_current_active_user),
+    csrf_protect: CsrfProtect = Depends()
+):
+    await csrf_protect.validate_csrf(request)
+    updated_session_row = await database.run_in_db_thread(_rename_session_sync, session_id, user['id'], update_data.name)
 
-        state.remove_memory_for_client(session_id)
+    if not updated_session_row:
+         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found after update.")
 
-        session_data = dict(updated_session_row)
-        return models.SessionResponseModel(**session_data)
+    state.remove_memory_for_client(session_id)
+    state.invalidate_sessions_list_cache()
 
-    except HTTPException as http_exc:
-        if conn: conn.rollback()
-        raise http_exc
-    except sqlite3.Error as db_err:
-        if conn: conn.rollback()
-        traceback.print_exc()
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error while updating session.")
-    except Exception as e:
-        if conn: conn.rollback()
-        traceback.print_exc()
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An unexpected error occurred.")
-    finally:
-        if conn: conn.close()
+    session_data = dict(updated_session_row)
+    return models.SessionResponseModel(**session_data)
 
 @app.get("/preview/{project_id}/{path:path}", tags=["Preview"])
 async def preview_proxy(project_id: str, path: str, request: Request):
@@ -217,7 +269,7 @@ async def preview_proxy(project_id: str, path: str, request: Request):
             error_message = f"Could not communicate with the preview server: {exc.__class__.__name__}. It might still be starting up. Please wait a moment and refresh."
             return await generate_preview_error_page(project_id, error_message)
         except Exception as exc:
-            traceback.print_exc()
+            logger.exception("Unexpected error proxying preview for project %s", project_id)
             error_message = f"An unexpected proxy error occurred: {exc}"
             return await generate_preview_error_page(project_id, error_message)
 
@@ -266,8 +318,7 @@ async def get_login_page_route(
     csrf_protect: CsrfProtect = Depends()
 ) -> Response:
     if user:
-        session_choice_url = request.url_for("get_session_choice_page")
-        return RedirectResponse(url=str(session_choice_url), status_code=status.HTTP_302_FOUND)
+        return RedirectResponse(url=_get_session_choice_page_path(), status_code=status.HTTP_302_FOUND)
 
     login_html_path = config.STATIC_DIR / "login.html"
     return await serve_html_with_csrf(login_html_path, request, csrf_protect)
@@ -279,8 +330,7 @@ async def get_session_choice_page_route(
     csrf_protect: CsrfProtect = Depends()
 ) -> Response:
     if user is None:
-        login_url = request.url_for("get_login_page_route")
-        return RedirectResponse(url=str(login_url), status_code=status.HTTP_302_FOUND)
+        return RedirectResponse(url=_get_login_page_path(), status_code=status.HTTP_302_FOUND)
 
     session_choice_html_path = config.STATIC_DIR / "session-choice.html"
     replacements = {"[User Name]": user.get("name", "User")}
@@ -306,7 +356,7 @@ async def download_project_zip(
 
         # 2. Security Check: Verify the user is a participant in the project's session
         session_id = project_row["session_id"]
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user['id']))
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user['id']))
         if not cursor.fetchone():
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to access this project.")
 
@@ -357,7 +407,7 @@ async def upload_file_to_project(
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found.")
 
         session_id = project_row["session_id"]
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user['id']))
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user['id']))
         if not cursor.fetchone():
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
 
@@ -391,7 +441,7 @@ async def upload_file_to_project(
 
     except Exception as e:
         if conn: conn.rollback()
-        traceback.print_exc()
+        logger.exception("Failed to upload file to project %s", project_id)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     finally:
         if conn: conn.close()
@@ -420,7 +470,7 @@ async def move_file_in_project(
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found.")
 
         session_id = project_row["session_id"]
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user['id']))
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user['id']))
         if not cursor.fetchone():
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
 
@@ -455,7 +505,7 @@ async def move_file_in_project(
 
     except Exception as e:
         if conn: conn.rollback()
-        traceback.print_exc()
+        logger.exception("Failed to move file in project %s", project_id)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     finally:
         if conn: conn.close()
@@ -476,7 +526,7 @@ async def get_project_version(
         if not project_row:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found.")
 
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (project_row["session_id"], user['id']))
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (project_row["session_id"], user['id']))
         if not cursor.fetchone():
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
 
@@ -495,45 +545,36 @@ async def get_project_version(
         if conn:
             conn.close()
 
-@app.get("/chat/{session_id}", response_class=HTMLResponse, name="get_chat_page_for_session", tags=["Pages"])
-async def get_chat_page_for_session(
-    request: Request,
-    session_id: str = FastApiPath(..., description="The ID of the chat session to load."),
-    user: Dict[str, Any] = Depends(auth.get_current_active_user),
-    csrf_protect: CsrfProtect = Depends()
-):
-    user_id = user['id']
-    session_name_for_html = "Chat Session"
-    conn = None
-    try:
-        conn = database.get_db_connection()
+def _open_session_page_sync(session_id: str, user_id: int, touch_last_accessed: bool) -> str:
+    """Checks the user may open an active session and returns its name; runs on the database executor."""
+    with database.get_conn() as conn, conn:
         cursor = conn.cursor()
         
-        cursor.execute("SELECT id, name FROM sessions WHERE id = ? AND is_active = 1", (session_id,))
+        cursor.execute(database.SQL_SELECT_ACTIVE_SESSION_ACCESS, (user_id, session_id))
         session_row = cursor.fetchone()
         
         if not session_row:
             raise HTTPException(status_code=404, detail="Chat session not found or is inactive.")
-        
-        session_name_for_html = session_row["name"]
-
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user_id))
-        if not cursor.fetchone():
+        if not session_row["is_participant"]:
             raise HTTPException(status_code=403, detail="You do not have access to this chat session.")
+        
+        if touch_last_accessed:
+            cursor.execute(database.SQL_UPDATE_SESSION_LAST_ACCESSED, (utils.utc_now_iso(), session_id))
+        return session_row["name"]
 
-        current_time_utc_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        cursor.execute("UPDATE sessions SET last_accessed_at = ? WHERE id = ?", (current_time_utc_iso, session_id))
-        conn.commit()
-
-    except HTTPException as http_exc:
-        if conn: conn.rollback()
-        raise http_exc
-    except Exception as e:
-        if conn: conn.rollback()
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail="Error verifying session access for chat page.")
-    finally:
-        if conn: conn.close()
+@app.get("/chat/{session_id}", response_class=HTMLResponse, name="get_chat_page_for_session", tags=["Pages"])
+async def get_chat_page_for_session(
+    request: Request,
+    session_id: str = FastApiPath(..., description="The ID of the chat session to load."),
+    user: Dict[str, Any] = Depends(auth.get_current_active_user),
+    csrf_protect: CsrfProtect = Depends()
+):
+    # Page refreshes don't need sub-minute last_accessed_at precision; skip the write (and fsync) if recent.
+    now_monotonic = time.monotonic()
+    touch_last_accessed = now_monotonic - state.last_accessed_cache.get(session_id, float("-inf")) >= state.LAST_ACCESSED_WRITE_INTERVAL_SECONDS
+    session_name_for_html = await database.run_in_db_thread(_open_session_page_sync, session_id, user['id'], touch_last_accessed)
+    if touch_last_accessed:
+        state.record_last_accessed_write(session_id, now_monotonic)
 
     chat_html_path = config.STATIC_DIR / "chat-session.html"
     replacements = {"%%SESSION_NAME_PLACEHOLDER%%": utils.escape_html(session_name_for_html)}
@@ -548,6 +589,11 @@ async def get_settings_page(
     settings_html_path = config.STATIC_DIR / "settings.html"
     return await serve_html_with_csrf(settings_html_path, request, csrf_protect)
 
+def _fetch_active_user_name_sync(email: str) -> Optional[str]:
+    with database.get_conn() as conn:
+        user_row = conn.execute("SELECT name FROM users WHERE email = ? AND is_active = 1", (email,)).fetchone()
+        return user_row["name"] if user_row else None
+
 @app.post("/check_email", response_model=models.EmailCheckResponse, tags=["Authentication"])
 async def check_email_exists_route(
     request: Request,
@@ -556,20 +602,20 @@ async def check_email_exists_route(
 ):
     await csrf_protect.validate_csrf(request)
     email_to_check = request_data.email.lower().strip()
-    conn = None
     try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM users WHERE email = ? AND is_active = 1", (email_to_check,))
-        user_row = cursor.fetchone()
-        if user_row:
-            return models.EmailCheckResponse(exists=True, user_name=user_row["name"])
-        else:
-            return models.EmailCheckResponse(exists=False, user_name=None)
+        user_name = await database.run_in_db_thread(_fetch_active_user_name_sync, email_to_check)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error checking email.")
-    finally:
-        if conn: conn.close()
+    if user_name is not None:
+        return models.EmailCheckResponse(exists=True, user_name=user_name)
+    return models.EmailCheckResponse(exists=False, user_name=None)
+
+def _fetch_login_user_sync(email: str) -> Optional[Dict[str, Any]]:
+    with database.get_conn() as conn:
+        user_row = conn.execute(
+            "SELECT id, name, email, password_hash, is_active FROM users WHERE email = ?", (email,)
+        ).fetchone()
+        return dict(user_row) if user_row else None
 
 @app.post("/token", response_model=models.Token, tags=["Authentication"])
 async def login_for_access_token(
@@ -581,32 +627,72 @@ async def login_for_access_token(
     await csrf_protect.validate_csrf(request)
     email = form_data.username.lower().strip()
     password = form_data.password
-    conn = None
-    try:
-        conn = database.get_db_connection()
-        user_dict = auth.authenticate_user_from_db(conn, email, password)
-        if not user_dict:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password.")
-        
-        if not user_dict["is_active"]:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is inactive.")
-        
-        session_token_raw = await auth.create_user_session(response=response, user_id=user_dict["id"])
-        
-        _raw_token_new, signed_token_for_cookie_new = csrf_protect.generate_csrf_tokens()
-        csrf_protect.set_csrf_cookie(response=response, csrf_signed_token=signed_token_for_cookie_new)
-        
-        return models.Token(
-            access_token=session_token_raw, 
-            token_type="bearer",
-            user_id=user_dict["id"], 
-            user_name=user_dict["name"], 
-            user_email=user_dict["email"]
+    user_dict = await database.run_in_db_thread(_fetch_login_user_sync, email)
+    # bcrypt runs on the default executor, not the small DB pool: a burst of logins must not hold
+    # up session lookups and message saves, and needs no pooled connection while it hashes.
+    stored_password_hash = user_dict.pop("password_hash", None) if user_dict else None
+    if not stored_password_hash or not await asyncio.to_thread(auth.verify_password, password, stored_password_hash):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password.")
+    
+    if not user_dict["is_active"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is inactive.")
+    
+    session_token_raw = await auth.create_user_session(response=response, user_id=user_dict["id"])
+    
+    _raw_token_new, signed_token_for_cookie_new = csrf_protect.generate_csrf_tokens()
+    csrf_protect.set_csrf_cookie(response=response, csrf_signed_token=signed_token_for_cookie_new)
+    
+    return models.Token(
+        access_token=session_token_raw, 
+        token_type="bearer",
+        user_id=user_dict["id"], 
+        user_name=user_dict["name"], 
+        user_email=user_dict["email"]
+    )
+
+_SQL_INSERT_SESSION_SELECT = """INSERT INTO sessions (id, host_user_id, name, access_level, passcode_hash, created_at, last_accessed_at)
+    SELECT ?, ?, ?, ?, ?, datetime('now', 'utc'), datetime('now', 'utc')"""
+_SQL_INSERT_SESSION_UNLESS_SHARED_NAME_TAKEN = _SQL_INSERT_SESSION_SELECT + """
+    WHERE NOT EXISTS (SELECT 1 FROM sessions WHERE name = ? AND access_level IN ('public', 'protected') AND is_active = 1)
+    RETURNING *"""
+_SQL_INSERT_SESSION_UNLESS_PRIVATE_NAME_TAKEN = _SQL_INSERT_SESSION_SELECT + """
+    WHERE NOT EXISTS (SELECT 1 FROM sessions WHERE name = ? AND host_user_id = ? AND access_level = 'private' AND is_active = 1)
+    RETURNING *"""
+_SQL_INSERT_SESSION = _SQL_INSERT_SESSION_SELECT + """
+    RETURNING *"""
+
+def _insert_session_sync(new_session_id: str, host_user_id: int, session_data: models.HostSessionRequest, passcode_hash: Optional[str]) -> sqlite3.Row:
+    """Creates a session with its host as the first participant; runs on the database executor."""
+    with database.get_conn() as conn, conn:
+        cursor = conn.cursor()
+
+        # The name-conflict check and the insert are one statement: no row comes back if a
+        # conflicting active session exists, which also closes the check-then-insert race.
+        if session_data.access_level in ['public', 'protected']:
+            insert_sql = _SQL_INSERT_SESSION_UNLESS_SHARED_NAME_TAKEN
+            conflict_params = (session_data.name,)
+        elif session_data.access_level == 'private':
+            insert_sql = _SQL_INSERT_SESSION_UNLESS_PRIVATE_NAME_TAKEN
+            conflict_params = (session_data.name, host_user_id)
+        else:
+            insert_sql = _SQL_INSERT_SESSION
+            conflict_params = ()
+
+        cursor.execute(
+            insert_sql,
+            (new_session_id, host_user_id, session_data.name, session_data.access_level, passcode_hash) + conflict_params
         )
-    except HTTPException as http_exc:
-        raise http_exc
-    finally:
-        if conn: conn.close()
+        new_session_row = cursor.fetchone()
+        if not new_session_row:
+            if session_data.access_level == 'private':
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="You already have an active private session with this name.")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A public or protected session with this name already exists.")
+
+        cursor.execute(
+            "INSERT INTO session_participants (session_id, user_id) VALUES (?, ?)",
+            (new_session_id, host_user_id)
+        )
+        return new_session_row
 
 @app.post("/sessions/create", response_model=models.SessionResponseModel, tags=["Sessions"])
 async def create_new_session_route(
@@ -617,81 +703,39 @@ async def create_new_session_route(
 ):
     await csrf_protect.validate_csrf(request)
     host_user_id = user["id"]
-    new_session_id = str(uuid.uuid4())
+    new_session_id = uuid.uuid4().hex
     passcode_hash = None
 
     if session_data.access_level in ['protected', 'unlisted'] and not session_data.passcode:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A passcode is required for protected or unlisted sessions.")
     
     if session_data.passcode:
-        passcode_hash = auth.get_password_hash(session_data.passcode)
-
-    conn = None
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-
-        if session_data.access_level in ['public', 'protected']:
-            cursor.execute(
-                "SELECT id FROM sessions WHERE name = ? AND access_level IN ('public', 'protected') AND is_active = 1",
-                (session_data.name,)
-            )
-            if cursor.fetchone():
-                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A public or protected session with this name already exists.")
-        
-        elif session_data.access_level == 'private':
-            cursor.execute(
-                "SELECT id FROM sessions WHERE name = ? AND host_user_id = ? AND access_level = 'private' AND is_active = 1",
-                (session_data.name, host_user_id)
-            )
-            if cursor.fetchone():
-                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="You already have an active private session with this name.")
-
-        cursor.execute(
-            """INSERT INTO sessions (id, host_user_id, name, access_level, passcode_hash, created_at, last_accessed_at) 
-               VALUES (?, ?, ?, ?, ?, datetime('now', 'utc'), datetime('now', 'utc'))""",
-            (new_session_id, host_user_id, session_data.name, session_data.access_level, passcode_hash)
-        )
+        passcode_hash = await asyncio.to_thread(auth.get_password_hash, session_data.passcode)
 
-        cursor.execute(
-            "INSERT INTO session_participants (session_id, user_id) VALUES (?, ?)",
-            (new_session_id, host_user_id)
+    new_session_row = await database.run_in_db_thread(
+        _insert_session_sync, new_session_id, host_user_id, session_data, passcode_hash
+    )
+    session_dict = dict(new_session_row)
+    # A new public or protected session shows up in everyone's joinable list.
+    state.invalidate_sessions_list_cache(None if session_dict['access_level'] in ['public', 'protected'] else host_user_id)
+
+    if session_dict['access_level'] in ['public', 'protected']:
+        broadcast_payload = models.SessionResponseModel(
+            id=session_dict['id'],
+            name=session_dict['name'],
+            created_at=session_dict['created_at'],
+            last_active=session_dict['last_accessed_at'],
+            host_user_id=session_dict['host_user_id'],
+            is_member=False,
+            access_level=session_dict['access_level']
         )
-        
-        conn.commit()
-
-        cursor.execute("SELECT * FROM sessions WHERE id = ?", (new_session_id,))
-        new_session_row = cursor.fetchone()
-        
-        session_dict = dict(new_session_row)
-
-        if session_dict['access_level'] in ['public', 'protected']:
-            broadcast_payload = models.SessionResponseModel(
-                id=session_dict['id'],
-                name=session_dict['name'],
-                created_at=session_dict['created_at'],
-                last_active=session_dict['last_accessed_at'],
-                host_user_id=session_dict['host_user_id'],
-                is_member=False,
-                access_level=session_dict['access_level']
-            )
-            await state.broadcast_to_lobby({
-                "type": "new_public_session",
-                "payload": broadcast_payload.model_dump()
-            })
-        
-        session_dict['is_member'] = True
-        return models.SessionResponseModel(**session_dict)
-
-    except HTTPException as http_exc:
-        if conn: conn.rollback()
-        raise http_exc
-    except sqlite3.Error as db_err:
-        if conn: conn.rollback()
-        traceback.print_exc()
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error creating session.")
-    finally:
-        if conn: conn.close()
+        await state.broadcast_to_lobby({
+            "type": "new_public_session",
+            "payload": broadcast_payload.model_dump()
+        })
+    
+    session_dict['is_member'] = True
+    return models.SessionResponseModel(**session_dict)
 
 # In app/main.py
 
@@ -714,7 +758,7 @@ async def get_project_details(
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found.")
 
         session_id = project_row["session_id"]
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user['id']))
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user['id']))
         if not cursor.fetchone():
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have access to this project's session.")
 
@@ -765,7 +809,7 @@ async def register_new_user(
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This email address is already registered.")
         
         plain_password = database.generate_secure_token(12)
-        hashed_password = auth.get_password_hash(plain_password)
+        hashed_password = await asyncio.to_thread(auth.get_password_hash, plain_password)
         
         cursor.execute(
             "INSERT INTO users (name, email, password_hash, is_active, created_at, updated_at) VALUES (?, ?, ?, ?, datetime('now'), datetime('now'))",
@@ -776,10 +820,7 @@ async def register_new_user(
             conn.rollback()
             raise sqlite3.Error("User insertion failed to return an ID.")
 
-        login_url_from_fastapi = str(request.url_for('get_login_page_route'))
-        parsed_base_url = urlparse(config.BASE_URL)
-        parsed_login_route_url = urlparse(login_url_from_fastapi)
-        login_page_url = parsed_base_url._replace(path=parsed_login_route_url.path).geturl()
+        login_page_url = _get_public_login_page_url()
         
         email_sent = await email_utils.send_registration_password_email(
             recipient_email=email, recipient_name=name, generated_password=plain_password, login_url=login_page_url
@@ -845,14 +886,11 @@ async def handle_forgot_password(
         user_name = user_row["name"]
 
         new_plain_password = database.generate_secure_token(12)
-        new_hashed_password = auth.get_password_hash(new_plain_password)
+        new_hashed_password = await asyncio.to_thread(auth.get_password_hash, new_plain_password)
 
         cursor.execute("UPDATE users SET password_hash = ?, updated_at = datetime('now') WHERE id = ?", (new_hashed_password, user_id))
         
-        login_url_from_fastapi = str(request.url_for('get_login_page_route'))
-        parsed_base_url = urlparse(config.BASE_URL)
-        parsed_login_route_url = urlparse(login_url_from_fastapi)
-        login_page_url = parsed_base_url._replace(path=parsed_login_route_url.path).geturl()
+        login_page_url = _get_public_login_page_url()
         
         email_sent = await email_utils.send_password_reset_email(
             recipient_email=email, recipient_name=user_name, new_password=new_plain_password, login_url=login_page_url
@@ -914,7 +952,7 @@ async def update_user_llm_settings(
     try:
         conn = database.get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT selected_llm_provider_id, selected_llm_model_id, user_llm_api_key_encrypted, selected_llm_base_url FROM users WHERE id = ?", (user_id,))
+        cursor.execute(database.SQL_FETCH_USER_LLM_SETTINGS, (user_id,))
         current_db_settings = cursor.fetchone()
         if not current_db_settings:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User settings record not found.")
@@ -932,6 +970,7 @@ async def update_user_llm_settings(
             (final_provider_id, final_model_id, final_api_key_encrypted, final_base_url_str, user_id)
         )
         conn.commit()
+        state.invalidate_llm_settings_cache(user_id)
 
         has_user_api_key = bool(final_api_key_encrypted)
         updated_base_url_obj = HttpUrl(final_base_url_str) if final_base_url_str else None
@@ -965,28 +1004,29 @@ async def regenerate_user_password(
         cursor = conn.cursor()
         cursor.execute("SELECT password_hash FROM users WHERE id = ?", (user_id,))
         user_record = cursor.fetchone()
-        if not user_record or not auth.verify_password(payload.current_password, user_record["password_hash"]):
+        if not user_record or not await asyncio.to_thread(auth.verify_password, payload.current_password, user_record["password_hash"]):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect current password.")
 
         new_plain_password = database.generate_secure_token(12)
-        new_hashed_password = auth.get_password_hash(new_plain_password)
+        new_hashed_password = await asyncio.to_thread(auth.get_password_hash, new_plain_password)
         
         cursor.execute("UPDATE users SET password_hash = ?, updated_at = datetime('now') WHERE id = ?", (new_hashed_password, user_id))
         
-        login_url = request.url_for('get_login_page_route')
+        login_url = str(request.base_url).rstrip("/") + _get_login_page_path()
         email_sent = await email_utils.send_password_reset_email(
-            recipient_email=user_email, recipient_name=user_name, new_password=new_plain_password, login_url=str(login_url)
+            recipient_email=user_email, recipient_name=user_name, new_password=new_plain_password, login_url=login_url
         )
         if not email_sent:
             conn.rollback()
             raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Password change rolled back due to email failure.")
 
-        now_utc_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        now_utc_iso = utils.utc_now_iso()
         cursor.execute(
             "UPDATE auth_tokens SET used_at = ?, expires_at = ? WHERE user_id = ? AND token_type = 'session' AND used_at IS NULL",
             (now_utc_iso, now_utc_iso, user_id)
         )
         conn.commit()
+        auth.invalidate_cached_sessions_for_user(user_id)
         return models.RegeneratePasswordResponse(message="Password regenerated successfully. Please check your email.")
     except HTTPException as http_exc:
         if conn: conn.rollback()
@@ -1014,7 +1054,7 @@ async def update_user_email(
         cursor = conn.cursor()
         cursor.execute("SELECT password_hash FROM users WHERE id = ?", (user_id,))
         user_record = cursor.fetchone()
-        if not user_record or not auth.verify_password(payload.current_password, user_record["password_hash"]):
+        if not user_record or not await asyncio.to_thread(auth.verify_password, payload.current_password, user_record["password_hash"]):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect current password.")
 
         cursor.execute("SELECT id FROM users WHERE email = ? AND id != ?", (new_email_normalized, user_id))
@@ -1023,12 +1063,13 @@ async def update_user_email(
 
         cursor.execute("UPDATE users SET email = ?, updated_at = datetime('now') WHERE id = ?", (new_email_normalized, user_id))
         
-        now_utc_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        now_utc_iso = utils.utc_now_iso()
         cursor.execute(
             "UPDATE auth_tokens SET used_at = ?, expires_at = ? WHERE user_id = ? AND token_type = 'session' AND used_at IS NULL",
             (now_utc_iso, now_utc_iso, user_id)
         )
         conn.commit()
+        auth.invalidate_cached_sessions_for_user(user_id)
         return models.UpdateEmailResponse(message="Email updated. You will be logged out.", new_email=new_email_normalized)
     except HTTPException as http_exc:
         if conn: conn.rollback()
@@ -1056,11 +1097,12 @@ async def update_user_name(
         cursor = conn.cursor()
         cursor.execute("SELECT password_hash FROM users WHERE id = ?", (user_id,))
         user_record = cursor.fetchone()
-        if not user_record or not auth.verify_password(update_data.current_password, user_record["password_hash"]):
+        if not user_record or not await asyncio.to_thread(auth.verify_password, update_data.current_password, user_record["password_hash"]):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect current password.")
 
         cursor.execute("UPDATE users SET name = ?, updated_at = datetime('now') WHERE id = ?", (new_name_stripped, user_id))
         conn.commit()
+        auth.invalidate_cached_sessions_for_user(user_id)
         return models.UpdateNameResponse(message="Name updated successfully.", new_name=new_name_stripped)
     except HTTPException as http_exc:
         if conn: conn.rollback()
@@ -1080,19 +1122,22 @@ async def list_llm_providers(
 
         provider_can_use_key = provider_id in config.PROVIDERS_TYPICALLY_USING_API_KEYS
         
-        response_providers.append(
-            models.LLMProviderDetail(
-                id=provider_id,
-                display_name=provider_data.get("display_name", provider_id),
-                type=provider_runtime_config.get("type", "unknown"),
-                is_system_configured=False, # This is now always False
-                can_accept_user_api_key=provider_can_use_key,
-                needs_api_key_from_user=provider_can_use_key, # If a key can be used, it's now always required from the user
-                available_models=[models.LLMAvailableModel(**m) for m in provider_data.get("available_models", [])],
-                can_accept_user_base_url=provider_runtime_config.get("type") == "openai_compatible"
-            )
-        )
-    return response_providers
+        # Built from our own static config, so returned as plain dicts in the shape of
+        # models.LLMProviderDetail without a response-model validation pass.
+        response_providers.append({
+            "id": provider_id,
+            "display_name": provider_data.get("display_name", provider_id),
+            "type": provider_runtime_config.get("type", "unknown"),
+            "is_system_configured": False, # This is now always False
+            "can_accept_user_api_key": provider_can_use_key,
+            "needs_api_key_from_user": provider_can_use_key, # If a key can be used, it's now always required from the user
+            "available_models": [
+                {"model_id": m["model_id"], "display_name": m["display_name"], "context_window": m.get("context_window")}
+                for m in provider_data.get("available_models", [])
+            ],
+            "can_accept_user_base_url": provider_runtime_config.get("type") == "openai_compatible"
+        })
+    return JSONResponse(content=response_providers)
 
 @app.get("/api/me/llm-settings", response_model=models.UserLLMSettingsResponse, tags=["User Account Management", "LLM Configuration"])
 async def get_user_llm_settings(
@@ -1103,12 +1148,19 @@ async def get_user_llm_settings(
     try:
         conn = database.get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT selected_llm_provider_id, selected_llm_model_id, user_llm_api_key_encrypted, selected_llm_base_url FROM users WHERE id = ?", (user_id,))
+        # Only the presence of a stored key matters here, so let SQLite answer that
+        # instead of shipping the ciphertext back to Python.
+        cursor.execute(
+            """SELECT selected_llm_provider_id, selected_llm_model_id, selected_llm_base_url,
+                      (user_llm_api_key_encrypted IS NOT NULL AND user_llm_api_key_encrypted != '') AS has_user_api_key
+               FROM users WHERE id = ?""",
+            (user_id,)
+        )
         settings = cursor.fetchone()
         if not settings:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User LLM settings not found.")
         
-        has_key = bool(settings["user_llm_api_key_encrypted"])
+        has_key = bool(settings["has_user_api_key"])
         base_url = HttpUrl(settings["selected_llm_base_url"]) if settings["selected_llm_base_url"] else None
         
         provider_id = settings["selected_llm_provider_id"]
@@ -1135,12 +1187,13 @@ async def get_user_llm_settings(
 @app.get("/logout", tags=["Authentication"])
 async def logout_route(
     request: Request,
-    response: FastAPIResponse,
     session_token_value: Optional[str] = Depends(auth.cookie_scheme)
 ):
+    # The cookie deletion must be set on the response that is actually returned; headers put on
+    # an injected Response parameter are dropped when the route returns its own Response.
+    response = RedirectResponse(url=_get_login_page_path(), status_code=status.HTTP_303_SEE_OTHER)
     await auth.logout_user(response, session_token_value)
-    redirect_url = request.url_for('get_login_page_route')
-    return RedirectResponse(url=str(redirect_url), status_code=status.HTTP_302_FOUND)
+    return response
 
 @app.get("/api/me", response_model=models.UserResponseModel, tags=["Users"])
 async def get_current_user_details(
@@ -1152,16 +1205,17 @@ async def get_current_user_details(
 async def get_session_code_execution_results(
     session_id: str = FastApiPath(..., description="The ID of the session to fetch code results for."),
     user: Dict[str, Any] = Depends(auth.get_current_active_user)
-) -> List[Dict[str, Any]]:
+) -> Response:
     user_id = user.get('id')
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user_id))
-    if not cursor.fetchone():
+    try:
+        cursor = conn.cursor()
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user_id))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
+        return JSONResponse(content=database.get_code_execution_results(session_id, conn=conn))
+    finally:
         conn.close()
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
-    conn.close()
-    return database.get_code_execution_results(session_id)
 
 
 @app.get("/api/sessions/{session_id}/edited-blocks", response_model=Dict[str, str], tags=["Sessions"])
@@ -1170,87 +1224,112 @@ async def get_session_edited_blocks(
     user: Dict[str, Any] = Depends(auth.get_current_active_user)
 ):
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user['id']))
-    if not cursor.fetchone():
+    try:
+        cursor = conn.cursor()
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user['id']))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
+        return database.get_edited_code_blocks(session_id, conn=conn)
+    finally:
         conn.close()
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
-    conn.close()
-    return database.get_edited_code_blocks(session_id)
 
-@app.get("/api/sessions/{session_id}/messages", response_model=List[models.MessageItem], tags=["Messages"])
+# Optional MessageItem fields that are not columns of chat_messages.
+_MESSAGE_ITEM_DEFAULTS: Dict[str, Any] = {
+    "sender_initials": None, "sender_color": None,
+    "project_name": None, "project_files": None, "project_commits": None,
+}
+
+MESSAGES_FETCH_BATCH_SIZE = 500
+
+def _fetch_visible_messages_sync(
+    session_id: str, user_id: int, since: Optional[str] = None, limit: Optional[int] = None,
+    since_id: Optional[int] = None
+) -> Optional[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """
+    Returns the session's messages not hidden by the user (optionally only those after the
+    (`since`, `since_id`) position, at most `limit` of them) plus the rows of the projects they reference, or None if the user
+    is not a participant. Runs in a worker thread.
+    """
+    with database.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        
+        cursor.execute(
+            database.SQL_SELECT_VISIBLE_MESSAGES_FOR_PARTICIPANT,
+            (since, since, since, since_id, session_id, user_id, -1 if limit is None else limit)
+        )
+        # Rows are turned into dicts batch by batch rather than holding a fetchall() list as well.
+        # Plain tuples zipped with the column names once are cheaper than sqlite3.Row -> dict.
+        columns = tuple(d[0] for d in cursor.description)
+        id_index = columns.index('id')
+        is_participant = False
+        messages_rows = []
+        while True:
+            batch = cursor.fetchmany(MESSAGES_FETCH_BATCH_SIZE)
+            if not batch:
+                break
+            is_participant = True
+            messages_rows.extend(dict(zip(columns, row)) for row in batch if row[id_index] is not None)
+        if not is_participant:
+            return None
+        
+        project_ids_to_fetch = {msg['project_id'] for msg in messages_rows if msg.get('project_id')}
+        project_rows = database.get_projects_by_ids(conn, list(project_ids_to_fetch)) if project_ids_to_fetch else []
+        return messages_rows, project_rows
+
+# Handlers that return a Response are sent as-is; `responses` only documents the shape for OpenAPI.
+@app.get("/api/sessions/{session_id}/messages", responses={200: {"model": List[models.MessageItem]}}, tags=["Messages"])
 async def get_chat_messages_for_session(
     session_id: str = FastApiPath(..., description="The ID of the session to fetch messages for."),
+    since: Optional[str] = Query(None, description="Only return messages with a timestamp after this one."),
+    since_id: Optional[int] = Query(None, description="ID of the last message already received; with `since`, also returns later messages sharing that timestamp."),
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Maximum number of messages to return."),
     user: Dict[str, Any] = Depends(auth.get_current_active_user)
-) -> List[models.MessageItem]:
+) -> Response:
     user_id = user.get('id')
-    conn = None
     project_info_map: Dict[str, Dict[str, Any]] = {}
 
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user_id))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
-        
-        cursor.execute("""
-            SELECT m.* FROM chat_messages m
-            LEFT JOIN hidden_messages h ON m.id = h.message_id AND h.user_id = ?
-            WHERE m.session_id = ? AND h.message_id IS NULL
-            ORDER BY m.timestamp ASC
-        """, (user_id, session_id))
-        messages_rows = [dict(row) for row in cursor.fetchall()]
-        
-        project_ids_to_fetch = {msg['project_id'] for msg in messages_rows if msg.get('project_id')}
+    fetched = await database.run_in_db_thread(_fetch_visible_messages_sync, session_id, user_id, since, limit, since_id)
+    if fetched is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
+    messages_rows, project_rows = fetched
 
-        if project_ids_to_fetch:
-            project_rows = database.get_projects_by_ids(conn, list(project_ids_to_fetch))
-            
-            for project_row in project_rows:
-                project_details, error = await asyncio.to_thread(project_utils.unpack_git_repo_from_blob, project_row['git_repo_blob'])
-                if error or not project_details:
-                    print(f"!!! LOGGING ERROR: Error unpacking project {project_row['id']}: {error}")
-                    continue
-                
-                project_info_map[project_row['id']] = {
-                    "name": project_row['name'],
-                    "files": project_details.get("files", []),
-                    "commits": project_details.get("commits", [])
-                }
-
-        messages_to_return = []
-        for msg_row in messages_rows:
-            project_id = msg_row.get('project_id')
-            if project_id and project_id in project_info_map:
-                project_details = project_info_map[project_id]
-                msg_row['project_files'] = project_details['files']
-                msg_row['project_name'] = project_details['name']
-                msg_row['project_commits'] = project_details['commits']
-
-            messages_to_return.append(models.MessageItem(**msg_row))
-
-        # --- START: DETAILED LOGGING ---
-        print("\n" + "="*20 + " DETAILED BACKEND LOG: DATA SENT TO FRONTEND " + "="*20)
+    for project_row in project_rows:
+        project_details, error = await asyncio.to_thread(project_utils.unpack_git_repo_from_blob, project_row['git_repo_blob'])
+        if error or not project_details:
+            logger.error("Error unpacking project %s: %s", project_row['id'], error)
+            continue
+        
+        project_info_map[project_row['id']] = {
+            "name": project_row['name'],
+            "files": project_details.get("files", []),
+            "commits": project_details.get("commits", [])
+        }
+
+    # Rows come straight from our own schema, so they are returned as plain dicts in the
+    # shape of models.MessageItem instead of being re-validated through the response model.
+    messages_to_return = []
+    for msg_row in messages_rows:
+        message = {**_MESSAGE_ITEM_DEFAULTS, **msg_row}
+        project_id = msg_row.get('project_id')
+        if project_id and project_id in project_info_map:
+            project_details = project_info_map[project_id]
+            message['project_files'] = project_details['files']
+            message['project_name'] = project_details['name']
+            message['project_commits'] = project_details['commits']
+
+        messages_to_return.append(message)
+
+    # --- START: DETAILED LOGGING ---
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("DETAILED BACKEND LOG: %d messages sent to frontend for session %s", len(messages_to_return), session_id)
         for msg in messages_to_return:
-            msg_dict = msg.model_dump()
-            has_project_files = 'project_files' in msg_dict and msg_dict['project_files'] is not None
-            print(f"  - Message ID: {msg_dict['id']}, Type: {msg_dict['sender_type']}, Project ID: {msg_dict['project_id']}")
-            if has_project_files:
-                print(f"    - Found {len(msg_dict['project_files'])} files. Inspecting each file:")
-                for i, file_dict in enumerate(msg_dict['project_files']):
-                    print(f"      - File #{i+1}: path='{file_dict.get('path')}', has_language_key={'language' in file_dict}, language_value='{file_dict.get('language')}'")
-            else:
-                print("    - No project files attached.")
-        print("="*78 + "\n")
-        # --- END: DETAILED LOGGING ---
-            
-        return messages_to_return
-
-    finally:
-        if conn:
-            conn.close()
+            logger.debug("  - Message ID: %s, Type: %s, Project ID: %s", msg['id'], msg['sender_type'], msg['project_id'])
+            for i, project_file in enumerate(msg['project_files'] or []):
+                logger.debug("      - File #%d: path='%s', language='%s'", i + 1, project_file.get('path'), project_file.get('language'))
+    # --- END: DETAILED LOGGING ---
+        
+    return Response(content=orjson.dumps(messages_to_return), media_type="application/json")
 
 @app.post("/api/sessions/{session_id}/join", status_code=status.HTTP_200_OK, tags=["Sessions"])
 async def join_session(
@@ -1275,7 +1354,7 @@ async def join_session(
         if session["access_level"] == 'protected':
             if not payload or not payload.passcode:
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="A passcode is required to join this protected session.")
-            if not auth.verify_password(payload.passcode, session["passcode_hash"]):
+            if not await asyncio.to_thread(auth.verify_password, payload.passcode, session["passcode_hash"]):
                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Incorrect passcode.")
         elif session["access_level"] != 'public':
              raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This session is private and cannot be joined.")
@@ -1285,6 +1364,7 @@ async def join_session(
             (session_id, user_id)
         )
         conn.commit()
+        state.invalidate_sessions_list_cache(user_id)
         chat_url = request.url_for("get_chat_page_for_session", session_id=session_id)
         return {"redirect_url": str(chat_url)}
     except sqlite3.Error as e:
@@ -1330,12 +1410,15 @@ def _generate_unique_initials(participants: List[Dict]) -> List[Dict]:
     # In a real app, you'd add logic here to check for duplicate initials and extend them (e.g., VJ -> VJO)
     return participants
 
+def _participant_color(user_id: int) -> str:
+    return PARTICIPANT_COLORS[user_id % len(PARTICIPANT_COLORS)]
+
 def _get_session_participants_logic(session_id: str, user_id: int) -> Optional[List[models.UserResponseModel]]:
     conn = None
     try:
         conn = database.get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user_id))
+        cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user_id))
         if not cursor.fetchone():
             return None
         
@@ -1350,8 +1433,8 @@ def _get_session_participants_logic(session_id: str, user_id: int) -> Optional[L
         participants = [dict(row) for row in cursor.fetchall()]
         
         participants = _generate_unique_initials(participants)
-        for i, p in enumerate(participants):
-            p['color'] = PARTICIPANT_COLORS[p['id'] % len(PARTICIPANT_COLORS)]
+        for p in participants:
+            p['color'] = _participant_color(p['id'])
 
         return [models.UserResponseModel(**p) for p in participants]
     except sqlite3.Error:
@@ -1361,26 +1444,17 @@ def _get_session_participants_logic(session_id: str, user_id: int) -> Optional[L
 
 def _save_user_message_sync(session_id: str, user_id: int, user_name: str, content: str, turn_id: int, reply_to_id: Optional[int]) -> Optional[Dict[str, Any]]:
     """A synchronous function to save a user message, designed to be run in a thread."""
-    conn = None
     try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO chat_messages (session_id, user_id, sender_name, sender_type, content, turn_id, reply_to_message_id)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (session_id, user_id, user_name, 'user', content, turn_id, reply_to_id)
-        )
-        message_id = cursor.lastrowid
-        conn.commit()
-        cursor.execute("SELECT * FROM chat_messages WHERE id = ?", (message_id,))
-        new_msg_row = cursor.fetchone()
-        return dict(new_msg_row) if new_msg_row else None
+        with database.get_conn() as conn:
+            new_msg_row = conn.execute(
+                database.SQL_INSERT_USER_CHAT_MESSAGE,
+                (session_id, user_id, user_name, content, turn_id, reply_to_id)
+            ).fetchone()
+            conn.commit()
+            return dict(new_msg_row) if new_msg_row else None
     except sqlite3.Error as e:
-        traceback.print_exc()
+        logger.exception("Failed to save user message for session %s", session_id)
         return None
-    finally:
-        if conn:
-            conn.close()
 
 async def handle_chat_message(
         session_id: str,
@@ -1389,7 +1463,7 @@ async def handle_chat_message(
         payload: Dict[str, Any],
         websocket: WebSocket
     ):
-        print(f"[HANDLER / {client_id}] handle_chat_message started for user '{user.get('name')}'")
+        logger.debug("[HANDLER / %s] handle_chat_message started for user '%s'", client_id, user.get('name'))
         user_id = user.get('id')
         user_name = user.get('name')
         user_input_raw = payload.get("user_input")
@@ -1397,47 +1471,100 @@ async def handle_chat_message(
         recipient_ids = payload.get("recipient_ids", [])
         reply_to_id = payload.get("reply_to_id")
     
-        new_msg_dict = await asyncio.to_thread(
+        new_msg_dict = await database.run_in_db_thread(
             _save_user_message_sync,
             session_id, user_id, user_name, user_input_raw, turn_id, reply_to_id
         )
     
         if not new_msg_dict:
-            print(f"[HANDLER / {client_id}] ERROR: Failed to save user message to database.")
+            logger.error("[HANDLER / %s] Failed to save user message to database.", client_id)
             return
     
+        state.append_message_to_memory(session_id, 'user', new_msg_dict.get("content"))
         new_msg_dict["files"] = None
-        current_participants = _get_session_participants_logic(session_id, user_id)
-        sender_info = next((p for p in current_participants if p.id == user_id), None)
-    
+        # Participation was verified at the WebSocket handshake and colours depend only on the
+        # user id, so the turn needs no second connection to list the session's participants.
         message_model = models.MessageItem(**new_msg_dict)
-        if sender_info:
-            message_model.sender_color = sender_info.color
+        message_model.sender_color = _participant_color(user_id)
     
         await state.broadcast(
             session_id,
             {"type": "new_message", "payload": message_model.model_dump()}
         )
         
-        print(f"[HANDLER / {client_id}] Checking recipients: {recipient_ids}")
+        logger.debug("[HANDLER / %s] Checking recipients: %s", client_id, recipient_ids)
     
         if any(isinstance(recipient, str) and recipient.upper() == 'AI' for recipient in recipient_ids):
-            print(f"[HANDLER / {client_id}] AI is a recipient. Invoking LLM for turn_id {turn_id}.")
+            logger.debug("[HANDLER / %s] AI is a recipient. Invoking LLM for turn_id %s.", client_id, turn_id)
             stream_id = f"{session_id}-{client_id}-{turn_id}"
             
-            asyncio.create_task(
-                llm.invoke_llm_for_session(
-                    session_id=session_id,
-                    websocket=websocket,
-                    user_id=user_id,
-                    user_name=user_name,
-                    user_input_raw=user_input_raw,
-                    turn_id=turn_id,
-                    stream_id=stream_id,
-                    reply_to_message_id=reply_to_id
-                )
+            # Awaited, not spawned: the session's turn worker must not start the next turn
+            # until this reply has finished streaming and been added to memory.
+            await llm.invoke_llm_for_session(
+                session_id=session_id,
+                websocket=websocket,
+                user_id=user_id,
+                user_name=user_name,
+                user_input_raw=user_input_raw,
+                turn_id=turn_id,
+                stream_id=stream_id,
+                reply_to_message_id=reply_to_id
             )
 
+def _spawn_background_task(coro) -> asyncio.Task:
+    """Starts a fire-and-forget task and keeps a reference to it until it finishes."""
+    task = asyncio.create_task(coro)
+    state.background_tasks.add(task)
+    task.add_done_callback(state.background_tasks.discard)
+    return task
+
+async def _chat_turn_worker(session_id: str):
+    """
+    Runs queued chat turns for one session in arrival order, each including its AI reply, so at most
+    one LLM stream per session runs at a time. Exits when the queue is empty.
+    """
+    turn_queue = state.chat_turn_queues[session_id]
+    try:
+        while not turn_queue.empty():
+            turn_args = turn_queue.get_nowait()
+            try:
+                await handle_chat_message(*turn_args)
+            except Exception:
+                logger.exception("Chat turn failed for session %s", session_id)
+    finally:
+        state.chat_turn_workers.pop(session_id, None)
+        if turn_queue.empty():
+            state.chat_turn_queues.pop(session_id, None)
+
+def enqueue_chat_turn(session_id: str, client_id: str, user: Dict[str, Any], payload: Dict[str, Any], websocket: WebSocket) -> bool:
+    """
+    Queues a chat turn for its session, starting the session's worker if needed.
+    Returns False if the session already has CHAT_QUEUE_MAX_PENDING turns waiting.
+    """
+    turn_queue = state.chat_turn_queues.setdefault(session_id, asyncio.Queue(maxsize=state.CHAT_QUEUE_MAX_PENDING))
+    try:
+        turn_queue.put_nowait((session_id, client_id, user, payload, websocket))
+    except asyncio.QueueFull:
+        return False
+    if session_id not in state.chat_turn_workers:
+        state.chat_turn_workers[session_id] = asyncio.create_task(_chat_turn_worker(session_id))
+    return True
+
+# Warnings that any client can trigger per frame (bad frames, failing handlers) share one budget,
+# so a misbehaving or hostile client cannot flood the log or spend the loop formatting records.
+_client_error_log_limiter = logging_utils.LogRateLimiter(rate=5, burst=20)
+
+def _log_client_error(msg: str, *args, exc_info: bool = False):
+    """logger.warning for client-triggerable errors, subject to _client_error_log_limiter."""
+    if not _client_error_log_limiter.allow():
+        return
+    if suppressed := _client_error_log_limiter.take_suppressed():
+        logger.warning("Suppressed %d similar client error message(s).", suppressed)
+    logger.warning(msg, *args, exc_info=exc_info)
+
+# First character of a frame that may hold a JSON object (leading whitespace is legal JSON), as str and bytes.
+_WS_JSON_OBJECT_FIRST_CHARS = frozenset(["{", " ", "\t", "\n", "\r", b"{", b" ", b"\t", b"\n", b"\r"])
+
 @app.websocket("/ws/{session_id_ws}/{client_js_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
@@ -1449,15 +1576,14 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
     
-    current_ws_user = await auth.get_user_by_session_token_internal(session_token_from_cookie)
-    if not current_ws_user or not current_ws_user.get('id'):
+    # One query resolves the cookie to a user and checks session membership.
+    current_ws_user = await auth.get_session_participant_by_token(session_token_from_cookie, session_id_ws)
+    if not current_ws_user or not current_ws_user.get('id') or not current_ws_user.pop('is_participant'):
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
     
     user_id = current_ws_user['id']
-    if not _get_session_participants_logic(session_id_ws, user_id):
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-        return
+    sender_color = _participant_color(user_id)
 
     await websocket.accept()
     websocket.scope['client_id'] = client_js_id
@@ -1465,53 +1591,113 @@ async def websocket_endpoint(
     queue = asyncio.Queue()
     connection = state.Connection(websocket=websocket, queue=queue)
     await state.connect(session_id_ws, connection)
+    utils.register_ws_writer(websocket, queue)
+    state.warm_memory_for_client(session_id_ws)
 
     async def reader(ws: WebSocket, q: asyncio.Queue):
+        # Runs once per inbound frame for the life of the connection; bind what it looks up.
+        receive = ws.receive
+        loads = orjson.loads
+        json_decode_error = orjson.JSONDecodeError
+        max_message_size = config.WS_MAX_MESSAGE_SIZE
+        json_object_first_chars = _WS_JSON_OBJECT_FIRST_CHARS
+        action_handlers = _ACTION_HANDLERS
+        user_name = current_ws_user.get('name')
         try:
             while True:
-                received_data = await ws.receive_text()
-                message_data = json.loads(received_data)
-                message_type = message_data.get("type")
-                payload = message_data.get("payload")
+                # Read the raw ASGI message so binary frames go to orjson as bytes without a
+                # UTF-8 decode; browsers send text frames, which orjson accepts as str.
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+                received_data = message.get("text")
+                if received_data is None:
+                    received_data = message.get("bytes")
+                if not received_data:
+                    continue
+                # The limit is in bytes, as for uvicorn's --ws-max-size. A text frame's UTF-8 size is
+                # between 1 and 4 times its length, so it is only encoded when that leaves it open.
+                message_size = len(received_data)
+                if message_size <= max_message_size < 4 * message_size and isinstance(received_data, str):
+                    message_size = len(received_data.encode("utf-8"))
+                if message_size > max_message_size:
+                    _log_client_error("[WS-READER / %s] Dropping oversized message (%d bytes).", client_js_id, message_size)
+                    await q.put(WS_ERROR_MESSAGE_TOO_LARGE)
+                    continue
+                # Only a JSON object can be a valid envelope, so anything else is rejected on its
+                # first character without paying for a parse and a JSONDecodeError.
+                if received_data[:1] in json_object_first_chars:
+                    try:
+                        message_data = loads(received_data)
+                    except json_decode_error:
+                        message_data = None
+                else:
+                    message_data = None
+                # Every frame must be a {"type": str, "payload": object | null} envelope; checking the
+                # shape once here means the handlers below can rely on payload being a dict or None.
+                if isinstance(message_data, dict):
+                    message_type = message_data.get("type")
+                    payload = message_data.get("payload")
+                if (not isinstance(message_data, dict) or not isinstance(message_type, str)
+                        or not (payload is None or isinstance(payload, dict))):
+                    _log_client_error("[WS-READER / %s] Dropping malformed message.", client_js_id)
+                    await q.put(WS_ERROR_INVALID_MESSAGE)
+                    continue
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[WS-READER / %s] Received '%s' (%d bytes).", client_js_id, message_type,
+                                 len(received_data.encode("utf-8")) if isinstance(received_data, str) else message_size)
 
                 if message_type == "chat_message" and payload:
-                    asyncio.create_task(handle_chat_message(
-                        session_id_ws, client_js_id, current_ws_user, payload, websocket
-                    ))
+                    if not enqueue_chat_turn(session_id_ws, client_js_id, current_ws_user, payload, websocket):
+                        await q.put(WS_ERROR_TOO_MANY_PENDING)
                 
                 elif message_type == "user_typing" and payload is not None:
-                    current_participants = _get_session_participants_logic(session_id_ws, user_id)
-                    sender_info = next((p for p in current_participants if p.id == user_id), None)
-                    sender_color = sender_info.color if sender_info else "#E5E7EB"
+                    # Typing events arrive on every keystroke; the color is derived from the user id,
+                    # so no participants query is needed and the reader never blocks on the database.
                     await state.broadcast(
                         session_id_ws,
-                        {"type": "participant_typing", "payload": {"user_id": user_id, "user_name": current_ws_user.get('name'), "is_typing": payload.get("is_typing", False), "color": sender_color}},
+                        {"type": "participant_typing", "payload": {"user_id": user_id, "user_name": user_name, "is_typing": payload.get("is_typing", False), "color": sender_color}},
                     )
 
-                elif message_type in ["run_code", "stop_code", "code_input", "save_code_content", "save_code_run", "commit_project_changes", "delete_message"]:
-                    asyncio.create_task(handle_action_message(
+                elif message_type in action_handlers:
+                    _spawn_background_task(handle_action_message(
                         message_type, payload, websocket, client_js_id, session_id_ws
                     ))
                 else:
-                    print(f"[WS-READER / {client_js_id}] Received unhandled message type: '{message_type}'")
+                    _log_client_error("[WS-READER / %s] Received unhandled message type: '%s'", client_js_id, message_type)
 
         except WebSocketDisconnect:
-            print(f"Reader task for client {client_js_id} disconnected.")
+            logger.info("Reader task for client %s disconnected.", client_js_id)
         except Exception as e:
-            print(f"Error in reader task for client {client_js_id}: {e}")
-            traceback.print_exc()
+            # Reachable by whatever a client sends, so the full traceback is only worth its cost at DEBUG.
+            _log_client_error("Error in reader task for client %s: %s: %s", client_js_id, type(e).__name__, e,
+                              exc_info=logger.isEnabledFor(logging.DEBUG))
 
     async def writer(ws: WebSocket, q: asyncio.Queue):
+        # The only task that sends on this socket. Frames that piled up while a send was in
+        # progress are written back to back without waiting on the queue again. Serialized
+        # frames arrive as UTF-8 bytes (sent as binary frames, which the client decodes) or as
+        # constant str frames.
+        send_bytes = ws.send_bytes
+        send_text = ws.send_text
         try:
             while True:
                 message = await q.get()
-                await ws.send_json(message)
-                q.task_done()
+                while True:
+                    if isinstance(message, bytes):
+                        await send_bytes(message)
+                    elif isinstance(message, str):
+                        await send_text(message)
+                    else:
+                        await send_bytes(orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS))
+                    try:
+                        message = q.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
         except WebSocketDisconnect:
-            print(f"Writer task for client {client_js_id} disconnected.")
+            logger.info("Writer task for client %s disconnected.", client_js_id)
         except Exception as e:
-            print(f"Error in writer task for client {client_js_id}: {e}")
-            traceback.print_exc()
+            logger.exception("Error in writer task for client %s", client_js_id)
 
     reader_task = asyncio.create_task(reader(websocket, queue))
     writer_task = asyncio.create_task(writer(websocket, queue))
@@ -1519,276 +1705,320 @@ async def websocket_endpoint(
     try:
         await asyncio.gather(reader_task, writer_task)
     except Exception as e:
-        print(f"WebSocket endpoint error for client {client_js_id}: {e}")
+        logger.error("WebSocket endpoint error for client %s: %s", client_js_id, e)
     finally:
-        print(f"Client {client_js_id} (User {user_id}) connection closing.")
-
-        async with state.running_containers_lock:
-            running_ids = [pid for pid, info in state.running_containers.items() if info.get("client_id") == client_js_id]
-        for pid in running_ids:
-            print(f"Cleaning up running container {pid} for disconnected client {client_js_id}")
-            await docker_utils.stop_container(pid)
-
-        async with state.running_previews_lock:
-            preview_ids = [pid for pid, info in state.running_previews.items() if info.get("client_id") == client_js_id]
-        for pid in preview_ids:
-            print(f"Cleaning up preview container {pid} for disconnected client {client_js_id}")
-            await docker_utils.stop_container(pid)
+        logger.info("Client %s (User %s) connection closing.", client_js_id, user_id)
 
         reader_task.cancel()
         writer_task.cancel()
+        utils.unregister_ws_writer(websocket)
         await state.disconnect(session_id_ws, connection)
 
-async def handle_action_message(message_type: str, payload: dict, websocket: WebSocket, client_id: str, session_id: str):
-    user = await auth.get_user_by_session_token_internal(websocket.cookies.get(auth.SESSION_COOKIE_NAME))
-    if not user:
+        # Stopping containers means Docker API round trips; don't hold the closing socket for them.
+        cleanup_task = asyncio.create_task(_cleanup_client_containers(client_js_id))
+        state.container_cleanup_tasks.add(cleanup_task)
+        cleanup_task.add_done_callback(state.container_cleanup_tasks.discard)
+
+async def _cleanup_client_containers(client_id: str):
+    """Stops every running and preview container started by a client that has disconnected."""
+    async with state.running_containers_lock:
+        running_ids = [pid for pid, info in state.running_containers.items() if info.get("client_id") == client_id]
+    async with state.running_previews_lock:
+        preview_ids = [pid for pid, info in state.running_previews.items() if info.get("client_id") == client_id]
+
+    for pid in running_ids:
+        logger.info("Cleaning up running container %s for disconnected client %s", pid, client_id)
+    for pid in preview_ids:
+        logger.info("Cleaning up preview container %s for disconnected client %s", pid, client_id)
+
+    results = await asyncio.gather(*(docker_utils.stop_container(pid) for pid in running_ids + preview_ids), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Container cleanup for client %s failed: %s", client_id, result)
+
+async def _handle_run_code(payload: dict, websocket: WebSocket, client_id: str, session_id: str, user: Dict[str, Any]):
+    """Starts a project run (or preview server) for a code block, unless that block is already running."""
+    project_data = payload.get("project_data")
+    run_block_id = payload.get("project_id")
+    persistent_project_id = payload.get("persistent_project_id")
+    language = payload.get("language")
+
+    if not all([project_data, run_block_id, language, persistent_project_id]):
         return
 
-    if message_type == "run_code" and payload:
-        project_data = payload.get("project_data")
-        run_block_id = payload.get("project_id")
-        persistent_project_id = payload.get("persistent_project_id")
-        language = payload.get("language")
-
-        if not all([project_data, run_block_id, language, persistent_project_id]):
-            return
+    # Unknown languages are rejected here, before project files are written or a container is
+    # started for them.
+    lang_config = config.SUPPORTED_LANGUAGES.get(language.lower()) if isinstance(language, str) else None
+    if not lang_config:
+        await utils.send_ws_message(websocket, "code_finished", {"project_id": run_block_id, "exit_code": -1, "error": f"Unsupported language: {language}"})
+        return
 
-        async def run_and_process_task():
-            project_path = None
-            is_preview = False
-            try:
-                project_path, error = await asyncio.to_thread(
-                    project_utils.create_project_directory_and_files, project_data
+    async def run_and_process_task():
+        project_path = None
+        is_preview = False
+        try:
+            project_path, error = await asyncio.to_thread(
+                project_utils.create_project_directory_and_files, project_data
+            )
+            if error or not project_path:
+                error_message = f"Failed to create project files: {error}"
+                await utils.send_ws_message(websocket, "code_finished", {"project_id": run_block_id, "error": error_message})
+                return
+            
+            is_preview = lang_config.get("is_preview_server", False)
+            
+            if is_preview:
+                await docker_utils.handle_preview_server(
+                    websocket=websocket, project_id=run_block_id, persistent_project_id=persistent_project_id,
+                    project_path=project_path, lang_config=lang_config
+                )
+            else:
+                loop = asyncio.get_running_loop()
+                exit_code, full_output, error_message = await docker_utils.run_code_in_docker(
+                    websocket, client_id, run_block_id, project_data, project_path,
+                    "sh run.sh", lang_config, loop
                 )
-                if error or not project_path:
-                    error_message = f"Failed to create project files: {error}"
-                    await utils.send_ws_message(websocket, "code_finished", {"project_id": run_block_id, "error": error_message})
-                    return
                 
-                lang_config = config.SUPPORTED_LANGUAGES.get(language.lower())
-                if not lang_config:
-                    raise Exception(f"Language '{language}' is not configured.")
+                final_payload = {"project_id": run_block_id, "exit_code": exit_code, "full_output": full_output}
+                if error_message:
+                    final_payload["error"] = error_message
                 
-                is_preview = lang_config.get("is_preview_server", False)
+                await utils.send_ws_message(websocket, "code_finished", final_payload)
                 
-                if is_preview:
-                    await docker_utils.handle_preview_server(
-                        websocket=websocket, project_id=run_block_id, persistent_project_id=persistent_project_id,
-                        project_path=project_path, lang_config=lang_config
-                    )
-                else:
-                    loop = asyncio.get_running_loop()
-                    exit_code, full_output, error_message = await docker_utils.run_code_in_docker(
-                        websocket, client_id, run_block_id, project_data, project_path,
-                        "sh run.sh", lang_config, loop
-                    )
-                    
-                    final_payload = {"project_id": run_block_id, "exit_code": exit_code, "full_output": full_output}
-                    if error_message:
-                        final_payload["error"] = error_message
-                    
-                    await utils.send_ws_message(websocket, "code_finished", final_payload)
-                    
-                    if full_output and not error_message and exit_code == 0:
-                        asyncio.create_task(handle_action_message(
-                            'save_code_run',
-                            {'project_id': persistent_project_id, 'output': full_output},
-                            websocket, client_id, session_id
-                        ))
-
-            except asyncio.CancelledError:
-                error_message = "Stopped by user."
-                await utils.send_ws_message(websocket, "code_finished", {"project_id": run_block_id, "error": error_message})
-            except Exception as e:
-                error_message = f"A task error occurred: {e}"
-                traceback.print_exc()
-                await utils.send_ws_message(websocket, "code_finished", {"project_id": run_block_id, "error": error_message})
-            finally:
-                if project_path and os.path.exists(project_path) and not is_preview:
-                    await asyncio.to_thread(shutil.rmtree, project_path)
-                async with state.running_code_tasks_lock:
-                    state.running_code_tasks.pop(run_block_id, None)
+                if full_output and not error_message and exit_code == 0:
+                    _spawn_background_task(_handle_save_code_run(
+                        {'project_id': persistent_project_id, 'output': full_output},
+                        websocket, client_id, session_id, user
+                    ))
 
-        task = asyncio.create_task(run_and_process_task())
-        async with state.running_code_tasks_lock:
-            state.running_code_tasks[run_block_id] = task
-    
-    elif message_type == "stop_code" and payload:
-        if project_id := payload.get("project_id"):
+        except asyncio.CancelledError:
+            error_message = "Stopped by user."
+            await utils.send_ws_message(websocket, "code_finished", {"project_id": run_block_id, "error": error_message})
+        except Exception as e:
+            error_message = f"A task error occurred: {e}"
+            _log_client_error("Code run task failed for block %s: %s: %s", run_block_id, type(e).__name__, e,
+                              exc_info=logger.isEnabledFor(logging.DEBUG))
+            await utils.send_ws_message(websocket, "code_finished", {"project_id": run_block_id, "error": error_message})
+        finally:
+            if project_path and os.path.exists(project_path) and not is_preview:
+                await asyncio.to_thread(shutil.rmtree, project_path)
             async with state.running_code_tasks_lock:
-                task_to_cancel = state.running_code_tasks.pop(project_id, None)
-            if task_to_cancel:
-                task_to_cancel.cancel()
+                # After a stop, a new run of the same block may already be registered.
+                if state.running_code_tasks.get(run_block_id) is asyncio.current_task():
+                    del state.running_code_tasks[run_block_id]
+
+    # Starting a container is the most expensive thing a client can ask for, so a repeated
+    # run_code for a block that is still running (double click, resend) is dropped; the
+    # running task will still report code_finished for it.
+    async with state.running_code_tasks_lock:
+        running_task = state.running_code_tasks.get(run_block_id)
+        if running_task is not None and not running_task.done():
+            logger.debug("Ignoring run_code for block %s from client %s: already running.", run_block_id, client_id)
+            return
+        state.running_code_tasks[run_block_id] = asyncio.create_task(run_and_process_task())
+
+async def _handle_stop_code(payload: dict, websocket: WebSocket, client_id: str, session_id: str, user: Dict[str, Any]):
+    """Cancels a code block's run and stops its container."""
+    if project_id := payload.get("project_id"):
+        async with state.running_code_tasks_lock:
+            task_to_cancel = state.running_code_tasks.pop(project_id, None)
+        if task_to_cancel:
+            task_to_cancel.cancel()
+        
+        await docker_utils.stop_container(project_id)
+        await utils.send_ws_message(websocket, "code_finished", {"project_id": project_id, "error": "Stopped by user."})
+
+async def _handle_code_input(payload: dict, websocket: WebSocket, client_id: str, session_id: str, user: Dict[str, Any]):
+    """Forwards a line of user input to a running container."""
+    await docker_utils.send_input_to_container(payload['project_id'], payload['input'])
+
+async def _handle_commit_project_changes(payload: dict, websocket: WebSocket, client_id: str, session_id: str, user: Dict[str, Any]):
+    """Commits the user's edited files to a project and broadcasts the updated project."""
+    project_id = payload.get("project_id")
+    commit_message = payload.get("commit_message")
+    files = payload.get("files", [])
+
+    if not all([project_id, commit_message, files]):
+        return
+
+    def sync_commit_and_repack():
+        conn_inner = None
+        try:
+            conn_inner = database.get_db_connection()
+            cursor = conn_inner.cursor()
+            cursor.execute("SELECT git_repo_blob FROM projects WHERE id = ?", (project_id,))
+            project_row = cursor.fetchone()
+            if not project_row: return None, "Project not found"
             
-            await docker_utils.stop_container(project_id)
-            await utils.send_ws_message(websocket, "code_finished", {"project_id": project_id, "error": "Stopped by user."})
-    
-    elif message_type == "code_input" and payload:
-        await docker_utils.send_input_to_container(payload['project_id'], payload['input'])
+            operations = [
+                {"type": "UPDATE_FILE", "path": f.get("path"), "content": f.get("content")}
+                for f in files
+            ]
+
+            new_repo_blob, error = project_utils.apply_project_modifications(
+                repo_blob=project_row["git_repo_blob"],
+                operations=operations,
+                commit_message=commit_message,
+                user_name=user["name"]
+            )
 
-    elif message_type == "commit_project_changes" and payload:
-        project_id = payload.get("project_id")
-        commit_message = payload.get("commit_message")
-        files = payload.get("files", [])
+            if error: return None, error
 
-        if not all([project_id, commit_message, files]):
-            return
+            # The edited blocks are now part of the commit, so clear them in the same transaction.
+            cursor.execute("UPDATE projects SET git_repo_blob = ? WHERE id = ?", (new_repo_blob, project_id))
+            cursor.execute("DELETE FROM edited_code_blocks WHERE session_id = ?", (session_id,))
+            conn_inner.commit()
+            return new_repo_blob, None
+        finally:
+            if conn_inner: conn_inner.close()
 
-        def sync_commit_and_repack():
-            conn_inner = None
-            try:
-                conn_inner = database.get_db_connection()
-                cursor = conn_inner.cursor()
-                cursor.execute("SELECT git_repo_blob FROM projects WHERE id = ?", (project_id,))
-                project_row = cursor.fetchone()
-                if not project_row: return None, "Project not found"
-                
-                operations = [
-                    {"type": "UPDATE_FILE", "path": f.get("path"), "content": f.get("content")}
-                    for f in files
-                ]
-
-                new_repo_blob, error = project_utils.apply_project_modifications(
-                    repo_blob=project_row["git_repo_blob"],
-                    operations=operations,
-                    commit_message=commit_message,
-                    user_name=user["name"]
-                )
+    await database.discard_pending_edited_code(session_id)
+    new_blob, err = await asyncio.to_thread(sync_commit_and_repack)
 
-                if error: return None, error
+    if err:
+        logger.error("Error committing user changes for project %s: %s", project_id, err)
+    else:
+        logger.info("Successfully committed user changes for project %s", project_id)
+        full_project_data = await get_project_details(project_id, user)
+        await state.broadcast(session_id, {
+            "type": "project_updated",
+            "payload": { "project_id": project_id, "project_data": full_project_data.model_dump() }
+        })
 
-                cursor.execute("UPDATE projects SET git_repo_blob = ? WHERE id = ?", (new_repo_blob, project_id))
-                conn_inner.commit()
-                return new_repo_blob, None
-            finally:
-                if conn_inner: conn_inner.close()
+async def _handle_save_code_run(payload: dict, websocket: WebSocket, client_id: str, session_id: str, user: Dict[str, Any]):
+    """Commits a successful run's output to a project and broadcasts the updated project."""
+    project_id = payload.get("project_id")
+    output = payload.get("output")
+    user_name = user["name"] if user else "Code Execution"
 
-        new_blob, err = await asyncio.to_thread(sync_commit_and_repack)
+    if not project_id or not output:
+        return
 
-        if err:
-            print(f"Error committing user changes for project {project_id}: {err}")
-        else:
-            print(f"Successfully committed user changes for project {project_id}")
-            conn = database.get_db_connection()
-            try:
-                conn.execute("DELETE FROM edited_code_blocks WHERE session_id = ?", (session_id,))
-                conn.commit()
-            finally:
-                conn.close()
-
-            full_project_data = await get_project_details(project_id, user)
-            await state.broadcast(session_id, {
-                "type": "project_updated",
-                "payload": { "project_id": project_id, "project_data": full_project_data.model_dump() }
-            })
+    def sync_save_and_repack():
+        conn_inner = None
+        temp_dir = None
+        try:
+            conn_inner = database.get_db_connection()
+            cursor = conn_inner.cursor()
+            cursor.execute("SELECT git_repo_blob FROM projects WHERE id = ?", (project_id,))
+            project_row = cursor.fetchone()
+            if not project_row:
+                return None, f"Project {project_id} not found in database"
+
+            repo_blob = project_row["git_repo_blob"]
+            project_root, error = project_utils.unpack_git_repo_to_temp_dir(repo_blob)
+            if error: return None, error
+            temp_dir = os.path.dirname(project_root)
+
+            commit_error = project_utils.add_output_and_commit(project_root, output, user_name)
+            if commit_error: return None, commit_error
+            
+            new_repo_blob, repack_error = project_utils.repack_repo_from_path(project_root)
+            if repack_error: return None, repack_error
+            
+            cursor.execute("UPDATE projects SET git_repo_blob = ? WHERE id = ?", (new_repo_blob, project_id))
+            conn_inner.commit()
+            return new_repo_blob, None
+        finally:
+            if conn_inner: conn_inner.close()
+            if temp_dir and os.path.exists(temp_dir): 
+                shutil.rmtree(temp_dir)
     
-    elif message_type == "save_code_run" and payload:
-        project_id = payload.get("project_id")
-        output = payload.get("output")
-        user_name = user["name"] if user else "Code Execution"
+    new_blob, err = await asyncio.to_thread(sync_save_and_repack)
+    if err:
+        logger.error("Error saving run result for project %s: %s", project_id, err)
+    else:
+        logger.info("Successfully saved run output for project %s", project_id)
+        full_project_data = await get_project_details(project_id, user)
+        await state.broadcast(session_id, {
+            "type": "project_updated",
+            "payload": {
+                "project_id": project_id,
+                "project_data": full_project_data.model_dump()
+            }
+        })
 
-        if not project_id or not output:
-            return
+async def _handle_save_code_content(payload: dict, websocket: WebSocket, client_id: str, session_id: str, user: Dict[str, Any]):
+    """Queues an edited code block for saving."""
+    code_content = payload.get('code_content')
+    if not isinstance(code_content, str) or len(code_content) > config.MAX_CODE_CONTENT_LENGTH:
+        if (writer_queue := utils.get_ws_writer_queue(websocket)) is not None:
+            writer_queue.put_nowait(WS_ERROR_CODE_TOO_LARGE)
+        return
+    database.queue_edited_code_content(
+        payload['session_id'], payload['code_block_id'], payload['language'], payload['code_content']
+    )
+    state.remove_memory_for_client(payload['session_id'])
 
-        def sync_save_and_repack():
-            conn_inner = None
-            temp_dir = None
-            try:
-                conn_inner = database.get_db_connection()
-                cursor = conn_inner.cursor()
-                cursor.execute("SELECT git_repo_blob FROM projects WHERE id = ?", (project_id,))
-                project_row = cursor.fetchone()
-                if not project_row:
-                    return None, f"Project {project_id} not found in database"
-
-                repo_blob = project_row["git_repo_blob"]
-                project_root, error = project_utils.unpack_git_repo_to_temp_dir(repo_blob)
-                if error: return None, error
-                temp_dir = os.path.dirname(project_root)
-
-                commit_error = project_utils.add_output_and_commit(project_root, output, user_name)
-                if commit_error: return None, commit_error
-                
-                new_repo_blob, repack_error = project_utils.repack_repo_from_path(project_root)
-                if repack_error: return None, repack_error
-                
-                cursor.execute("UPDATE projects SET git_repo_blob = ? WHERE id = ?", (new_repo_blob, project_id))
-                conn_inner.commit()
-                return new_repo_blob, None
-            finally:
-                if conn_inner: conn_inner.close()
-                if temp_dir and os.path.exists(temp_dir): 
-                    shutil.rmtree(temp_dir)
+async def _handle_delete_message(payload: dict, websocket: WebSocket, client_id: str, session_id: str, user: Dict[str, Any]):
+    """Soft-deletes a message for the host or its author and broadcasts the change."""
+    message_id = payload.get("message_id")
+    if not message_id or not isinstance(message_id, int):
+        # Ignore if the ID is temporary (e.g., "temp-id-...") or invalid
+        return
+
+    conn = database.get_db_connection()
+    try:
+        cursor = conn.cursor()
         
-        new_blob, err = await asyncio.to_thread(sync_save_and_repack)
-        if err:
-            print(f"Error saving run result for project {project_id}: {err}")
-        else:
-            print(f"Successfully saved run output for project {project_id}")
-            full_project_data = await get_project_details(project_id, user)
-            await state.broadcast(session_id, {
-                "type": "project_updated",
-                "payload": {
-                    "project_id": project_id,
-                    "project_data": full_project_data.model_dump()
-                }
-            })
-
-    elif message_type == "save_code_content" and payload:
-        await asyncio.to_thread(
-            database.save_edited_code_content,
-            payload['session_id'], payload['code_block_id'], payload['language'], payload['code_content']
-        )
-        state.remove_memory_for_client(payload['session_id'])
-    
-    elif message_type == "delete_message" and payload:
-        message_id = payload.get("message_id")
-        if not message_id or not isinstance(message_id, int):
-            # Ignore if the ID is temporary (e.g., "temp-id-...") or invalid
+        # First, verify the user has permission to delete this message
+        cursor.execute("""
+            SELECT m.user_id, s.host_user_id
+            FROM chat_messages m JOIN sessions s ON m.session_id = s.id
+            WHERE m.id = ?
+        """, (message_id,))
+        message = cursor.fetchone()
+
+        if not message:
+            return # Message doesn't exist
+
+        is_host = user["id"] == message["host_user_id"]
+        is_my_message = user["id"] == message["user_id"]
+
+        # Allow deletion if user is the host or the author of the message
+        if not (is_host or is_my_message):
             return
 
-        conn = database.get_db_connection()
-        try:
-            cursor = conn.cursor()
-            
-            # First, verify the user has permission to delete this message
-            cursor.execute("""
-                SELECT m.user_id, s.host_user_id
-                FROM chat_messages m JOIN sessions s ON m.session_id = s.id
-                WHERE m.id = ?
-            """, (message_id,))
-            message = cursor.fetchone()
-
-            if not message:
-                return # Message doesn't exist
-
-            is_host = user["id"] == message["host_user_id"]
-            is_my_message = user["id"] == message["user_id"]
-
-            # Allow deletion if user is the host or the author of the message
-            if not (is_host or is_my_message):
-                return
+        # Instead of DELETE, we UPDATE the content to a "deleted" state
+        deleted_content = json.dumps({"type": "deleted", "deleted_by": user["name"]})
+        cursor.execute("UPDATE chat_messages SET content = ? WHERE id = ?", (deleted_content, message_id))
+        
+        # We also clear any associated project ID from the message
+        cursor.execute("UPDATE chat_messages SET project_id = NULL WHERE id = ?", (message_id,))
 
-            # Instead of DELETE, we UPDATE the content to a "deleted" state
-            deleted_content = json.dumps({"type": "deleted", "deleted_by": user["name"]})
-            cursor.execute("UPDATE chat_messages SET content = ? WHERE id = ?", (deleted_content, message_id))
-            
-            # We also clear any associated project ID from the message
-            cursor.execute("UPDATE chat_messages SET project_id = NULL WHERE id = ?", (message_id,))
+        conn.commit()
+        logger.info("User %s soft-deleted message %s.", user['id'], message_id)
 
-            conn.commit()
-            print(f"User {user['id']} soft-deleted message {message_id}.")
+        state.remove_memory_for_client(session_id)
 
-            state.remove_memory_for_client(session_id)
+        # Broadcast a 'message_updated' event so all clients can re-render it
+        await state.broadcast(session_id, {
+            "type": "message_updated",
+            "payload": {"message_id": message_id, "new_content": deleted_content}
+        })
 
-            # Broadcast a 'message_updated' event so all clients can re-render it
-            await state.broadcast(session_id, {
-                "type": "message_updated",
-                "payload": {"message_id": message_id, "new_content": deleted_content}
-            })
+    finally:
+        if conn: conn.close()
 
-        finally:
-            if conn: conn.close()
+# Handlers for the action message types a session WebSocket accepts, keyed by message type.
+_ACTION_HANDLERS = {
+    "run_code": _handle_run_code,
+    "stop_code": _handle_stop_code,
+    "code_input": _handle_code_input,
+    "commit_project_changes": _handle_commit_project_changes,
+    "save_code_run": _handle_save_code_run,
+    "save_code_content": _handle_save_code_content,
+    "delete_message": _handle_delete_message,
+}
+
+async def handle_action_message(message_type: str, payload: dict, websocket: WebSocket, client_id: str, session_id: str):
+    handler = _ACTION_HANDLERS.get(message_type)
+    if handler is None or not payload:
+        return
+    user = await auth.get_user_by_session_token_internal(websocket.cookies.get(auth.SESSION_COOKIE_NAME))
+    if not user:
+        return
+    await handler(payload, websocket, client_id, session_id, user)
 
 # [ADD] in app/main.py
 
@@ -1813,57 +2043,112 @@ async def hide_deleted_message_for_user(
         conn.commit()
     except sqlite3.Error as e:
         # This will likely fail only on a major DB issue, not if the entry exists.
-        print(f"Error hiding message {message_id} for user {user_id}: {e}")
+        logger.error("Error hiding message %s for user %s: %s", message_id, user_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error while hiding message.")
     finally:
         if conn:
             conn.close()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-@app.get("/api/sessions", response_model=List[models.SessionResponseModel], tags=["Sessions"])
+# Builds the JSON array for the sessions list inside SQLite, in the shape of
+# models.SessionResponseModel, so the endpoint can return the string as-is.
+_SESSION_LIST_JSON_SELECT = """
+    SELECT json_group_array(json_object(
+        'id', id, 'name', name, 'created_at', created_at, 'last_active', last_active,
+        'host_user_id', host_user_id, 'is_member', json(CASE WHEN is_member THEN 'true' ELSE 'false' END),
+        'access_level', access_level, 'is_active', json(CASE WHEN is_active THEN 'true' ELSE 'false' END)
+    ))
+"""
+
+_SQL_JOINABLE_SESSIONS_JSON = _SESSION_LIST_JSON_SELECT + """
+    FROM (SELECT s.id, s.name, s.created_at, s.last_accessed_at AS last_active, s.host_user_id, s.access_level, s.is_active,
+                 EXISTS (SELECT 1 FROM session_participants sp
+                         WHERE sp.session_id = s.id AND sp.user_id = ? AND sp.is_hidden = 0) AS is_member
+          FROM sessions s
+          WHERE s.is_active = 1 AND s.access_level IN ('public', 'protected')
+          ORDER BY s.created_at DESC)"""
+_SQL_PERSONAL_SESSIONS_JSON = _SESSION_LIST_JSON_SELECT + """
+    FROM (SELECT s.id, s.name, s.created_at, s.last_accessed_at AS last_active, s.host_user_id, s.access_level, s.is_active,
+                 1 AS is_member
+          FROM sessions s
+          JOIN session_participants sp ON s.id = sp.session_id
+          WHERE sp.user_id = ? AND sp.is_hidden = 0
+          ORDER BY s.is_active DESC, s.last_accessed_at DESC)"""
+
+def _fetch_user_sessions_json_sync(user_id: int, scope: str) -> str:
+    """Returns the session list for the given scope as a JSON array string. Runs in a worker thread."""
+    sql = _SQL_JOINABLE_SESSIONS_JSON if scope == "joinable" else _SQL_PERSONAL_SESSIONS_JSON
+    with database.get_conn() as conn:
+        return conn.execute(sql, (user_id,)).fetchone()[0]
+
+async def _load_user_sessions_json(user_id: int, scope: str) -> str:
+    key = (user_id, scope)
+    this_task = asyncio.current_task()
+    try:
+        sessions_json = await database.run_in_db_thread(_fetch_user_sessions_json_sync, user_id, scope)
+        if state.sessions_list_load_tasks.get(key) is this_task:
+            state.cache_sessions_list(user_id, scope, sessions_json)
+        return sessions_json
+    finally:
+        if state.sessions_list_load_tasks.get(key) is this_task:
+            del state.sessions_list_load_tasks[key]
+
+@app.get("/api/sessions", responses={200: {"model": List[models.SessionResponseModel]}}, tags=["Sessions"])
 async def get_user_sessions(
     request: Request,
-    response: FastAPIResponse,
     scope: str = "personal",
+    no_cache: bool = False,
     user: Dict[str, Any] = Depends(auth.get_current_active_user)
-) -> List[models.SessionResponseModel]:
-    response.headers["Cache-Control"] = "no-store"
+) -> Response:
     user_id = user.get('id')
-    
-    conn = None
-    try:
-        conn = database.get_db_connection()
+    if no_cache:
+        sessions_json = await database.run_in_db_thread(_fetch_user_sessions_json_sync, user_id, scope)
+    else:
+        sessions_json = state.get_cached_sessions_list(user_id, scope)
+        if sessions_json is None:
+            # Concurrent requests (several tabs, reconnect storms) share one query; shield it so
+            # one caller disconnecting doesn't cancel the load the others are waiting on.
+            load_task = state.sessions_list_load_tasks.get((user_id, scope))
+            if load_task is None:
+                load_task = asyncio.create_task(_load_user_sessions_json(user_id, scope))
+                state.sessions_list_load_tasks[(user_id, scope)] = load_task
+            sessions_json = await asyncio.shield(load_task)
+    return Response(content=sessions_json, media_type="application/json", headers={"Cache-Control": "no-store"})
+
+_SQL_HIDE_INACTIVE_SESSION_FOR_USER = """UPDATE session_participants SET is_hidden = 1
+    WHERE session_id = ? AND user_id = ?
+    AND EXISTS (SELECT 1 FROM sessions WHERE id = ? AND is_active = 0)"""
+_SQL_LEAVE_ACTIVE_SESSION_AS_GUEST = """DELETE FROM session_participants
+    WHERE session_id = ? AND user_id = ?
+    AND EXISTS (SELECT 1 FROM sessions WHERE id = ? AND is_active = 1 AND host_user_id != ?)"""
+_SQL_CLOSE_OWN_PRIVATE_SESSION = "UPDATE sessions SET is_active = 0 WHERE id = ? AND is_active = 1 AND host_user_id = ? AND access_level = 'private'"
+
+def _leave_or_close_session_sync(session_id: str, user_id: int) -> bool:
+    """
+    Hides, leaves or closes a session for the user in one transaction. Returns True if the
+    session was closed, which changes it for every participant. Runs in a worker thread.
+    """
+    with database.get_conn() as conn:
         cursor = conn.cursor()
+
+        # Each statement carries its own guard on the session's state, so at most one of them
+        # matches and the decision is made atomically inside one transaction (no SELECT first).
+        # The first statement that touches a row settles the action, so the rest are skipped.
+        for sql, params in (
+            # If the session is already inactive, the action is always to hide it from history.
+            (_SQL_HIDE_INACTIVE_SESSION_FOR_USER, (session_id, user_id, session_id)),
+            # A non-host leaving an active session.
+            (_SQL_LEAVE_ACTIVE_SESSION_AS_GUEST, (session_id, user_id, session_id, user_id)),
+            # The host closing their own active private session.
+            (_SQL_CLOSE_OWN_PRIVATE_SESSION, (session_id, user_id)),
+        ):
+            if cursor.execute(sql, params).rowcount:
+                break
+        else:
+            sql = None
         
-        user_session_ids = {row['session_id'] for row in cursor.execute("SELECT session_id FROM session_participants WHERE user_id = ? AND is_hidden = 0", (user_id,))}
-
-        if scope == "joinable":
-            cursor.execute(
-                """SELECT s.id, s.name, s.created_at, s.last_accessed_at AS last_active, s.host_user_id, s.access_level, s.is_active
-                   FROM sessions s
-                   WHERE s.is_active = 1 AND s.access_level IN ('public', 'protected')
-                   ORDER BY s.created_at DESC"""
-            )
-        else: # "personal" scope
-            cursor.execute(
-                """SELECT s.id, s.name, s.created_at, s.last_accessed_at AS last_active, s.host_user_id, s.access_level, s.is_active
-                   FROM sessions s
-                   JOIN session_participants sp ON s.id = sp.session_id
-                   WHERE sp.user_id = ? AND sp.is_hidden = 0
-                   ORDER BY s.is_active DESC, s.last_accessed_at DESC""",
-                (user_id,)
-            )
-        
-        rows = cursor.fetchall()
-        sessions_list = []
-        for row in rows:
-            session_dict = dict(row)
-            session_dict['is_member'] = session_dict['id'] in user_session_ids
-            sessions_list.append(models.SessionResponseModel(**session_dict))
-            
-        return sessions_list
-    finally:
-        if conn: conn.close()
+        conn.commit()
+        return sql is _SQL_CLOSE_OWN_PRIVATE_SESSION
 
 @app.delete("/api/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Sessions"])
 async def delete_session_route(
@@ -1874,37 +2159,11 @@ async def delete_session_route(
 ):
     await csrf_protect.validate_csrf(request)
     user_id = user.get('id')
-    conn = None
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT host_user_id, access_level, is_active FROM sessions WHERE id = ?", (session_id,))
-        session = cursor.fetchone()
-
-        if not session:
-            return Response(status_code=status.HTTP_204_NO_CONTENT)
-
-        is_host = (session["host_user_id"] == user_id)
-
-        if not session["is_active"]:
-            # If the session is already inactive, the action is always to hide it from history.
-            cursor.execute(
-                "UPDATE session_participants SET is_hidden = 1 WHERE session_id = ? AND user_id = ?",
-                (session_id, user_id)
-            )
-        elif is_host and session["access_level"] == 'private':
-            cursor.execute("UPDATE sessions SET is_active = 0 WHERE id = ?", (session_id,))
-        elif not is_host:
-            cursor.execute(
-                "DELETE FROM session_participants WHERE session_id = ? AND user_id = ?",
-                (session_id, user_id)
-            )
-        
-        conn.commit()
-        return Response(status_code=status.HTTP_204_NO_CONTENT)
-    finally:
-        if conn: conn.close()
+    # The whole transaction, commit included, runs off the event loop.
+    session_closed = await database.run_in_db_thread(_leave_or_close_session_sync, session_id, user_id)
+    # Closing the session changes every participant's list; hiding or leaving only the caller's.
+    state.invalidate_sessions_list_cache(None if session_closed else user_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @app.delete("/api/sessions/{session_id}/edited-blocks/{code_block_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Code Execution"])
 async def delete_edited_code_block_route(
@@ -1917,11 +2176,12 @@ async def delete_edited_code_block_route(
     await csrf_protect.validate_csrf(request)
     conn = database.get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM session_participants WHERE session_id = ? AND user_id = ?", (session_id, user['id']))
+    cursor.execute(database.SQL_CHECK_SESSION_PARTICIPANT, (session_id, user['id']))
     if not cursor.fetchone():
         conn.close()
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied.")
     conn.close()
+    await database.discard_pending_edited_code(session_id, code_block_id)
     if not database.delete_edited_code_block(session_id, code_block_id):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to restore code block.")
     state.remove_memory_for_client(session_id)
@@ -1937,9 +2197,11 @@ async def websocket_lobby_endpoint(websocket: WebSocket):
     await state.connect_to_lobby(websocket)
     try:
         while True:
-            # Keep the connection alive
-            await websocket.receive_text()
-    except WebSocketDisconnect:
+            # Keep the connection alive; the lobby is push-only, so incoming frames are ignored undecoded.
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
         await state.disconnect_from_lobby(websocket)
 
 @app.delete("/api/sessions/{session_id}/delete-by-host", status_code=status.HTTP_204_NO_CONTENT, tags=["Sessions"])
@@ -1951,72 +2213,113 @@ async def delete_session_by_host(
 ):
     await csrf_protect.validate_csrf(request)
     user_id = user.get('id')
-    conn = None
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT host_user_id FROM sessions WHERE id = ?", (session_id,))
-        session = cursor.fetchone()
-        if not session or session['host_user_id'] != user_id:
+    with database.get_conn() as conn:
+        # The host guard is part of the UPDATE, so ownership check and soft delete are one
+        # statement; a 403 has written nothing, and database errors go to the app-wide handler.
+        cursor = conn.execute("UPDATE sessions SET is_active = 0 WHERE id = ? AND host_user_id = ?", (session_id, user_id))
+        if cursor.rowcount == 0:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not the host of this session and cannot delete it.")
-        
-        # Mark the session as inactive instead of a hard delete
-        cursor.execute("UPDATE sessions SET is_active = 0 WHERE id = ?", (session_id,))
         conn.commit()
+    state.invalidate_sessions_list_cache()
 
-        # Notify clients in the lobby and the session itself
-        delete_payload = {"type": "session_deleted", "payload": {"session_id": session_id}}
-        await state.broadcast_to_lobby(delete_payload)
-        await state.broadcast(session_id, delete_payload)
+    # Notify clients in the lobby and the session itself
+    delete_payload = {"type": "session_deleted", "payload": {"session_id": session_id}}
+    await state.broadcast_to_lobby(delete_payload)
+    await state.broadcast(session_id, delete_payload)
 
-        return Response(status_code=status.HTTP_204_NO_CONTENT)
-    except sqlite3.Error:
-        if conn: conn.rollback()
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error during session deletion.")
-    finally:
-        if conn: conn.close()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 # In main.py
 
+OPEN_FILE_LIMIT_TARGET = 1048576
+CONTAINER_CLEANUP_SHUTDOWN_TIMEOUT_SECONDS = 10
+TURN_FINALIZE_SHUTDOWN_TIMEOUT_SECONDS = 10
+
+def _raise_open_file_limit(target: int = OPEN_FILE_LIMIT_TARGET) -> None:
+    """Raises RLIMIT_NOFILE towards `target` so many concurrent WebSockets don't exhaust file descriptors."""
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft >= target:
+            return
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, max(hard, target)))
+        except (ValueError, OSError):
+            # Raising the hard limit needs privileges; fall back to the current hard limit.
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(target, hard), hard))
+        logger.info("Open file limit raised to %s.", resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+    except (ValueError, OSError) as e:
+        logger.warning("Could not raise open file limit: %s", e)
+
 @app.on_event("startup")
 async def startup_event():
-    print("=" * 60)
-    print(" Tesseracs Chat - Code Version: 2025-09-25-STREAMING-FIX-6")
-    print("=" * 60)
+    logger.info("Tesseracs Chat - Code Version: 2025-09-25-STREAMING-FIX-6")
+    _raise_open_file_limit()
 
-    print("Running startup cleanup for orphaned Docker containers...")
+    logger.info("Running startup cleanup for orphaned Docker containers...")
     await docker_utils.cleanup_dangling_containers()
 
-    print("Application startup: Initializing database...")
+    logger.info("Application startup: Initializing database...")
     db_parent_dir = config.DATABASE_PATH.parent
     if not db_parent_dir.exists():
         db_parent_dir.mkdir(parents=True, exist_ok=True)
     database.init_db()
-    print("Database initialization check complete.")
+    logger.info("Database initialization check complete.")
     
-    print("Starting background container scavenger...")
+    logger.info("Starting background container scavenger...")
     scavenger_interval = 600 
-    asyncio.create_task(docker_utils.background_scavenger_task(scavenger_interval))
+    _spawn_background_task(docker_utils.background_scavenger_task(scavenger_interval))
 
     docker_utils.start_docker_worker()
     llm.start_llm_worker()
+    database.start_edited_code_writer()
+    database.start_wal_checkpointer()
+
+    if config.STATIC_DIR:
+        dist_assets_dir = config.STATIC_DIR / "dist"
+        if dist_assets_dir.is_dir():
+            precompressed_count = await asyncio.to_thread(utils.precompress_static_files, dist_assets_dir)
+            logger.info("Precompressed %d asset(s) in %s.", precompressed_count, dist_assets_dir)
+        for page_name in HTML_PAGE_NAMES:
+            try:
+                if _load_html_template(config.STATIC_DIR / page_name) is None:
+                    logger.warning("HTML page %s not found in %s.", page_name, config.STATIC_DIR)
+            except OSError as e:
+                logger.warning("Could not preload HTML page %s: %s", page_name, e)
 
     try:
         encryption_utils._get_fernet()
     except ValueError as e:
-        print(f"STARTUP WARNING: Could not pre-initialize Fernet. {e}")
+        logger.warning("Could not pre-initialize Fernet. %s", e)
         pass
 
 @app.on_event("shutdown")
-def shutdown_event():
-    print("Application shutdown: Stopping LLM worker...")
+async def shutdown_event():
+    if state.turn_finalize_tasks:
+        logger.info("Application shutdown: Waiting for %d AI reply save(s)...", len(state.turn_finalize_tasks))
+        try:
+            await asyncio.wait_for(asyncio.gather(*state.turn_finalize_tasks, return_exceptions=True), timeout=TURN_FINALIZE_SHUTDOWN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Application shutdown: AI reply saves did not finish in time.")
+    if state.container_cleanup_tasks:
+        logger.info("Application shutdown: Waiting for %d container cleanup(s)...", len(state.container_cleanup_tasks))
+        try:
+            await asyncio.wait_for(asyncio.gather(*state.container_cleanup_tasks, return_exceptions=True), timeout=CONTAINER_CLEANUP_SHUTDOWN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Application shutdown: Container cleanups did not finish in time.")
+    await database.stop_edited_code_writer()
+    database.stop_wal_checkpointer()
+    logger.info("Application shutdown: Stopping LLM worker...")
     llm.shutdown_llm_worker()
-    print("Application shutdown: Stopping Docker worker...")
+    logger.info("Application shutdown: Stopping Docker worker...")
     docker_utils.shutdown_docker_worker()
+    database.close_db_pool()
+    logging_utils.shutdown_logging()
 
 if config.STATIC_DIR and config.STATIC_DIR.is_dir():
     dist_dir = config.STATIC_DIR / "dist"
     if dist_dir.is_dir():
-        app.mount("/dist", StaticFiles(directory=dist_dir), name="dist_assets")
+        app.mount("/dist", utils.PrecompressedStaticFiles(directory=dist_dir), name="dist_assets")
     app.mount("/static", StaticFiles(directory=config.STATIC_DIR), name="static_general")
 
@@ -10,8 +10,9 @@ import tarfile
 import io
 import shutil
 import zipfile
-import traceback
+import logging
 
+logger = logging.getLogger(__name__)
 
 def apply_project_modifications(
     repo_blob: bytes, 
@@ -31,7 +32,7 @@ def apply_project_modifications(
         for op in operations:
             op_path = op.get("path", "").lstrip('./')
             if ".." in op_path or op_path.startswith('/'):
-                print(f"PROJECT_UTILS: Skipping unsafe path in operation: {op_path}")
+                logger.warning("Skipping unsafe path in operation: %s", op_path)
                 continue
             
             full_path = os.path.join(project_root, op_path)
@@ -70,8 +71,8 @@ def apply_project_modifications(
         return new_repo_blob, None
     except Exception as e:
         error_msg = f"Failed during project modification: {e}"
-        print(f"PROJECT_UTILS ERROR: {error_msg}")
-        traceback.print_exc()
+        # Full tracebacks only at DEBUG: these paths are reachable from client-supplied data.
+        logger.error("%s", error_msg, exc_info=logger.isEnabledFor(logging.DEBUG))
         return None, error_msg
     finally:
         if temp_dir_to_clean and os.path.exists(temp_dir_to_clean):
@@ -121,58 +122,57 @@ def parse_file_blocks(content: str) -> Optional[List[Dict[str, Any]]]:
             })
         return files if files else None
     except Exception as e:
-        print(f"PROJECT_UTILS PARSE ERROR: Failed to parse file blocks - {e}")
+        logger.error("Failed to parse file blocks: %s", e)
         return None
 
 def parse_project_from_full_response(content: str) -> Optional[Dict[str, Any]]:
     """Parses a full AI response string containing a _PROJECT_START_ block to extract its data."""
     try:
-        print("\n" + "="*20 + " NEW DETAILED PARSER LOG " + "="*20)
-        print(f"[PARSER STEP 0] Full raw content received (length: {len(content)}):\n---\n{content}\n---")
+        logger.debug("[PARSER STEP 0] Full raw content received (length: %d):\n---\n%s\n---", len(content), content)
 
         # 1. Isolate the main project block.
         project_block_match = re.search(r"_PROJECT_START_([\s\S]*?)_PROJECT_END_", content, re.DOTALL)
         if not project_block_match:
-            print("[PARSER] ERROR: Could not find a complete _PROJECT_START_..._PROJECT_END_ block.")
+            logger.warning("[PARSER] Could not find a complete _PROJECT_START_..._PROJECT_END_ block.")
             return None
         
         project_content_raw = project_block_match.group(1).strip()
-        print(f"[PARSER STEP 1] Isolated project content (length: {len(project_content_raw)}):\n---\n{project_content_raw}\n---")
+        logger.debug("[PARSER STEP 1] Isolated project content (length: %d):\n---\n%s\n---", len(project_content_raw), project_content_raw)
         
         # 2. Extract the project header JSON.
         project_header_match = re.search(r"^(.*?)_JSON_END_", project_content_raw, re.DOTALL)
         if not project_header_match:
-            print("[PARSER] ERROR: Could not find _JSON_END_ for the project header.")
+            logger.warning("[PARSER] Could not find _JSON_END_ for the project header.")
             return None
             
         project_payload = json.loads(project_header_match.group(1).strip())
         project_name = project_payload.get("name", "Untitled Project")
-        print(f"[PARSER STEP 2] Found project name: '{project_name}'")
+        logger.debug("[PARSER STEP 2] Found project name: '%s'", project_name)
 
         # 3. Find the content after the project header.
         content_after_header = project_content_raw[project_header_match.end():]
-        print(f"[PARSER STEP 3] Content after project header (length: {len(content_after_header)}):\n---\n{content_after_header}\n---")
+        logger.debug("[PARSER STEP 3] Content after project header (length: %d):\n---\n%s\n---", len(content_after_header), content_after_header)
 
         # 4. Split the remaining content by the file start tag.
         # This gives us the intro text and then each subsequent file block.
         file_blocks_raw = content_after_header.split("_FILE_START_")
         
         intro_text = file_blocks_raw.pop(0).strip()
-        print(f"[PARSER STEP 4] Found intro text: '{intro_text}'")
+        logger.debug("[PARSER STEP 4] Found intro text: '%s'", intro_text)
 
         file_blocks = []
         # 5. Iterate through each potential file block.
         for i, block_raw in enumerate(file_blocks_raw):
-            print(f"\n[PARSER STEP 5.{i}] Processing raw file block #{i+1}:\n---\n{block_raw}\n---")
+            logger.debug("[PARSER STEP 5.%d] Processing raw file block #%d:\n---\n%s\n---", i, i + 1, block_raw)
             
             if "_JSON_END_" not in block_raw:
-                print(f"[PARSER] WARN: Skipping malformed file block #{i+1} (missing _JSON_END_)")
+                logger.warning("[PARSER] Skipping malformed file block #%d (missing _JSON_END_)", i + 1)
                 continue
 
             # Split the block into its JSON part and the content part.
             payload_str, content_and_end_tag = block_raw.split("_JSON_END_", 1)
-            print(f"[PARSER STEP 5.{i}.A] Extracted payload string:\n---\n{payload_str}\n---")
-            print(f"[PARSER STEP 5.{i}.B] Extracted content + end tag:\n---\n{content_and_end_tag}\n---")
+            logger.debug("[PARSER STEP 5.%d.A] Extracted payload string:\n---\n%s\n---", i, payload_str)
+            logger.debug("[PARSER STEP 5.%d.B] Extracted content + end tag:\n---\n%s\n---", i, content_and_end_tag)
             
             # The content is everything before the final _FILE_END_ tag.
             # Using rsplit is more robust against content that might contain the end tag text.
@@ -182,44 +182,41 @@ def parse_project_from_full_response(content: str) -> Optional[Dict[str, Any]]:
                  # Handle malformed tags like _FILE_END (missing final underscore)
                  file_content_str = content_and_end_tag.rsplit("_FILE_END", 1)[0].strip()
 
-            print(f"[PARSER STEP 5.{i}.C] Extracted file content (length: {len(file_content_str)}):\n---\n{file_content_str}\n---")
+            logger.debug("[PARSER STEP 5.%d.C] Extracted file content (length: %d):\n---\n%s\n---", i, len(file_content_str), file_content_str)
 
             try:
                 file_args = json.loads(payload_str.strip())
                 path = file_args.get("path")
                 if not path:
-                    print(f"[PARSER] WARN: Skipping file block #{i+1} with no path in JSON.")
+                    logger.warning("[PARSER] Skipping file block #%d with no path in JSON.", i + 1)
                     continue
                 
                 if len(file_content_str) > 0:
-                    print(f"[PARSER] SUCCESS: Adding file '{path}' to project.")
+                    logger.debug("[PARSER] Adding file '%s' to project.", path)
                     file_blocks.append({
                         "path": path,
                         "language": get_language_from_extension(path),
                         "content": file_content_str
                     })
                 else:
-                    print(f"[PARSER] WARN: Skipping file '{path}' because its content is empty after final parsing.")
+                    logger.warning("[PARSER] Skipping file '%s' because its content is empty after final parsing.", path)
 
             except json.JSONDecodeError:
-                print(f"[PARSER] WARN: Skipping file block #{i+1} with invalid JSON payload.")
+                logger.warning("[PARSER] Skipping file block #%d with invalid JSON payload.", i + 1)
                 continue
 
         if not file_blocks:
-            print("[PARSER] ERROR: No valid file blocks were parsed from the project after iterating.")
+            logger.warning("[PARSER] No valid file blocks were parsed from the project after iterating.")
             return None
 
-        print("\n[PARSER FINAL] Successfully parsed all data.")
-        print("="*50 + "\n")
+        logger.debug("[PARSER FINAL] Successfully parsed all data.")
         return {
             "name": project_name,
             "intro_text": intro_text,
             "files": file_blocks
         }
     except Exception as e:
-        print(f"!!! PROJECT_UTILS CRITICAL ERROR in parse_project_from_full_response: {e}")
-        traceback.print_exc()
-        print("="*50 + "\n")
+        logger.error("Error in parse_project_from_full_response: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
         return None
 
 def create_zip_from_blob(repo_blob: bytes) -> Tuple[Optional[io.BytesIO], Optional[str]]:
@@ -341,7 +338,7 @@ def move_file_and_repack_repo(repo_blob: bytes, source_path: str, destination_pa
 
     except subprocess.CalledProcessError as e:
         error_msg = f"Git move operation failed: {e.stderr}"
-        print(f"PROJECT_UTILS GIT ERROR: {error_msg}")
+        logger.error("%s", error_msg)
         return None, error_msg
     except Exception as e:
         return None, str(e)
@@ -378,7 +375,7 @@ def unpack_git_repo_to_temp_dir(repo_blob: bytes) -> Tuple[Optional[str], Option
             
     except Exception as e:
         error_msg = f"Failed to unpack git repo to temp dir: {e}"
-        print(f"PROJECT_UTILS ERROR: {error_msg}")
+        logger.error("%s", error_msg)
         if unpack_dir and os.path.exists(unpack_dir):
             shutil.rmtree(unpack_dir)
         return None, error_msg
@@ -407,7 +404,7 @@ def create_project_directory_and_files(project_data: Dict[str, Any]) -> Tuple[Op
             content = file_info.get("content", "")
             
             if not file_path_str or file_path_str.startswith("/") or ".." in file_path_str:
-                print(f"[EXEC-TRACE] Skipping potentially unsafe file path: {file_path_str}")
+                logger.warning("Skipping potentially unsafe file path: %s", file_path_str)
                 continue
                 
             full_path = project_dir / file_path_str.lstrip('./')
@@ -420,7 +417,7 @@ def create_project_directory_and_files(project_data: Dict[str, Any]) -> Tuple[Op
         return str(project_dir), None
     except Exception as e:
         error_msg = f"Failed during project file creation: {e}"
-        print(f"[EXEC-TRACE] ERROR: {error_msg}")
+        logger.error("%s", error_msg)
         if project_dir and project_dir.exists():
             shutil.rmtree(project_dir)
         return None, error_msg
@@ -460,7 +457,7 @@ def create_and_pack_git_repo(project_data: Dict[str, Any]) -> Tuple[Optional[byt
         return in_memory_file.getvalue(), None
     except Exception as e:
         error_msg = f"Failed during project creation/packing: {e}"
-        print(f"PROJECT_UTILS ERROR: {error_msg}")
+        logger.error("%s", error_msg)
         # Clean up only on FAILURE
         if project_dir and os.path.exists(project_dir):
             shutil.rmtree(project_dir)
@@ -510,7 +507,7 @@ def unpack_git_repo_from_blob(repo_blob: bytes) -> Tuple[Optional[Dict[str, Any]
                             "timestamp": int(parts[2]) * 1000
                         })
             except (subprocess.CalledProcessError, FileNotFoundError) as e:
-                print(f"Warning: Could not get git log: {e}")
+                logger.warning("Could not get git log: %s", e)
 
             meta_file_path = os.path.join(project_root_path, '.tesseracs_meta.json')
             file_order_map = {}
@@ -546,7 +543,7 @@ def unpack_git_repo_from_blob(repo_blob: bytes) -> Tuple[Optional[Dict[str, Any]
                             'lastModified': stats.st_mtime * 1000
                         })
                     except UnicodeDecodeError:
-                        print(f"Warning: Could not read file {relative_path} as UTF-8 text.")
+                        logger.warning("Could not read file %s as UTF-8 text.", relative_path)
 
             if file_order_map:
                 files_list.sort(key=lambda f: file_order_map.get(f['path'], float('inf')))
@@ -557,8 +554,7 @@ def unpack_git_repo_from_blob(repo_blob: bytes) -> Tuple[Optional[Dict[str, Any]
             
     except Exception as e:
         error_msg = f"Failed to unpack and read git repo blob: {e}"
-        print(f"PROJECT_UTILS ERROR: {error_msg}")
-        traceback.print_exc()
+        logger.error("%s", error_msg, exc_info=logger.isEnabledFor(logging.DEBUG))
         return None, error_msg
 
 def get_project_state_at_commit(repo_blob: bytes, commit_hash: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
@@ -606,7 +602,7 @@ def get_project_state_at_commit(repo_blob: bytes, commit_hash: str) -> Tuple[Opt
                         'lastModified': stats.st_mtime * 1000
                     })
                 except UnicodeDecodeError:
-                    print(f"Warning: Could not read file {relative_path} as UTF-8 text.")
+                    logger.warning("Could not read file %s as UTF-8 text.", relative_path)
 
         if file_order_map:
             files_list.sort(key=lambda f: file_order_map.get(f['path'], float('inf')))
@@ -675,7 +671,7 @@ def add_output_and_commit(project_path: str, output: str, user_name: str) -> Opt
         return None
     except subprocess.CalledProcessError as e:
         error_msg = f"Git operation failed: {e.stderr}"
-        print(f"PROJECT_UTILS GIT ERROR: {error_msg}")
+        logger.error("%s", error_msg)
         return error_msg
     except Exception as e:
         return str(e)
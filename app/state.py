@@ -1,19 +1,30 @@
 import asyncio
 import json
+import logging
 import sqlite3
 import datetime
-from langchain.memory import ConversationBufferMemory
+import time
+import orjson
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, messages_from_dict, messages_to_dict
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Set, Tuple, Union
 from fastapi import WebSocket
-from . import database, project_utils
-import traceback
+from . import config, database, project_utils
 import os
 import subprocess
 import shutil
 from pathlib import Path
 
-client_memory: Dict[str, ConversationBufferMemory] = {}
+logger = logging.getLogger(__name__)
+
+# LRU of per-session conversation memory; evicted sessions are rebuilt from chat_messages on next use.
+# The memory is just the session's message list: the LLM chain is shared per worker process and
+# takes the history as input on each call, so no per-session memory/chain object is kept.
+client_memory: "OrderedDict[str, List[BaseMessage]]" = OrderedDict()
+# messages_to_dict() of each cached memory, kept until that memory is invalidated or evicted.
+client_history_serialised: Dict[str, List[Dict[str, Any]]] = {}
+# In-flight memory rebuilds, so concurrent requests for the same session share one load.
+memory_load_tasks: Dict[str, asyncio.Task] = {}
 running_containers: Dict[str, Dict[str, Any]] = {}
 running_containers_lock = asyncio.Lock()
 active_ai_streams: Dict[str, asyncio.Event] = {}
@@ -23,118 +34,268 @@ running_previews_lock = asyncio.Lock()
 preview_routes: Dict[str, str] = {}
 running_code_tasks: Dict[str, asyncio.Task] = {}
 running_code_tasks_lock = asyncio.Lock()
+# Fire-and-forget container cleanups started when a WebSocket closes; awaited on shutdown.
+container_cleanup_tasks: Set[asyncio.Task] = set()
+# Saves of finished AI replies still in flight; awaited on shutdown.
+turn_finalize_tasks: Set[asyncio.Task] = set()
+# Other fire-and-forget tasks (action handlers, LLM turns, the container scavenger). The event loop
+# only keeps weak references to tasks, so they are held here until done.
+background_tasks: Set[asyncio.Task] = set()
+# time.monotonic() of the last sessions.last_accessed_at write per session, used to throttle those writes.
+# Oldest write first; entries past the interval no longer throttle anything and are dropped.
+LAST_ACCESSED_WRITE_INTERVAL_SECONDS = 60
+last_accessed_cache: "OrderedDict[str, float]" = OrderedDict()
+# Each user's LLM settings row, so a chat turn does not query it again, stored with its
+# time.monotonic() expiry. Only the encrypted API key is kept; callers decrypt through
+# encryption_utils.decrypt_data_cached. Dropped when the user changes their settings, and
+# expired after the TTL so writes made elsewhere are picked up too.
+LLM_SETTINGS_CACHE_TTL_SECONDS = 60.0
+LLM_SETTINGS_CACHE_MAX_ENTRIES = 1000
+llm_settings_cache: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# Bumped on every invalidation; a load that was in flight across a bump must not cache its row.
+llm_settings_cache_generation = 0
+# Recent /api/sessions responses keyed by (user_id, scope), stored with their time.monotonic() expiry.
+SESSIONS_LIST_CACHE_TTL_SECONDS = 5.0
+SESSIONS_LIST_CACHE_MAX_ENTRIES = 10000
+sessions_list_cache: "OrderedDict[Tuple[int, str], Tuple[float, str]]" = OrderedDict()
+# In-flight /api/sessions queries, so concurrent requests for the same list share one query.
+sessions_list_load_tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+# Per-session queue of pending chat turns and the task currently draining it.
+CHAT_QUEUE_MAX_PENDING = 4
+chat_turn_queues: Dict[str, asyncio.Queue] = {}
+chat_turn_workers: Dict[str, asyncio.Task] = {}
 
-def _get_memory_from_db_sync(session_id: str) -> Optional[ConversationBufferMemory]:
-    conn = None
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT * FROM chat_messages WHERE session_id = ? ORDER BY timestamp ASC",
+def _fetch_memory_rows_sync(session_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, bytes]]:
+    """Reads a session's messages and the git blobs of the projects they reference. Runs on the DB executor."""
+    with database.get_conn() as conn:
+        messages_rows = [dict(row) for row in conn.execute(
+            "SELECT sender_type, content, project_id FROM chat_messages WHERE session_id = ? ORDER BY timestamp ASC, id ASC",
             (session_id,)
-        )
-        messages_rows = cursor.fetchall()
-        
-        langchain_messages: List[BaseMessage] = []
+        )]
+        project_ids = list({msg['project_id'] for msg in messages_rows if msg['sender_type'] == 'ai' and msg['project_id']})
+        project_blobs = {row['id']: row['git_repo_blob'] for row in database.get_projects_by_ids(conn, project_ids)}
+        return messages_rows, project_blobs
 
-        for row in messages_rows:
-            msg = dict(row)
-            
-            if msg['sender_type'] == 'user':
-                langchain_messages.append(HumanMessage(content=msg['content'] or ""))
+def _build_memory_from_rows_sync(messages_rows: List[Dict[str, Any]], project_blobs: Dict[str, bytes]) -> Optional[List[BaseMessage]]:
+    """
+    Turns message rows into LangChain messages, expanding AI replies that saved a project with its
+    commit history and files. Unpacks repos and runs git, so it belongs on the default executor.
+    """
+    langchain_messages: List[BaseMessage] = []
+
+    for msg in messages_rows:
+        if msg['sender_type'] == 'user':
+            langchain_messages.append(HumanMessage(content=msg['content'] or ""))
+        
+        elif msg['sender_type'] == 'ai':
+            ai_content = msg['content'] or ""
             
-            elif msg['sender_type'] == 'ai':
-                ai_content = msg['content'] or ""
-                
-                if msg['project_id']:
-                    cursor.execute("SELECT git_repo_blob FROM projects WHERE id = ?", (msg['project_id'],))
-                    project_row = cursor.fetchone()
-                    
-                    if project_row and project_row['git_repo_blob']:
-                        repo_blob = project_row['git_repo_blob']
-                        project_path, error = project_utils.unpack_git_repo_to_temp_dir(repo_blob)
+            if msg['project_id']:
+                repo_blob = project_blobs.get(msg['project_id'])
+                if repo_blob:
+                    project_path, error = project_utils.unpack_git_repo_to_temp_dir(repo_blob)
                         
-                        if project_path:
-                            try:
-                                log_result = subprocess.run(
-                                    ['git', 'log', '--pretty=format:%h - %s (%cr)'],
-                                    cwd=project_path, capture_output=True, text=True, check=True
-                                )
-                                commit_history = log_result.stdout.strip()
-
-                                ls_result = subprocess.run(
-                                    ['git', 'ls-tree', '-r', '--name-only', 'HEAD'],
-                                    cwd=project_path, capture_output=True, text=True, check=True
-                                )
-                                file_paths = ls_result.stdout.strip().split('\n')
-
-                                project_context_parts = [
-                                    ai_content,
-                                    f"\n\n--- PROJECT CONTEXT (ID: {msg['project_id']}) ---",
-                                    "Commit History:",
-                                    commit_history,
-                                    "\nLatest Files:"
-                                ]
-
-                                for file_path in file_paths:
-                                    if file_path:
-                                        try:
-                                            full_file_path = os.path.join(project_path, file_path)
-                                            file_content = Path(full_file_path).read_text(encoding="utf-8")
-                                            project_context_parts.append(f"--- file: {file_path} ---\n{file_content}")
-                                        except Exception as e:
-                                            project_context_parts.append(f"--- file: {file_path} ---\nError reading file: {e}")
+                    if project_path:
+                        try:
+                            log_result = subprocess.run(
+                                ['git', 'log', '--pretty=format:%h - %s (%cr)'],
+                                cwd=project_path, capture_output=True, text=True, check=True
+                            )
+                            commit_history = log_result.stdout.strip()
+
+                            ls_result = subprocess.run(
+                                ['git', 'ls-tree', '-r', '--name-only', 'HEAD'],
+                                cwd=project_path, capture_output=True, text=True, check=True
+                            )
+                            file_paths = ls_result.stdout.strip().split('\n')
+
+                            project_context_parts = [
+                                ai_content,
+                                f"\n\n--- PROJECT CONTEXT (ID: {msg['project_id']}) ---",
+                                "Commit History:",
+                                commit_history,
+                                "\nLatest Files:"
+                            ]
+
+                            for file_path in file_paths:
+                                if file_path:
+                                    try:
+                                        full_file_path = os.path.join(project_path, file_path)
+                                        file_content = Path(full_file_path).read_text(encoding="utf-8")
+                                        project_context_parts.append(f"--- file: {file_path} ---\n{file_content}")
+                                    except Exception as e:
+                                        project_context_parts.append(f"--- file: {file_path} ---\nError reading file: {e}")
                                 
-                                ai_content = "\n".join(project_context_parts)
-
-                            except Exception as e:
-                                print(f"STATE_ERROR: Failed to process git repo for project {msg['project_id']}: {e}")
-                            finally:
-                                unpack_dir = os.path.dirname(project_path)
-                                if os.path.exists(unpack_dir):
-                                    shutil.rmtree(unpack_dir)
+                            ai_content = "\n".join(project_context_parts)
+
+                        except Exception as e:
+                            logger.error("Failed to process git repo for project %s: %s", msg['project_id'], e)
+                        finally:
+                            unpack_dir = os.path.dirname(project_path)
+                            if os.path.exists(unpack_dir):
+                                shutil.rmtree(unpack_dir)
                 
-                langchain_messages.append(AIMessage(content=ai_content))
+            langchain_messages.append(AIMessage(content=ai_content))
 
-        if langchain_messages:
-            memory_instance = ConversationBufferMemory(return_messages=True, memory_key="history")
-            memory_instance.chat_memory.messages = langchain_messages
-            return memory_instance
-            
-        return None
-    finally:
-        if conn:
-            conn.close()
+    if langchain_messages:
+        return langchain_messages
+        
+    return None
+
+async def _get_memory_from_db(session_id: str) -> Optional[List[BaseMessage]]:
+    # Only the sqlite reads use the small DB executor; git unpacking and subprocesses could
+    # otherwise hold its threads and stall auth and session lookups.
+    messages_rows, project_blobs = await database.run_in_db_thread(_fetch_memory_rows_sync, session_id)
+    return await asyncio.to_thread(_build_memory_from_rows_sync, messages_rows, project_blobs)
+
+async def get_memory_for_client(session_id: str) -> List[BaseMessage]:
+    memory_instance = client_memory.get(session_id)
+    if memory_instance is not None:
+        client_memory.move_to_end(session_id)
+        return memory_instance
+    # Concurrent callers (e.g. a warm-up and the first chat turn) share one rebuild.
+    return await asyncio.shield(_start_memory_load(session_id))
 
-async def get_memory_for_client(session_id: str) -> ConversationBufferMemory:
-    global client_memory
-    if session_id in client_memory:
-        return client_memory[session_id]
+def warm_memory_for_client(session_id: str):
+    """Starts rebuilding a session's memory in the background so its first LLM turn finds it cached."""
+    if session_id not in client_memory:
+        _start_memory_load(session_id)
 
+def _start_memory_load(session_id: str) -> asyncio.Task:
+    load_task = memory_load_tasks.get(session_id)
+    if load_task is None:
+        load_task = asyncio.create_task(_load_memory_for_client(session_id))
+        memory_load_tasks[session_id] = load_task
+    return load_task
+
+async def _load_memory_for_client(session_id: str) -> List[BaseMessage]:
+    this_task = asyncio.current_task()
     try:
-        memory_instance = await asyncio.to_thread(_get_memory_from_db_sync, session_id)
-        if memory_instance:
-            client_memory[session_id] = memory_instance
-            return memory_instance
-    except Exception as e:
-        print(f"STATE ERROR: Failed to load/reconstruct memory for session {session_id}: {e}")
-        traceback.print_exc()
-
-    new_memory = ConversationBufferMemory(return_messages=True, memory_key="history")
-    client_memory[session_id] = new_memory
-    return new_memory
+        try:
+            memory_instance = await _get_memory_from_db(session_id)
+        except Exception as e:
+            logger.exception("Failed to load/reconstruct memory for session %s", session_id)
+            memory_instance = None
+
+        if not memory_instance:
+            memory_instance = []
+        # If the session's data changed while loading, remove_memory_for_client dropped this task;
+        # hand the result to the waiting callers but don't cache it.
+        if memory_load_tasks.get(session_id) is this_task:
+            _cache_memory_for_client(session_id, memory_instance)
+        return memory_instance
+    finally:
+        if memory_load_tasks.get(session_id) is this_task:
+            del memory_load_tasks[session_id]
+
+def _cache_memory_for_client(session_id: str, memory_instance: List[BaseMessage]):
+    client_memory[session_id] = memory_instance
+    client_memory.move_to_end(session_id)
+    while len(client_memory) > config.MEMORY_LRU_SIZE:
+        evicted_session_id, _ = client_memory.popitem(last=False)
+        client_history_serialised.pop(evicted_session_id, None)
+
+async def get_serialised_history_for_client(session_id: str) -> List[Dict[str, Any]]:
+    """
+    Returns the session's history in messages_to_dict() form for the LLM worker, serialising
+    it only once per memory instance rather than on every turn.
+    """
+    memory_instance = await get_memory_for_client(session_id)
+    history = client_history_serialised.get(session_id)
+    if history is None:
+        history = messages_to_dict(memory_instance)
+        if client_memory.get(session_id) is memory_instance:
+            client_history_serialised[session_id] = history
+    return history
+
+def append_message_to_memory(session_id: str, sender_type: str, content: str):
+    """
+    Adds a just-saved plain chat message to the session's cached memory, the same way
+    _build_memory_from_rows_sync would rebuild it, so a turn does not force a full reload.
+    Messages whose memory form needs more than their content (projects, edits) must use
+    remove_memory_for_client instead.
+    """
+    # A load already in flight may not see this message; let it finish uncached.
+    memory_load_tasks.pop(session_id, None)
+    client_history_serialised.pop(session_id, None)
+    memory_instance = client_memory.get(session_id)
+    if memory_instance is None:
+        return
+    if sender_type == 'ai':
+        memory_instance.append(AIMessage(content=content or ""))
+    else:
+        memory_instance.append(HumanMessage(content=content or ""))
 
 def remove_memory_for_client(session_id: str):
-    global client_memory
-    if session_id in client_memory:
-        del client_memory[session_id]
-        print(f"STATE: Memory cache cleared for session {session_id} due to data change.")
+    memory_load_tasks.pop(session_id, None)
+    client_history_serialised.pop(session_id, None)
+    if client_memory.pop(session_id, None) is not None:
+        logger.debug("Memory cache cleared for session %s due to data change.", session_id)
+
+def get_cached_sessions_list(user_id: int, scope: str) -> Optional[str]:
+    entry = sessions_list_cache.get((user_id, scope))
+    if entry is None:
+        return None
+    expires_at, sessions_json = entry
+    if time.monotonic() >= expires_at:
+        del sessions_list_cache[(user_id, scope)]
+        return None
+    return sessions_json
+
+def cache_sessions_list(user_id: int, scope: str, sessions_json: str):
+    key = (user_id, scope)
+    sessions_list_cache[key] = (time.monotonic() + SESSIONS_LIST_CACHE_TTL_SECONDS, sessions_json)
+    sessions_list_cache.move_to_end(key)
+    while len(sessions_list_cache) > SESSIONS_LIST_CACHE_MAX_ENTRIES:
+        sessions_list_cache.popitem(last=False)
+
+def get_cached_llm_settings(user_id: int) -> Optional[Dict[str, Any]]:
+    entry = llm_settings_cache.get(user_id)
+    if entry is None:
+        return None
+    expires_at, settings = entry
+    if time.monotonic() >= expires_at:
+        del llm_settings_cache[user_id]
+        return None
+    llm_settings_cache.move_to_end(user_id)
+    return settings
+
+def cache_llm_settings(user_id: int, settings: Dict[str, Any]):
+    llm_settings_cache[user_id] = (time.monotonic() + LLM_SETTINGS_CACHE_TTL_SECONDS, settings)
+    llm_settings_cache.move_to_end(user_id)
+    while len(llm_settings_cache) > LLM_SETTINGS_CACHE_MAX_ENTRIES:
+        llm_settings_cache.popitem(last=False)
+
+def invalidate_llm_settings_cache(user_id: int):
+    global llm_settings_cache_generation
+    llm_settings_cache_generation += 1
+    llm_settings_cache.pop(user_id, None)
+
+def record_last_accessed_write(session_id: str, written_at: float):
+    """Notes a last_accessed_at write and forgets sessions whose last write is past the throttle interval."""
+    last_accessed_cache[session_id] = written_at
+    last_accessed_cache.move_to_end(session_id)
+    cutoff = written_at - LAST_ACCESSED_WRITE_INTERVAL_SECONDS
+    while last_accessed_cache and next(iter(last_accessed_cache.values())) <= cutoff:
+        last_accessed_cache.popitem(last=False)
+
+def invalidate_sessions_list_cache(user_id: Optional[int] = None):
+    """Drops one user's cached session lists, or every user's when user_id is None."""
+    # In-flight loads are forgotten too: they may have read the old data, so they must not be
+    # joined by new requests or write their result into the cache.
+    if user_id is None:
+        sessions_list_cache.clear()
+        sessions_list_load_tasks.clear()
+        return
+    for key in [key for key in sessions_list_cache if key[0] == user_id]:
+        del sessions_list_cache[key]
+    for key in [key for key in sessions_list_load_tasks if key[0] == user_id]:
+        del sessions_list_load_tasks[key]
 
 async def register_ai_stream(stream_id: str) -> asyncio.Event:
     async with active_ai_streams_lock:
         if stream_id in active_ai_streams:
-            print(f"STATE WARNING: Stream ID {stream_id} already registered. Overwriting stop event.")
+            logger.warning("Stream ID %s already registered. Overwriting stop event.", stream_id)
         stop_event = asyncio.Event()
         active_ai_streams[stream_id] = stop_event
         return stop_event
@@ -154,6 +315,8 @@ async def signal_stop_ai_stream(stream_id: str) -> bool:
 
 # --- WebSocket Connection Manager ---
 class Connection:
+    __slots__ = ("websocket", "queue")
+
     def __init__(self, websocket: WebSocket, queue: asyncio.Queue):
         self.websocket = websocket
         self.queue = queue
@@ -166,7 +329,7 @@ async def connect(session_id: str, connection: Connection):
         if session_id not in active_connections:
             active_connections[session_id] = []
         active_connections[session_id].append(connection)
-        print(f"STATE: WebSocket connected to session {session_id}. Total connections: {len(active_connections[session_id])}")
+        logger.debug("WebSocket connected to session %s. Total connections: %d", session_id, len(active_connections[session_id]))
 
 async def disconnect(session_id: str, connection: Connection):
     async with active_connections_lock:
@@ -175,11 +338,15 @@ async def disconnect(session_id: str, connection: Connection):
                 active_connections[session_id].remove(connection)
                 if not active_connections[session_id]:
                     del active_connections[session_id]
-                print(f"STATE: WebSocket disconnected from session {session_id}.")
+                logger.debug("WebSocket disconnected from session %s.", session_id)
             except ValueError:
                 pass
 
-async def broadcast(session_id: str, message: dict, exclude_websocket: Optional[WebSocket] = None):
+async def broadcast(session_id: str, message: Union[dict, str, bytes], exclude_websocket: Optional[WebSocket] = None):
+    """
+    Queues `message` for every connection in the session. A str or bytes is treated as an
+    already-serialized JSON frame; a dict is serialized once, to bytes.
+    """
     queues_to_send: List[asyncio.Queue] = []
     async with active_connections_lock:
         if session_id in active_connections:
@@ -188,6 +355,10 @@ async def broadcast(session_id: str, message: dict, exclude_websocket: Optional[
                     queues_to_send.append(conn.queue)
     
     if queues_to_send:
+        # Serialise once here rather than once per connection in each writer task. The UTF-8
+        # bytes are sent as a binary frame, so no connection re-encodes the text.
+        if isinstance(message, dict):
+            message = orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS)
         for queue in queues_to_send:
             await queue.put(message)
 
@@ -199,13 +370,13 @@ async def connect_to_lobby(websocket: WebSocket):
     await websocket.accept()
     async with lobby_connections_lock:
         lobby_connections.append(websocket)
-        print(f"STATE: WebSocket connected to lobby. Total connections: {len(lobby_connections)}")
+        logger.debug("WebSocket connected to lobby. Total connections: %d", len(lobby_connections))
 
 async def disconnect_from_lobby(websocket: WebSocket):
     async with lobby_connections_lock:
         try:
             lobby_connections.remove(websocket)
-            print(f"STATE: WebSocket disconnected from lobby.")
+            logger.debug("WebSocket disconnected from lobby.")
         except ValueError:
             pass
 
@@ -213,7 +384,8 @@ async def broadcast_to_lobby(message: dict):
     websockets_to_send = [ws for ws in lobby_connections]
     
     if websockets_to_send:
+        message_text = orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode()
         await asyncio.gather(
-            *[ws.send_json(message) for ws in websockets_to_send],
+            *[ws.send_text(message_text) for ws in websockets_to_send],
             return_exceptions=True
         )
@@ -1160,6 +1160,10 @@ function createPlotBlock(projectId, plotData, plotIndex) {
     renderPlotWhenReady(plotDivId, plotData);
 }
 
+const wsTextEncoder = new TextEncoder();
+// The server sends its JSON frames as binary (UTF-8) messages; older/constant frames may be text.
+const wsTextDecoder = new TextDecoder();
+
 function saveCodeBlockContent(blockId, content) {
     const container = document.getElementById(blockId);
     if (!container) return;
@@ -1171,7 +1175,9 @@ function saveCodeBlockContent(blockId, content) {
         return;
     }
     
-    websocket.send(JSON.stringify({
+    // Code bodies can be large, so send them as a binary frame: the server parses the
+    // UTF-8 bytes directly instead of first decoding the frame into a string.
+    websocket.send(wsTextEncoder.encode(JSON.stringify({
         type: 'save_code_content',
         payload: {
             session_id: sessionId,
@@ -1179,7 +1185,7 @@ function saveCodeBlockContent(blockId, content) {
             language: language,
             code_content: content
         }
-    }));
+    })));
 }
 
 function createOutputHeaderHTML(title, promptingUserId, statusText = 'Running...', statusClass = 'running') {
@@ -1277,7 +1283,8 @@ async function handleRunStopCodeClick(event) {
             language: mainLanguage
         };
         console.log("[FRONTEND-TRACE] Sending 'run_code' message with payload:", payload);
-        websocket.send(JSON.stringify({ type: 'run_code', payload }));
+        // Binary frame: project_data carries every file's content (see saveCodeBlockContent).
+        websocket.send(wsTextEncoder.encode(JSON.stringify({ type: 'run_code', payload })));
     } else {
         addErrorMessage("Cannot run code: Not connected to server.");
     }
@@ -2044,15 +2051,16 @@ function connectWebSocket() {
     const wsUrl = `${wsProtocol}//${window.location.host}/ws/${sessionId}/${clientId}`;
     try {
         const ws = new WebSocket(wsUrl);
+        ws.binaryType = 'arraybuffer';
         websocket = ws;
         ws.onopen = () => { console.log("[WS_CLIENT] WebSocket connection opened."); setInputDisabledState(false, false); addSystemMessage("Connected to the server."); };
         ws.onmessage = (event) => {
-            if (typeof event.data !== 'string') return;
-            const messageData = JSON.parse(event.data);
+            const frameText = typeof event.data === 'string' ? event.data : wsTextDecoder.decode(event.data);
+            const messageData = JSON.parse(frameText);
             
             console.log("[WebSocket Client] Received message:", messageData);
 
-            if (event.data.startsWith("<ERROR>")) { addErrorMessage(event.data.substring(7)); finalizeTurnOnErrorOrClose(); return; }
+            if (frameText.startsWith("<ERROR>")) { addErrorMessage(frameText.substring(7)); finalizeTurnOnErrorOrClose(); return; }
             
             switch (messageData.type) {
                 case 'ai_thinking': handleAiThinking(messageData.payload); break;
@@ -2479,7 +2487,7 @@ document.addEventListener('DOMContentLoaded', async () => {
                         reply_to_id: null
                     }
                 };
-                websocket.send(JSON.stringify(messagePayload));
+                websocket.send(wsTextEncoder.encode(JSON.stringify(messagePayload)));
             } catch (sendError) {
                 console.error("Error during message send:", sendError);
                 addErrorMessage(`Failed to send message: ${sendError.message}`);
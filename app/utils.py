@@ -1,11 +1,28 @@
 # app/utils.py
 
 from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.staticfiles import StaticFiles
 from fastapi.websockets import WebSocketState
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Scope
+import anyio
+import datetime
+import gzip
 import html
-import traceback
-from typing import Any
+import os
+import stat
+import time
+import logging
+from pathlib import Path
+from typing import Any, Dict
+import asyncio
 import re
+import orjson
+
+logger = logging.getLogger(__name__)
+
+_UTC = datetime.timezone.utc
 
 def escape_html(s: str) -> str:
     """
@@ -16,38 +33,125 @@ def escape_html(s: str) -> str:
     return html.escape(s)
 
 
+def utc_now_iso() -> str:
+    """
+    Returns the current UTC time as an ISO-8601 string with a +00:00 offset,
+    identical in format to datetime.now(timezone.utc).isoformat().
+    """
+    return datetime.datetime.fromtimestamp(time.time(), _UTC).isoformat()
+
+
+_ANSI_ESCAPE_RE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+_EMAIL_RE = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+
 def strip_ansi_codes(text: str) -> str:
     """Removes ANSI escape codes (used for terminal colors) from a string."""
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+    return _ANSI_ESCAPE_RE.sub('', text)
 
 def is_valid_email(email: str) -> bool:
     """
     Validates an email address. A simple check.
     """
-    if not email:
-        return False
-    # Basic regex for email validation
-    import re
-    pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-    if re.match(pattern, email):
-        return True
-    return False
+    return bool(email) and _EMAIL_RE.match(email) is not None
+
+# Outgoing frame queue of each session WebSocket, drained by that connection's single writer task.
+# Messages for a registered socket are queued rather than sent directly, so action handlers and
+# code runs never write to the socket concurrently with the writer.
+_ws_writer_queues: Dict[WebSocket, asyncio.Queue] = {}
+
+def register_ws_writer(websocket: WebSocket, queue: asyncio.Queue):
+    _ws_writer_queues[websocket] = queue
+
+def unregister_ws_writer(websocket: WebSocket):
+    _ws_writer_queues.pop(websocket, None)
+
+def get_ws_writer_queue(websocket: WebSocket) -> "asyncio.Queue | None":
+    return _ws_writer_queues.get(websocket)
 
 async def send_ws_message(websocket: WebSocket, message_type: str, payload: Any):
     """Safely sends a JSON message over the WebSocket with improved logging."""
     if websocket.client_state != WebSocketState.CONNECTED:
-        print(f"[utils] ✗ WebSocket not connected (state: {websocket.client_state.name}), cannot send message")
+        logger.debug("WebSocket not connected (state: %s), cannot send %s", websocket.client_state.name, message_type)
         return False
         
     try:
-        message = {"type": message_type, "payload": payload}
-        await websocket.send_json(message)
+        message = orjson.dumps({"type": message_type, "payload": payload}, option=orjson.OPT_NON_STR_KEYS)
+        writer_queue = _ws_writer_queues.get(websocket)
+        if writer_queue is not None:
+            writer_queue.put_nowait(message)
+        else:
+            await websocket.send_text(message.decode())
         return True
     except WebSocketDisconnect:
-        print(f"[utils] ✗ WebSocket disconnected while trying to send {message_type}")
+        logger.debug("WebSocket disconnected while trying to send %s", message_type)
         return False
     except Exception as e:
-        print(f"[utils] ✗ Error sending WebSocket message ({message_type}): {e}")
-        traceback.print_exc()
-        return False
\ No newline at end of file
+        logger.exception("Error sending WebSocket message (%s)", message_type)
+        return False
+
+
+# Bundled assets worth shipping gzipped; smaller files are not worth the extra request headers.
+PRECOMPRESS_SUFFIXES = frozenset([".js", ".css", ".map", ".svg", ".json", ".html", ".txt"])
+PRECOMPRESS_MIN_BYTES = 1024
+
+def precompress_static_files(directory: Path) -> int:
+    """
+    Writes a gzip sibling (foo.js -> foo.js.gz) for every compressible file under directory,
+    skipping files whose sibling is already up to date. Returns the number of files written.
+    """
+    written = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            source = Path(root) / filename
+            if source.suffix not in PRECOMPRESS_SUFFIXES:
+                continue
+            target = source.with_name(filename + ".gz")
+            try:
+                source_stat = source.stat()
+                if source_stat.st_size < PRECOMPRESS_MIN_BYTES:
+                    continue
+                try:
+                    if target.stat().st_mtime >= source_stat.st_mtime:
+                        continue
+                except FileNotFoundError:
+                    pass
+                # Write to a temp name first so a request never picks up a half-written file.
+                tmp_target = target.with_name(target.name + ".tmp")
+                tmp_target.write_bytes(gzip.compress(source.read_bytes(), compresslevel=9, mtime=0))
+                os.replace(tmp_target, target)
+                written += 1
+            except OSError as e:
+                logger.warning("Could not precompress %s: %s", source, e)
+    return written
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves the .gz sibling written by precompress_static_files when the client
+    accepts gzip and the sibling is not older than the file itself. Asset names are not
+    content-hashed, so responses are marked for revalidation; the ETag then makes that a 304.
+    """
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        request_headers = Headers(scope=scope)
+        if scope["method"] in ("GET", "HEAD") and "gzip" in request_headers.get("accept-encoding", ""):
+            full_path, stat_result = await anyio.to_thread.run_sync(self._lookup_gzip_sibling, path)
+            if stat_result is not None:
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["content-encoding"] = "gzip"
+                response.headers["vary"] = "Accept-Encoding"
+                response.headers["cache-control"] = "no-cache"
+                return response
+
+        response = await super().get_response(path, scope)
+        response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = "no-cache"
+        return response
+
+    def _lookup_gzip_sibling(self, path: str):
+        full_path, stat_result = self.lookup_path(path)
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            return "", None
+        gz_full_path, gz_stat_result = self.lookup_path(path + ".gz")
+        if gz_stat_result is None or gz_stat_result.st_mtime < stat_result.st_mtime:
+            return "", None
+        return gz_full_path, gz_stat_result
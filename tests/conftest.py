@@ -0,0 +1,12 @@
+import pytest
+
+from app import database
+
+@pytest.fixture
+def db_pool(tmp_path, monkeypatch):
+    """A connection pool on a fresh, fully migrated database file in tmp_path."""
+    pool = database.ConnectionPool(tmp_path / "test.db", 2)
+    monkeypatch.setattr(database, "_connection_pool", pool)
+    database.init_db()
+    yield pool
+    pool.close_all()
@@ -0,0 +1,194 @@
+import sqlite3
+import pytest
+
+from app import database
+
+SESSION_ID = "session-1"
+USER_ID = 1
+SAME_SECOND = "2024-01-01 12:00:00"
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+    CREATE TABLE session_participants (session_id TEXT NOT NULL, user_id INTEGER NOT NULL);
+    CREATE TABLE hidden_messages (user_id INTEGER NOT NULL, message_id INTEGER NOT NULL);
+    CREATE TABLE chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, content TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    conn.execute("INSERT INTO session_participants VALUES (?, ?)", (SESSION_ID, USER_ID))
+    yield conn
+    conn.close()
+
+def fetch_page(conn, since=None, since_id=None, limit=-1):
+    rows = conn.execute(
+        database.SQL_SELECT_VISIBLE_MESSAGES_FOR_PARTICIPANT,
+        (since, since, since, since_id, SESSION_ID, USER_ID, limit)
+    ).fetchall()
+    return [row for row in rows if row["id"] is not None]
+
+def test_pagination_does_not_skip_messages_sharing_a_timestamp(conn):
+    # Five rows in one second, so page boundaries fall inside it, plus one later row.
+    for content in ("a", "b", "c", "d", "e"):
+        conn.execute(
+            "INSERT INTO chat_messages (session_id, content, timestamp) VALUES (?, ?, ?)",
+            (SESSION_ID, content, SAME_SECOND)
+        )
+    conn.execute(
+        "INSERT INTO chat_messages (session_id, content, timestamp) VALUES (?, ?, ?)",
+        (SESSION_ID, "f", "2024-01-01 12:00:01")
+    )
+
+    seen = []
+    since, since_id = None, None
+    while True:
+        page = fetch_page(conn, since, since_id, limit=2)
+        if not page:
+            break
+        seen.extend(row["content"] for row in page)
+        since, since_id = page[-1]["timestamp"], page[-1]["id"]
+
+    assert seen == ["a", "b", "c", "d", "e", "f"]
+
+def test_since_without_id_returns_only_later_timestamps(conn):
+    for content, timestamp in (("a", SAME_SECOND), ("b", SAME_SECOND), ("c", "2024-01-01 12:00:01")):
+        conn.execute(
+            "INSERT INTO chat_messages (session_id, content, timestamp) VALUES (?, ?, ?)",
+            (SESSION_ID, content, timestamp)
+        )
+
+    assert [row["content"] for row in fetch_page(conn, since=SAME_SECOND)] == ["c"]
+
+def test_non_participant_gets_no_rows(conn):
+    rows = conn.execute(
+        database.SQL_SELECT_VISIBLE_MESSAGES_FOR_PARTICIPANT,
+        (None, None, None, None, SESSION_ID, USER_ID + 1, -1)
+    ).fetchall()
+    assert rows == []
+
+# --- Connection pool ---
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = database.ConnectionPool(tmp_path / "pool.db", 2)
+    setup_conn = pool.acquire()
+    setup_conn.execute("CREATE TABLE items (value TEXT)")
+    setup_conn.close()
+    yield pool
+    pool.close_all()
+
+def test_closing_a_pooled_connection_returns_it_to_the_pool(pool):
+    conn = pool.acquire()
+    conn.close()
+    assert pool.acquire() is conn
+
+def test_release_rolls_back_an_open_transaction(pool):
+    conn = pool.acquire()
+    conn.execute("INSERT INTO items VALUES ('uncommitted')")
+    assert conn.in_transaction
+    conn.close()
+
+    reused = pool.acquire()
+    assert reused is conn
+    assert not reused.in_transaction
+    assert reused.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+
+def test_double_close_releases_only_once(pool):
+    conn = pool.acquire()
+    conn.close()
+    conn.close()
+    assert pool.acquire() is conn
+    # The second close must not have queued the same connection twice.
+    assert pool.acquire() is not conn
+
+def test_connections_beyond_the_pool_size_are_closed(pool):
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        conn.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conns[-1].execute("SELECT 1")
+    assert {pool.acquire(), pool.acquire()} == set(conns[:2])
+
+def test_get_conn_releases_on_error(pool, monkeypatch):
+    monkeypatch.setattr(database, "_connection_pool", pool)
+    with pytest.raises(RuntimeError):
+        with database.get_conn() as conn:
+            conn.execute("INSERT INTO items VALUES ('lost')")
+            raise RuntimeError("boom")
+    assert pool.acquire() is conn
+    assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+
+# --- Coalescing writer for edited code blocks ---
+
+@pytest.fixture
+def edited_code_writer(db_pool, monkeypatch):
+    monkeypatch.setattr(database, "_pending_edited_blocks", {})
+    monkeypatch.setattr(database, "_edited_code_flush", None)
+    monkeypatch.setattr(database, "_edited_code_writer_task", None)
+    monkeypatch.setattr(database, "_edited_code_writer_wakeup", None)
+    with database.get_conn() as conn:
+        conn.execute("INSERT INTO users (id, name, email) VALUES (1, 'Host', 'host@example.com')")
+        conn.execute(f"INSERT INTO sessions (id, host_user_id) VALUES ('{SESSION_ID}', 1)")
+        conn.commit()
+
+def saved_edited_blocks():
+    with database.get_conn() as conn:
+        rows = conn.execute("SELECT code_block_id, edited_content FROM edited_code_blocks").fetchall()
+        return {row["code_block_id"]: row["edited_content"] for row in rows}
+
+@pytest.mark.asyncio
+async def test_queued_edits_coalesce_into_the_latest_content(edited_code_writer):
+    for content in ("v1", "v2", "v3"):
+        database.queue_edited_code_content(SESSION_ID, "block", "python", content)
+    assert database.get_edited_code_blocks(SESSION_ID) == {"block": "v3"}
+
+    assert await database.flush_edited_code_content()
+    assert saved_edited_blocks() == {"block": "v3"}
+    assert not database._pending_edited_blocks
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_edits_queued(edited_code_writer, monkeypatch):
+    save_batch = database._save_edited_code_batch
+    def failing_batch(batch):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(database, "_save_edited_code_batch", failing_batch)
+    database.queue_edited_code_content(SESSION_ID, "block", "python", "kept")
+
+    assert not await database.flush_edited_code_content()
+    assert database.get_edited_code_blocks(SESSION_ID) == {"block": "kept"}
+
+    monkeypatch.setattr(database, "_save_edited_code_batch", save_batch)
+    assert await database.flush_edited_code_content()
+    assert saved_edited_blocks() == {"block": "kept"}
+
+@pytest.mark.asyncio
+async def test_edit_made_during_a_flush_is_not_dropped(edited_code_writer, monkeypatch):
+    save_batch = database._save_edited_code_batch
+    def save_then_edit(batch):
+        save_batch(batch)
+        # Runs on the DB thread while the flush is in flight.
+        database._pending_edited_blocks[(SESSION_ID, "block")] = (10**9, "python", "newer")
+    monkeypatch.setattr(database, "_save_edited_code_batch", save_then_edit)
+    database.queue_edited_code_content(SESSION_ID, "block", "python", "older")
+
+    assert await database.flush_edited_code_content()
+    assert saved_edited_blocks() == {"block": "older"}
+    assert database.get_edited_code_blocks(SESSION_ID) == {"block": "newer"}
+
+@pytest.mark.asyncio
+async def test_discarded_edits_are_not_written(edited_code_writer):
+    database.queue_edited_code_content(SESSION_ID, "block", "python", "discarded")
+    await database.discard_pending_edited_code(SESSION_ID, "block")
+
+    assert await database.flush_edited_code_content()
+    assert saved_edited_blocks() == {}
+
+@pytest.mark.asyncio
+async def test_stop_writes_what_is_still_queued(edited_code_writer):
+    database.start_edited_code_writer()
+    database.queue_edited_code_content(SESSION_ID, "block", "python", "at shutdown")
+    await database.stop_edited_code_writer()
+    assert saved_edited_blocks() == {"block": "at shutdown"}
@@ -3,10 +3,13 @@ import os
 import shutil
 import tempfile
 import pytest
+import orjson
+from multiprocessing import Pipe
 from unittest.mock import MagicMock
 from fastapi.websockets import WebSocketState
 
-from app import docker_utils, config, state
+from app import docker_utils, config, state, utils
+from app.docker_worker import STREAM_END_SIGNAL
 
 @pytest.fixture(scope="module", autouse=True)
 def manage_docker_worker():
@@ -206,3 +209,82 @@ async def test_interactive_code_execution(language, project_data):
         if project_path and os.path.exists(project_path):
             shutil.rmtree(project_path)
 
+
+# --- Output backlog while the client's writer queue is full (no Docker needed) ---
+
+BACKLOG_PROJECT_ID = "backlog_test_project"
+
+@pytest.fixture
+def worker_pipe(monkeypatch):
+    """Stands in for the Docker worker process; returns the worker's end of the pipe."""
+    parent_conn, child_conn = Pipe()
+    monkeypatch.setattr(docker_utils, "parent_conn", parent_conn)
+    monkeypatch.setattr(docker_utils, "worker_process", MagicMock(is_alive=MagicMock(return_value=True)))
+    yield child_conn
+    parent_conn.close()
+    child_conn.close()
+
+@pytest.fixture
+def full_writer_queue():
+    """A registered socket whose writer queue is already at the frame limit."""
+    websocket = MockWebSocket()
+    writer_queue = asyncio.Queue()
+    for _ in range(docker_utils.CODE_OUTPUT_MAX_QUEUED_FRAMES):
+        writer_queue.put_nowait(b"")
+    utils.register_ws_writer(websocket, writer_queue)
+    yield websocket, writer_queue
+    utils.unregister_ws_writer(websocket)
+
+def send_output(conn, *chunks):
+    for stream, data in chunks:
+        conn.send({"type": "chunk", "stream": stream, "data": data})
+    conn.send({"type": "exit_code", "exit_code": 0})
+    conn.send(STREAM_END_SIGNAL)
+
+async def run(websocket):
+    return await docker_utils.run_code_in_docker(
+        websocket, "client", BACKLOG_PROJECT_ID, {}, "/tmp/project", "run", {}, asyncio.get_running_loop()
+    )
+
+def queued_output(writer_queue):
+    frames = []
+    while not writer_queue.empty():
+        frame = writer_queue.get_nowait()
+        if frame:
+            payload = orjson.loads(frame)["payload"]
+            frames.append((payload["stream"], payload["data"]))
+    return frames
+
+@pytest.mark.asyncio
+async def test_output_held_back_is_coalesced_per_stream(worker_pipe, full_writer_queue):
+    websocket, writer_queue = full_writer_queue
+    send_output(worker_pipe, ("stdout", "a"), ("stdout", "b"), ("stderr", "c"), ("stdout", "d"))
+
+    exit_code, output, error = await run(websocket)
+
+    assert (exit_code, output, error) == (0, "abcd", None)
+    assert queued_output(writer_queue) == [("stdout", "ab"), ("stderr", "c"), ("stdout", "d")]
+
+@pytest.mark.asyncio
+async def test_output_beyond_the_backlog_cap_is_dropped_for_the_client(worker_pipe, full_writer_queue, monkeypatch):
+    websocket, writer_queue = full_writer_queue
+    monkeypatch.setattr(docker_utils, "CODE_OUTPUT_MAX_BACKLOG_CHARS", 4)
+    send_output(worker_pipe, ("stdout", "abc"), ("stdout", "def"), ("stdout", "ghi"))
+
+    exit_code, output, error = await run(websocket)
+
+    # The caller still gets everything; the slow client gets none of the held-back output.
+    assert (exit_code, output, error) == (0, "abcdefghi", None)
+    assert queued_output(writer_queue) == []
+
+@pytest.mark.asyncio
+async def test_output_is_queued_frame_by_frame_while_the_writer_keeps_up(worker_pipe):
+    websocket = MockWebSocket()
+    writer_queue = asyncio.Queue()
+    utils.register_ws_writer(websocket, writer_queue)
+    try:
+        send_output(worker_pipe, ("stdout", "a"), ("stdout", "b"))
+        await run(websocket)
+    finally:
+        utils.unregister_ws_writer(websocket)
+    assert queued_output(writer_queue) == [("stdout", "a"), ("stdout", "b")]
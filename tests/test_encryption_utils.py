@@ -0,0 +1,33 @@
+from cryptography.fernet import Fernet
+
+from app import config, encryption_utils
+
+def test_decrypt_data_cached_round_trip(monkeypatch):
+    monkeypatch.setattr(encryption_utils, "_fernet_instance", Fernet(Fernet.generate_key()))
+    token = encryption_utils.encrypt_data("sk-secret")
+    assert encryption_utils.decrypt_data_cached(token) == "sk-secret"
+    assert encryption_utils.decrypt_data_cached(token) == "sk-secret"
+
+def test_decrypt_data_cached_does_not_remember_failures(monkeypatch):
+    good_fernet = Fernet(Fernet.generate_key())
+    monkeypatch.setattr(encryption_utils, "_fernet_instance", good_fernet)
+    token = encryption_utils.encrypt_data("sk-secret")
+
+    # Wrong key: the token does not verify.
+    monkeypatch.setattr(encryption_utils, "_fernet_instance", Fernet(Fernet.generate_key()))
+    assert encryption_utils.decrypt_data_cached(token) is None
+
+    # Once the right key is back, the same token decrypts.
+    monkeypatch.setattr(encryption_utils, "_fernet_instance", good_fernet)
+    assert encryption_utils.decrypt_data_cached(token) == "sk-secret"
+
+def test_decrypt_data_cached_recovers_from_missing_configuration(monkeypatch):
+    key = Fernet.generate_key()
+    token = Fernet(key).encrypt(b"sk-secret").decode()
+
+    monkeypatch.setattr(encryption_utils, "_fernet_instance", None)
+    monkeypatch.setattr(config, "APP_SECRET_KEY", None)
+    assert encryption_utils.decrypt_data_cached(token) is None
+
+    monkeypatch.setattr(config, "APP_SECRET_KEY", key.decode())
+    assert encryption_utils.decrypt_data_cached(token) == "sk-secret"
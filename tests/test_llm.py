@@ -0,0 +1,58 @@
+import pytest
+from cryptography.fernet import Fernet
+
+from app import database, encryption_utils, llm, state
+
+@pytest.fixture
+def user_id(db_pool, monkeypatch):
+    monkeypatch.setattr(encryption_utils, "_fernet_instance", Fernet(Fernet.generate_key()))
+    monkeypatch.setattr(state, "llm_settings_cache", type(state.llm_settings_cache)())
+    with database.get_conn() as conn:
+        cursor = conn.execute(
+            """INSERT INTO users (name, email, selected_llm_provider_id, selected_llm_model_id, user_llm_api_key_encrypted)
+               VALUES ('Test', 'test@example.com', 'anthropic_claude', 'model-one', ?)""",
+            (encryption_utils.encrypt_data("sk-old"),)
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+def update_settings(user_id, model_id, api_key):
+    # What the settings PUT does: write the row, then drop the cached copy.
+    with database.get_conn() as conn:
+        conn.execute(
+            "UPDATE users SET selected_llm_model_id = ?, user_llm_api_key_encrypted = ? WHERE id = ?",
+            (model_id, encryption_utils.encrypt_data(api_key), user_id)
+        )
+        conn.commit()
+    state.invalidate_llm_settings_cache(user_id)
+
+@pytest.mark.asyncio
+async def test_settings_update_is_visible_on_the_next_turn(user_id):
+    settings = await llm._get_llm_settings(user_id)
+    assert (settings["selected_llm_model_id"], settings["api_key"]) == ("model-one", "sk-old")
+
+    update_settings(user_id, "model-two", "sk-new")
+
+    settings = await llm._get_llm_settings(user_id)
+    assert (settings["selected_llm_model_id"], settings["api_key"]) == ("model-two", "sk-new")
+
+@pytest.mark.asyncio
+async def test_cache_holds_only_the_encrypted_key(user_id):
+    await llm._get_llm_settings(user_id)
+    cached = state.get_cached_llm_settings(user_id)
+    assert "api_key" not in cached
+    assert "sk-old" not in repr(cached)
+
+@pytest.mark.asyncio
+async def test_cached_settings_expire(user_id, monkeypatch):
+    await llm._get_llm_settings(user_id)
+    monkeypatch.setattr(state, "LLM_SETTINGS_CACHE_TTL_SECONDS", -1.0)
+    state.cache_llm_settings(user_id, state.get_cached_llm_settings(user_id))
+    assert state.get_cached_llm_settings(user_id) is None
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(state, "llm_settings_cache", type(state.llm_settings_cache)())
+    monkeypatch.setattr(state, "LLM_SETTINGS_CACHE_MAX_ENTRIES", 2)
+    for cached_user_id in (1, 2, 3):
+        state.cache_llm_settings(cached_user_id, {"selected_llm_model_id": "m"})
+    assert list(state.llm_settings_cache) == [2, 3]
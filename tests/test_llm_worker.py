@@ -0,0 +1,22 @@
+from app import llm_worker
+
+def chain_model(chain):
+    # build_chain returns prompt | model | parser.
+    return chain.steps[1]
+
+def test_openai_compatible_client_carries_the_jobs_api_key():
+    chain = llm_worker.build_chain("openai_compatible_server", "test-model", "sk-job-one", "http://localhost:9/v1")
+    assert chain_model(chain).root_client.api_key == "sk-job-one"
+
+def test_each_job_gets_a_client_with_its_own_key():
+    first = llm_worker.build_chain("openai_compatible_server", "test-model", "sk-job-one", "http://localhost:9/v1")
+    second = llm_worker.build_chain("openai_compatible_server", "test-model", "sk-job-two", "http://localhost:9/v1")
+    assert chain_model(first).root_client.api_key == "sk-job-one"
+    assert chain_model(second).root_client.api_key == "sk-job-two"
+
+def test_anthropic_client_carries_the_jobs_api_key():
+    chain = llm_worker.build_chain("anthropic_claude", "claude-test", "sk-ant-job", None)
+    assert chain_model(chain)._client.api_key == "sk-ant-job"
+
+def test_unknown_provider_has_no_chain():
+    assert llm_worker.build_chain("no_such_provider", "model", "key", None) is None
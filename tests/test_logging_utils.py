@@ -0,0 +1,29 @@
+import pytest
+
+from app import logging_utils
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(logging_utils.time, "monotonic", lambda: now[0])
+    return now
+
+def test_rate_limiter_allows_a_burst_then_drops(clock):
+    limiter = logging_utils.LogRateLimiter(rate=1, burst=3)
+    assert [limiter.allow() for _ in range(5)] == [True, True, True, False, False]
+    assert limiter.take_suppressed() == 2
+    assert limiter.take_suppressed() == 0
+
+def test_rate_limiter_refills_over_time(clock):
+    limiter = logging_utils.LogRateLimiter(rate=2, burst=3)
+    for _ in range(3):
+        limiter.allow()
+    assert not limiter.allow()
+
+    clock[0] += 1.0
+    assert [limiter.allow() for _ in range(3)] == [True, True, False]
+
+def test_rate_limiter_refill_is_capped_at_the_burst(clock):
+    limiter = logging_utils.LogRateLimiter(rate=10, burst=2)
+    clock[0] += 60.0
+    assert [limiter.allow() for _ in range(3)] == [True, True, False]
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from app import main, state
+
+SESSION_ID = "session-1"
+
+@pytest.fixture
+def turns(monkeypatch):
+    """Replaces the chat turn handler with one that records turns and blocks until released."""
+    monkeypatch.setattr(state, "chat_turn_queues", {})
+    monkeypatch.setattr(state, "chat_turn_workers", {})
+    release = asyncio.Event()
+    started, running = [], []
+
+    async def fake_handle_chat_message(session_id, client_id, user, payload, websocket):
+        running.append(payload["text"])
+        assert len(running) == 1, "two turns of one session ran at once"
+        started.append(payload["text"])
+        await release.wait()
+        running.remove(payload["text"])
+    monkeypatch.setattr(main, "handle_chat_message", fake_handle_chat_message)
+    return release, started
+
+def enqueue(text):
+    return main.enqueue_chat_turn(SESSION_ID, "client", {"id": 1}, {"text": text}, None)
+
+@pytest.mark.asyncio
+async def test_turn_queue_rejects_turns_beyond_its_capacity(turns):
+    release, started = turns
+    accepted = [enqueue(str(i)) for i in range(state.CHAT_QUEUE_MAX_PENDING + 1)]
+    assert accepted == [True] * state.CHAT_QUEUE_MAX_PENDING + [False]
+
+    release.set()
+    await state.chat_turn_workers[SESSION_ID]
+    assert started == [str(i) for i in range(state.CHAT_QUEUE_MAX_PENDING)]
+
+@pytest.mark.asyncio
+async def test_turns_run_one_at_a_time_in_order(turns):
+    release, started = turns
+    enqueue("first")
+    await asyncio.sleep(0)
+    assert started == ["first"]
+
+    # The running turn has left the queue, so a full queue's worth can still wait behind it.
+    assert all(enqueue(str(i)) for i in range(state.CHAT_QUEUE_MAX_PENDING))
+    assert started == ["first"]
+
+    release.set()
+    await state.chat_turn_workers[SESSION_ID]
+    assert started == ["first"] + [str(i) for i in range(state.CHAT_QUEUE_MAX_PENDING)]
+
+@pytest.mark.asyncio
+async def test_worker_and_queue_are_removed_once_idle(turns):
+    release, _ = turns
+    release.set()
+    enqueue("only")
+    await state.chat_turn_workers[SESSION_ID]
+    assert SESSION_ID not in state.chat_turn_workers
+    assert SESSION_ID not in state.chat_turn_queues
+
+@pytest.mark.asyncio
+async def test_failing_turn_does_not_stop_the_queue(turns, monkeypatch):
+    handled = []
+
+    async def flaky_handle_chat_message(session_id, client_id, user, payload, websocket):
+        handled.append(payload["text"])
+        if payload["text"] == "bad":
+            raise RuntimeError("boom")
+    monkeypatch.setattr(main, "handle_chat_message", flaky_handle_chat_message)
+    enqueue("bad")
+    enqueue("good")
+    await state.chat_turn_workers[SESSION_ID]
+    assert handled == ["bad", "good"]
@@ -0,0 +1,108 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app import state
+
+SESSION_ID = "session-1"
+
+# --- Sessions list cache ---
+
+@pytest.fixture
+def sessions_list_cache(monkeypatch):
+    monkeypatch.setattr(state, "sessions_list_cache", OrderedDict())
+    monkeypatch.setattr(state, "sessions_list_load_tasks", {})
+
+def test_cached_sessions_list_expires(sessions_list_cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state.time, "monotonic", lambda: now[0])
+    state.cache_sessions_list(1, "own", "[]")
+    assert state.get_cached_sessions_list(1, "own") == "[]"
+
+    now[0] += state.SESSIONS_LIST_CACHE_TTL_SECONDS
+    assert state.get_cached_sessions_list(1, "own") is None
+    assert not state.sessions_list_cache
+
+def test_sessions_list_cache_is_bounded(sessions_list_cache, monkeypatch):
+    monkeypatch.setattr(state, "SESSIONS_LIST_CACHE_MAX_ENTRIES", 2)
+    for user_id in (1, 2, 3):
+        state.cache_sessions_list(user_id, "own", "[]")
+    assert list(state.sessions_list_cache) == [(2, "own"), (3, "own")]
+
+def test_invalidating_one_user_keeps_the_others(sessions_list_cache):
+    state.cache_sessions_list(1, "own", "[]")
+    state.cache_sessions_list(2, "own", "[]")
+    state.invalidate_sessions_list_cache(1)
+    assert list(state.sessions_list_cache) == [(2, "own")]
+
+    state.invalidate_sessions_list_cache(None)
+    assert not state.sessions_list_cache
+
+# --- Single-flight memory loads ---
+
+@pytest.fixture
+def memory_loads(monkeypatch):
+    """Replaces the DB rebuild with one the test releases by hand; returns (release event, call count)."""
+    monkeypatch.setattr(state, "client_memory", OrderedDict())
+    monkeypatch.setattr(state, "client_history_serialised", {})
+    monkeypatch.setattr(state, "memory_load_tasks", {})
+    release = asyncio.Event()
+    calls = []
+
+    async def fake_get_memory_from_db(session_id):
+        calls.append(session_id)
+        await release.wait()
+        return [HumanMessage(content="hello")]
+    monkeypatch.setattr(state, "_get_memory_from_db", fake_get_memory_from_db)
+    return release, calls
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_memory_load(memory_loads):
+    release, calls = memory_loads
+    first = asyncio.create_task(state.get_memory_for_client(SESSION_ID))
+    second = asyncio.create_task(state.get_memory_for_client(SESSION_ID))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await first is await second
+    assert calls == [SESSION_ID]
+    assert state.client_memory[SESSION_ID] is await first
+    assert not state.memory_load_tasks
+
+@pytest.mark.asyncio
+async def test_load_invalidated_while_running_is_not_cached(memory_loads):
+    release, calls = memory_loads
+    waiting = asyncio.create_task(state.get_memory_for_client(SESSION_ID))
+    await asyncio.sleep(0)
+    state.remove_memory_for_client(SESSION_ID)
+    release.set()
+
+    assert [message.content for message in await waiting] == ["hello"]
+    assert SESSION_ID not in state.client_memory
+
+    # The next caller starts a fresh load instead of reusing the stale one.
+    await state.get_memory_for_client(SESSION_ID)
+    assert calls == [SESSION_ID, SESSION_ID]
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_shared_load(memory_loads):
+    release, calls = memory_loads
+    cancelled = asyncio.create_task(state.get_memory_for_client(SESSION_ID))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    await state.get_memory_for_client(SESSION_ID)
+    assert calls == [SESSION_ID]
+
+# --- last_accessed_at write throttle ---
+
+def test_last_accessed_cache_forgets_writes_past_the_interval(monkeypatch):
+    monkeypatch.setattr(state, "last_accessed_cache", OrderedDict())
+    state.record_last_accessed_write("old", 0.0)
+    state.record_last_accessed_write("recent", 30.0)
+    state.record_last_accessed_write("new", state.LAST_ACCESSED_WRITE_INTERVAL_SECONDS + 1)
+    assert list(state.last_accessed_cache) == ["recent", "new"]
@@ -0,0 +1,93 @@
+import asyncio
+import gzip
+import os
+
+import orjson
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketState
+
+from app import utils
+
+SCRIPT = "console.log('tesseracs');\n" * 100
+
+# --- Precompressed static files ---
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "app.js").write_text(SCRIPT)
+    (tmp_path / "tiny.js").write_text("1;")
+    return tmp_path
+
+@pytest.fixture
+def client(static_dir):
+    app = Starlette(routes=[Mount("/static", utils.PrecompressedStaticFiles(directory=static_dir))])
+    return TestClient(app)
+
+def test_precompress_writes_gzip_siblings_once(static_dir):
+    assert utils.precompress_static_files(static_dir) == 1
+    assert gzip.decompress((static_dir / "app.js.gz").read_bytes()).decode() == SCRIPT
+    # Too small to be worth compressing.
+    assert not (static_dir / "tiny.js.gz").exists()
+    # Already up to date.
+    assert utils.precompress_static_files(static_dir) == 0
+
+def test_gzip_sibling_is_served_to_clients_that_accept_it(static_dir, client):
+    utils.precompress_static_files(static_dir)
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.text == SCRIPT
+
+def test_plain_file_is_served_without_gzip_support(static_dir, client):
+    utils.precompress_static_files(static_dir)
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.text == SCRIPT
+
+def test_stale_gzip_sibling_is_ignored(static_dir, client):
+    utils.precompress_static_files(static_dir)
+    source = static_dir / "app.js"
+    source.write_text("console.log('changed');\n" * 100)
+    gz_mtime = (static_dir / "app.js.gz").stat().st_mtime
+    os.utime(source, (gz_mtime + 10, gz_mtime + 10))
+
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text.startswith("console.log('changed');")
+
+# --- WebSocket writer queues ---
+
+class FakeWebSocket:
+    client_state = WebSocketState.CONNECTED
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+@pytest.mark.asyncio
+async def test_messages_for_a_registered_socket_go_through_its_writer_queue():
+    websocket = FakeWebSocket()
+    writer_queue = asyncio.Queue()
+    utils.register_ws_writer(websocket, writer_queue)
+    try:
+        assert await utils.send_ws_message(websocket, "status", {"ok": True})
+    finally:
+        utils.unregister_ws_writer(websocket)
+
+    assert websocket.sent == []
+    assert orjson.loads(writer_queue.get_nowait()) == {"type": "status", "payload": {"ok": True}}
+
+@pytest.mark.asyncio
+async def test_unregistered_socket_is_written_directly():
+    websocket = FakeWebSocket()
+    assert await utils.send_ws_message(websocket, "status", {"ok": True})
+    assert [orjson.loads(text) for text in websocket.sent] == [{"type": "status", "payload": {"ok": True}}]